@@ -1,109 +1,84 @@
 import sys
 import os
+import json
+import gzip
+import time
 from pathlib import Path
-import shutil
+import hashlib
 import tempfile
-import platform
 from typing import List, Optional
-import io
-import numpy as np
-import matplotlib.cm as cm
-from PIL import Image
+from contextlib import asynccontextmanager
+from functools import partial
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import Response, FileResponse
+from fastapi import FastAPI, UploadFile, File, Form, Query, HTTPException, Request
+from fastapi.responses import Response, FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import uvicorn
 
-# --- NEW IMPORTS FOR TILING ---
-from rio_tiler.io import Reader
-from rio_tiler.errors import TileOutsideBounds
-
 # --- BACKEND FUNCTIONS --- 
-from utils.extract_zarr_ts import get_glacier_timeseries
+from utils.extract_zarr_ts import get_glacier_timeseries, iter_glacier_timeseries, resmooth_timeseries, request_key, ExtractionError
+from utils.stores import open_all_stores, reload_store
+from utils.basins import list_basins, get_basin_timeseries
+from utils.tile_cache import TileCache, file_version
+from utils.tiles import TIFF_PATHS, render_tile, render_data_tile, archived_tile, warm_tile_readers
+from utils.data_tiles import MEDIA_TYPE as DATA_TILE_MEDIA_TYPE, DTYPES as DATA_TILE_DTYPES
+from utils.ts_cache import TIMESERIES_CACHE, RAW_SERIES_CACHE, MASK_CACHE
+from utils.shared_cache import SHARED_CACHE
+from utils.executors import TILE_EXECUTOR, EXTRACT_EXECUTOR, ExecutorBusy, shutdown_executors
+from utils.jobs import JOBS, JOB_EXECUTOR, FINISHED
+from utils.export import iter_sites_zip
+from utils.columnar import MEDIA_TYPE as COLUMNAR_MEDIA_TYPE, wants_columnar, accepts_gzip, encode_columnar
+from utils.metrics import REGISTRY, ServerTimingMiddleware, cache_collector, executor_collector, flight_collector, timed
+from utils.singleflight import SingleFlight
 
 # --- CREDENTIALS ---
 from dotenv import load_dotenv #
 load_dotenv() # Load the variables from .env immediately
 
-# --- CONFIGURATION: TIFF PATHS (ADDED) ---
-current_os = platform.system()
-
-if current_os == "Windows":
-    base_path_gr = Path("R:/SCADI/output/Sentinel1/Greenland/mosaic/subregions/lev/multiyear/20141011_20250826")
-    base_path_ant = Path("R:/SCADI/output/Sentinel1/Antarctica/mosaic/subregions/peninsula/multiyear/20141125_20250805")
-else:
-    base_path_gr = Path("/mnt/parscratch/users/gg1bjd/SCADI/output/Sentinel1/Greenland/mosaic/subregions/lev/multiyear/20141011_20250826")
-    base_path_ant = Path("/mnt/parscratch/users/gg1bjd/SCADI/output/Sentinel1/Antarctica/mosaic/subregions/peninsula/multiyear/20141125_20250805")
-
-TIFF_PATHS = {
-    "Greenland": {
-        "speed": base_path_gr / "S_median_20141011_20250826_200m_timefiltered_cog.tif",
-        "count": base_path_gr / "perc_finite_px_20141011_20250826_200m_timefiltered_cog.tif",
-        "trend": base_path_gr.parent / "speed_linear_trend_20141017_20251224_200m_raw_smoothed_spatial3x3_sig_masked.tif"
-    },
-    "Antarctica": {
-        "speed": base_path_ant / "S_median_20141125_20250805_200m_timefiltered_cog.tif",
-        "count": base_path_ant / "perc_finite_px_20141125_20250805_200m_timefiltered_cog.tif",
-        "trend": base_path_ant.parent / "speed_linear_trend_20141201_20251227_200m_raw_smoothed_spatial3x3_sig_masked.tif"
-    }
-}
-
-
 # Get the directory where main.py is located
 current_dir = Path(__file__).resolve().parent
 
-# --- 2. DYNAMIC PALETTE LOADING ---
-PALETTE_DIR = current_dir / "palettes"
-PALETTE_FILES = {
-    "Greenland": PALETTE_DIR / "Greenland_palette.txt",
-    "Antarctica": PALETTE_DIR / "Antarctica_palette.txt"
-}
-
-def load_custom_palette(path: Path):
-    """
-    Reads ALL lines from the text file. 
-    Returns numpy array of shape (N, 3).
-    """
-    if not path.exists():
-        print(f"⚠️ Palette not found: {path}")
-        return None
-
-    colors = []
-    try:
-        with open(path, 'r') as f:
-            for line in f:
-                parts = line.strip().split()
-                if len(parts) >= 3:
-                    try:
-                        r = int(float(parts[0]))
-                        g = int(float(parts[1]))
-                        b = int(float(parts[2]))
-                        colors.append([r, g, b])
-                    except ValueError:
-                        continue
-        
-        # Convert to numpy array (N rows, 3 columns)
-        palette_arr = np.array(colors, dtype=np.uint8)
-        print(f"✅ Loaded {len(palette_arr)} colors from {path.name}")
-        return palette_arr
+# --- TILE CACHE ---
+# Memory LRU (size in MB), plus optional on-disk tiers: one shared across
+# restarts, one (SHIVER_SHARED_CACHE) shared with the other workers
+TILE_CACHE = TileCache(
+    max_bytes=int(os.getenv("SHIVER_TILE_CACHE_MB", "256")) * 1024 * 1024,
+    disk_dir=os.getenv("SHIVER_TILE_CACHE_DIR") or None,
+    shared=SHARED_CACHE
+)
+TILE_MAX_AGE = 3600 # Seconds, for tile URLs without the current ?v= version
+# Seconds a layer's file version (a stat of its TIFF) is reused before it is
+# re-read on the tile pool; tile requests never stat the mount on the event loop
+TILE_VERSION_TTL = float(os.getenv("SHIVER_TILE_VERSION_TTL", "10"))
+_LAYER_VERSIONS = {} # (region, layer_type) -> (version or None when missing, checked at)
+# Identical tile requests in flight at the same time wait for one render
+TILE_FLIGHTS = SingleFlight("tiles")
+# Identical extraction requests in flight at the same time share one (see _extract)
+TIMESERIES_FLIGHTS = SingleFlight("timeseries")
+
+# --- STREAMING ---
+# Sites extracted per batch when streaming NDJSON (bounds server memory)
+STREAM_BATCH_SIZE = int(os.getenv("SHIVER_STREAM_BATCH", "16"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open every Zarr store once, so the first map click doesn't pay for it
+    open_all_stores()
+    # Open one reader per tile layer and pull in its overviews
+    warm_tile_readers()
+    yield
+    shutdown_executors()
+    JOB_EXECUTOR.shutdown()
 
-    except Exception as e:
-        print(f"❌ Error loading palette {path.name}: {e}")
-        return None
-
-# Load Palettes
-PALETTES = {}
-for region, path in PALETTE_FILES.items():
-    PALETTES[region] = load_custom_palette(path)
-   
 # Begin
 app = FastAPI(
     title="Ice Velocity API",
     description="High-performance API for extracting glacier velocity time-series from Zarr.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # --- CONFIG: CORS ---
@@ -116,14 +91,29 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# --- CONFIG: METRICS ---
+# Per-stage timings in a Server-Timing header on every response, histograms and cache / queue gauges on /metrics
+app.add_middleware(ServerTimingMiddleware)
+
 # --- CONFIG: STATIC FILES ---
 # Mounts the 'static' folder to serve GeoJSON/CSS/JS files
 static_path = current_dir / "static"
 static_path.mkdir(exist_ok=True) # Creates it if it doesn't exist
 app.mount("/static", StaticFiles(directory=static_path), name="static")
 
+# --- CONFIG: BACKPRESSURE ---
+# A full executor queue means "come back shortly", not an ever-growing backlog
+@app.exception_handler(ExecutorBusy)
+async def executor_busy_handler(request: Request, exc: ExecutorBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"status": "error", "message": f"Server busy ({exc.name}), please retry."},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 # --- DATA MODELS (Pydantic) ---
 class RoiRequest(BaseModel):
     roi: List[List[float]]
@@ -134,153 +124,186 @@ class RoiRequest(BaseModel):
     win_raw: int = 25
     win_daily: int = 25
     poly: int = 2
+    resolution: str = "native" # or "auto": large areas may be read from overview levels
+
+class ResmoothRequest(BaseModel):
+    handles: List[str] # meta.raw_handle of previously extracted sites
+    gap_fill: int = 24
+    win_raw: int = 25
+    win_daily: int = 25
+    poly: int = 2
 
 class LoginRequest(BaseModel):
     password: str
 
+class ReloadRequest(BaseModel):
+    password: str
+    region: Optional[str] = None # None = reload every region
+
 # --- ROUTES ---
 
 @app.get("/health")
 def health_check():
     """Simple check to see if server is running."""
-    return {"status": "active", "engine": "FastAPI"}
+    return {
+        "status": "active",
+        "engine": "FastAPI",
+        "caches": {"tiles": TILE_CACHE.stats(), "timeseries": TIMESERIES_CACHE.stats(), "raw_series": RAW_SERIES_CACHE.stats(), "masks": MASK_CACHE.stats()},
+        "shared_cache": SHARED_CACHE.stats() if SHARED_CACHE is not None else None,
+        "jobs": JOBS.stats(),
+        "singleflight": {"tiles": TILE_FLIGHTS.stats(), "timeseries": TIMESERIES_FLIGHTS.stats()}
+    }
+
+
+REGISTRY.collector(cache_collector({
+    "tiles": TILE_CACHE, "timeseries": TIMESERIES_CACHE, "raw_series": RAW_SERIES_CACHE, "masks": MASK_CACHE,
+    **({"shared": SHARED_CACHE} if SHARED_CACHE is not None else {})
+}))
+REGISTRY.collector(executor_collector([TILE_EXECUTOR, EXTRACT_EXECUTOR, JOB_EXECUTOR]))
+REGISTRY.collector(flight_collector([TILE_FLIGHTS, TIMESERIES_FLIGHTS]))
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus text exposition: stage / request histograms, cache hit rates, executor queues."""
+    return Response(content=REGISTRY.expose(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 # 2D overlays
-@app.get("/api/tiles/{region}/{layer_type}/{z}/{x}/{y}.png")
-async def tile(region: str, layer_type: str, z: int, x: int, y: int):
+@app.get("/api/tiles/versions")
+def tile_versions():
     """
-    Dynamic Tile Server: Region-specific limits & Transparency rules.
+    Current version of every tile layer. The frontend puts these in the tile
+    URLs (?v=...), which lets those URLs be cached as immutable.
     """
+    versions = {}
+    for region, layers in TIFF_PATHS.items():
+        versions[region] = {}
+        for layer_type in layers:
+            versions[region][layer_type] = _stat_layer(region, layer_type)
+    return versions
+
+
+def _load_tile(key):
+    """Cache (memory + disk) -> pre-rendered archive -> live render."""
+    cached = TILE_CACHE.get(key)
+    if cached is None:
+        region, layer_type, version, z, x, y = key
+        # Pre-rendered pyramid first, live rendering beyond its zoom levels
+        content = archived_tile(region, layer_type, version, z, x, y)
+        if content is None:
+            content = render_tile(region, layer_type, z, x, y, version)
+        cached = TILE_CACHE.put(key, content)
+    return cached
+
+
+def _load_data_tile(key):
+    """Cache (memory + disk) -> live read. Keys carry "<layer>.<dtype>" as the layer."""
+    cached = TILE_CACHE.get(key)
+    if cached is None:
+        region, layer, version, z, x, y = key
+        layer_type, dtype = layer.split(".")
+        cached = TILE_CACHE.put(key, render_data_tile(region, layer_type, z, x, y, version, dtype))
+    return cached
+
+
+def _stat_layer(region, layer_type):
+    """The layer's file version (None if the file is missing), remembered for the tile routes."""
+    try:
+        version = file_version(TIFF_PATHS[region][layer_type])
+    except OSError:
+        version = None
+    _LAYER_VERSIONS[(region, layer_type)] = (version, time.monotonic())
+    return version
+
+
+async def _layer_version(region, layer_type):
+    """Current file version of a tile layer, re-read (off the event loop) at most every TILE_VERSION_TTL s."""
     if region not in TIFF_PATHS or layer_type not in TIFF_PATHS[region]:
         raise HTTPException(status_code=404, detail="Layer not found")
-    
-    file_path = TIFF_PATHS[region][layer_type]
-    
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail=f"File not found: {file_path}")
 
-    try:
-        with Reader(file_path) as cog:
-            try:
-                img = cog.tile(x, y, z)
-            except TileOutsideBounds:
-                return Response(content=Image.new('RGBA', (256, 256), (0, 0, 0, 0)).tobytes("png"), media_type="image/png")
-
-            data = img.data[0].astype('float32')
-
-            alpha_mask = np.zeros(data.shape, dtype=np.uint8)
-            
-            # --- 1. MASK CREATION ---
-            if layer_type == "speed":
-                # --- SPEED LOGIC ---
-                # Fast ice (> 20 m/yr) -> Solid Opaque
-                alpha_mask[data >= 20] = 255
-                
-                # Slow/Stagnant ice (0-20 m/yr) -> Semi-transparent
-                # This de-emphasizes noise in stable areas
-                alpha_mask[(data > 0) & (data < 20)] = 60
-                
-            elif layer_type == "trend":
-                 # Mask out NaNs or arbitrary nodata values (often -9999 or similar)
-                 # Adjust this condition if your trend file uses specific nodata values
-                alpha_mask[~np.isnan(data)] = 255
-                
-                # Make areas with a weak trend very transparent
-                alpha_mask[(data > -0.5) & (data < 0.5)] = 40
-                
-            else:
-                # --- COUNT LOGIC ---
-                # For data density, we want to see everything that exists.
-                # If we make low counts transparent, the deep purple of Viridis 
-                # will vanish against the map background.
-                alpha_mask[data > 0] = 255
-
-
-            # --- 2. DATA PROCESSING ---
-            if layer_type == "speed":
-                # --- DYNAMIC LIMITS ---
-                if region == "Antarctica":
-                    max_v = 800.0
-                else:
-                    max_v = 400.0 # Greenland default
-
-                min_v = 1.0   
-                
-                # Log Scale Logic
-                log_min = np.log10(min_v)
-                log_max = np.log10(max_v)
-
-                # Safe Log Calculation
-                safe_data = np.where(data > min_v, data, min_v)
-                log_data = np.log10(safe_data)
-                norm = (log_data - log_min) / (log_max - log_min)
-                use_custom = True
-                
-            elif layer_type == "trend":
-                # --- TREND LOGIC ---
-                # Diverging Scale: -10 to +10 m/yr^2
-                if region == "Antarctica":
-                    min_v, max_v = -15, 15
-                else:
-                    min_v, max_v = -2.5, 2.5
-
-                norm = (data - min_v) / (max_v - min_v)
-                use_custom = False # We will use matplotlib 'bwr'
-
-            else:
-                # Count Layer
-                min_v, max_v = 0, 90
-                norm = (data - min_v) / (max_v - min_v)
-                use_custom = False
-
-            norm = np.clip(norm, 0, 1)
-
-            # --- 3. COLOR PAINTING ---
-            height, width = data.shape
-            rgba_image = np.zeros((height, width, 4), dtype=np.uint8)
-
-            if use_custom:
-                current_palette = PALETTES.get(region)
-                if current_palette is None:
-                    current_palette = PALETTES.get("Greenland")
-                if current_palette is not None and len(current_palette) > 0:
-                    num_colors = len(current_palette)
-                    indices = (norm * (num_colors - 1)).astype(np.int32)
-                    rgba_image[..., 0:3] = current_palette[indices]
-                else:
-                    # Grey Fallback
-                    idx_byte = (norm * 255).astype(np.uint8)
-                    rgba_image[..., 0] = idx_byte
-                    rgba_image[..., 1] = idx_byte
-                    rgba_image[..., 2] = idx_byte
-            else:
-                if layer_type == "trend":
-                    # 'bwr' = Blue-White-Red (0=Blue, 0.5=White, 1=Red)
-                    # This matches the "positive = red" requirement
-                    cm_data = cm.bwr(norm) 
-                else:
-                    # 'viridis' for Count
-                    cm_data = cm.viridis(norm)
-                
-                # Convert to 0-255 uint8 and assign RGB channels
-                rgba_image[..., 0] = (cm_data[..., 0] * 255).astype(np.uint8)
-                rgba_image[..., 1] = (cm_data[..., 1] * 255).astype(np.uint8)
-                rgba_image[..., 2] = (cm_data[..., 2] * 255).astype(np.uint8)
-
-            # --- 4. APPLY MASK ---
-            rgba_image[..., 3] = alpha_mask
-
-            # 5. Save
-            pil_img = Image.fromarray(rgba_image)
-            buf = io.BytesIO()
-            pil_img.save(buf, format="PNG")
-            
-            return Response(content=buf.getvalue(), media_type="image/png")
-            
-    except Exception as e:
-        print(f"Tile Error: {e}")
-        raise HTTPException(status_code=500, detail=f"Tile error: {str(e)}")
+    entry = _LAYER_VERSIONS.get((region, layer_type))
+    if entry is not None and time.monotonic() - entry[1] <= TILE_VERSION_TTL:
+        version = entry[0]
+    else:
+        version = await TILE_FLIGHTS.do_async(("version", region, layer_type), TILE_EXECUTOR.run, _stat_layer, region, layer_type)
+
+    if version is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {TIFF_PATHS[region][layer_type]}")
+    return version
+
+
+async def _tile_response(request, key, loader, v, media_type, gzipped=False):
+    """
+    Cached tile content with ETag / Cache-Control (304 when the client's copy
+    is current). gzipped content is sent with Content-Encoding: gzip to
+    clients that accept it and decompressed for the rest.
+    """
+    # Memory hits are answered here; anything that may touch disk or GDAL
+    # runs on the bounded tile pool, off the event loop, once per key however
+    # many requests for it arrive meanwhile
+    cached = TILE_CACHE.peek(key)
+    if cached is None:
+        try:
+            cached = await TILE_FLIGHTS.do_async(key, TILE_EXECUTOR.run, loader, key)
+        except ExecutorBusy:
+            raise
+        except Exception as e:
+            print(f"Tile Error: {e}")
+            raise HTTPException(status_code=500, detail=f"Tile error: {str(e)}")
+    content, etag = cached
+
+    # A URL carrying the current version never changes content; anything else
+    # gets a shorter lifetime and is revalidated with the ETag.
+    version = key[2]
+    if v == version:
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        cache_control = f"public, max-age={TILE_MAX_AGE}"
+    headers = {"Cache-Control": cache_control}
+    decompress = False
+    if gzipped:
+        # The plain body is a different representation, so it gets its own ETag
+        headers["Vary"] = "Accept-Encoding"
+        decompress = not accepts_gzip(request.headers.get("accept-encoding"))
+        if decompress:
+            etag = etag[:-1] + '-identity"'
+    headers["ETag"] = etag
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    if decompress:
+        content = gzip.decompress(content)
+    elif gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+@app.get("/api/tiles/{region}/{layer_type}/{z}/{x}/{y}.png")
+async def tile(request: Request, region: str, layer_type: str, z: int, x: int, y: int, v: Optional[str] = None):
+    """
+    Dynamic Tile Server: Region-specific limits & Transparency rules.
+    Rendered tiles are cached per source-file version and served with ETags.
+    """
+    version = await _layer_version(region, layer_type)
+    key = (region, layer_type, version, z, x, y)
+    return await _tile_response(request, key, _load_tile, v, "image/png")
+
+
+@app.get("/api/tiles/{region}/{layer_type}/{z}/{x}/{y}.bin")
+async def data_tile(request: Request, region: str, layer_type: str, z: int, x: int, y: int,
+                    v: Optional[str] = None, dtype: str = "uint16"):
+    """
+    Raw layer values of a tile, quantized to uint16 (scale/offset) or float16,
+    for client-side styling (layout in utils/data_tiles.py). Same caching,
+    versioning and ETags as the PNG tiles.
+    """
+    if dtype not in DATA_TILE_DTYPES:
+        raise HTTPException(status_code=400, detail=f"dtype must be one of: {', '.join(DATA_TILE_DTYPES)}")
+    version = await _layer_version(region, layer_type)
+    key = (region, f"{layer_type}.{dtype}", version, z, x, y)
+    return await _tile_response(request, key, _load_data_tile, v, DATA_TILE_MEDIA_TYPE, gzipped=True)
         
 
     
@@ -301,32 +324,285 @@ def authenticate(payload: LoginRequest):
     else:
         raise HTTPException(status_code=401, detail="Incorrect password")
 
+@app.post("/api/stores/reload")
+def reload_stores(payload: ReloadRequest):
+    """
+    Re-opens the Zarr store(s) after they have been rewritten on disk, and
+    forgets the remembered tile file versions.
+    """
+    secret = os.getenv("SHIVER_PASSWORD")
+    if not secret or payload.password != secret:
+        raise HTTPException(status_code=401, detail="Incorrect password")
+
+    status = reload_store(payload.region)
+    _LAYER_VERSIONS.clear() # Tile layers are re-read on their next request too
+    print(f"🔄 Store reload: {status}")
+    return {"status": "success", "stores": status}
+
+def _wants_ndjson(request: Request, stream: bool):
+    """Streaming is selected with ?stream=true or 'Accept: application/x-ndjson'."""
+    return stream or "application/x-ndjson" in request.headers.get("accept", "")
+
+
+def _save_upload(file, chunk_size=1024 * 1024):
+    """
+    Copies an upload to a temp file with the same suffix, hashing it on the
+    way (the key identical uploads are coalesced on). Blocking: run it off
+    the event loop. Returns (path, hex digest).
+    """
+    suffix = os.path.splitext(file.filename)[1]
+    digest = hashlib.blake2b()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        while chunk := file.file.read(chunk_size):
+            digest.update(chunk)
+            tmp.write(chunk)
+    return tmp.name, digest.hexdigest()
+
+
+def _remove_temp_file(path):
+    if os.path.exists(path):
+        try: os.remove(path)
+        except PermissionError: pass
+
+
+async def _ndjson_lines(sites, cleanup=None):
+    """
+    One JSON line per site as it finishes ({"type": "site", "name", "result"}),
+    then a summary line ({"type": "summary", ...}).
+    """
+    t0 = time.time()
+    n_sites = n_success = 0
+    status, message = "success", None
+    try:
+        async for site_name, site_data in sites:
+            n_sites += 1
+            if site_data.get("status") == "success": n_success += 1
+            yield json.dumps({"type": "site", "name": site_name, "result": site_data}) + "\n"
+    except ExtractionError as e:
+        status, message = "error", str(e)
+    except Exception as e:
+        print(f"❌ Stream Error: {str(e)}")
+        status, message = "error", str(e)
+    finally:
+        if cleanup: cleanup()
+
+    summary = {
+        "type": "summary",
+        "status": status,
+        "sites": n_sites,
+        "succeeded": n_success,
+        "failed": n_sites - n_success,
+        "elapsed_s": round(time.time() - t0, 2)
+    }
+    if message: summary["message"] = message
+    yield json.dumps(summary) + "\n"
+
+
+def _encode_columnar(results, compress):
+    with timed("serialize"):
+        return encode_columnar(results, compress=compress)
+
+
+async def _columnar_response(results, request):
+    """
+    Binary columnar encoding (utils/columnar.py), negotiated via Accept;
+    gzip-compressed only for clients whose Accept-Encoding allows it.
+    """
+    compress = accepts_gzip(request.headers.get("accept-encoding"))
+    content = await EXTRACT_EXECUTOR.run(_encode_columnar, results, compress)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=content, media_type=COLUMNAR_MEDIA_TYPE, headers=headers)
+
+
+async def _extract(location_input, columnar=False, cleanup=None, file_digest=None, **params):
+    """
+    get_glacier_timeseries on the extraction pool. Identical requests running
+    at the same time share one extraction, coalesced here on the event loop
+    so waiting requests don't hold extraction slots. Uploaded files are
+    coalesced on file_digest (see _save_upload). cleanup (removing an
+    upload's temp file) runs once nothing reads location_input any more: when
+    the shared extraction ends if this request started it, else right away.
+    """
+    async def run_and_cleanup():
+        try:
+            return await EXTRACT_EXECUTOR.run(get_glacier_timeseries, location_input, columnar=columnar, **params)
+        finally:
+            if cleanup: cleanup()
+
+    started = False
+    def start():
+        nonlocal started
+        started = True
+        return run_and_cleanup()
+
+    try:
+        key = request_key(location_input, dict(params, columnar=columnar), file_digest)
+        if key is None:
+            return await start()
+        # The outer dict is this request's own; the site dicts are shared read-only
+        return dict(await TIMESERIES_FLIGHTS.do_async(key, start))
+    finally:
+        if cleanup and not started: cleanup()
+
+
+def _export_zip(location_input, cleanup=None, **params):
+    """Extraction straight into ZIP chunks (one CSV per site), run on the extraction pool."""
+    try:
+        sites = iter_glacier_timeseries(location_input, batch_size=STREAM_BATCH_SIZE, **params)
+        yield from iter_sites_zip(sites)
+    finally:
+        if cleanup: cleanup()
+
+
+async def _zip_response(chunks):
+    """
+    Streams ZIP chunks to the client. The first chunk is awaited before
+    answering, so request-level failures still get a proper error status.
+    """
+    try:
+        first = await chunks.__anext__()
+    except ExtractionError as e:
+        return JSONResponse(status_code=400, content={"status": "error", "message": str(e)})
+    except Exception as e:
+        print(f"❌ Export Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def body():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(
+        body(),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="velocity_data_batch.zip"'}
+    )
+
+
 @app.post("/api/timeseries/json")
-def extract_from_json(payload: RoiRequest):
+async def extract_from_json(payload: RoiRequest, request: Request, stream: bool = False):
     """
     Extracts time series for coordinates provided in JSON body.
+    With ?stream=true (or Accept: application/x-ndjson) sites are streamed
+    back as NDJSON as they finish.
     """
     print(f"JSON Request | Pts: {len(payload.roi)} | Buf: {payload.buffer} | Vars: {payload.variables} | Qual: {payload.quality}")
+    params = dict(
+        buffer=payload.buffer,
+        variables=payload.variables,
+        quality=payload.quality,
+        # Pass new params
+        gap_fill=payload.gap_fill,
+        win_raw=payload.win_raw,
+        win_daily=payload.win_daily,
+        poly=payload.poly,
+        resolution=payload.resolution
+    )
+    if _wants_ndjson(request, stream):
+        sites = EXTRACT_EXECUTOR.stream(iter_glacier_timeseries, payload.roi, batch_size=STREAM_BATCH_SIZE, **params)
+        return StreamingResponse(_ndjson_lines(sites), media_type="application/x-ndjson")
+
+    columnar = wants_columnar(request.headers.get("accept"))
     try:
-        results = get_glacier_timeseries(
-            location_input=payload.roi,
-            buffer=payload.buffer,
-            variables=payload.variables,
-            quality=payload.quality,
-            # Pass new params
+        results = await _extract(payload.roi, columnar=columnar, **params)
+        if columnar and "error" not in results:
+            return await _columnar_response(results, request)
+        return results
+    except ExecutorBusy:
+        raise
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/timeseries/resmooth")
+async def resmooth_from_handles(payload: ResmoothRequest, request: Request):
+    """
+    Re-smooths already extracted sites with new parameters, without
+    re-reading the data store. Results are keyed by handle.
+    """
+    print(f"Resmooth Request | Sites: {len(payload.handles)} | Gap: {payload.gap_fill} | Win: {payload.win_raw}/{payload.win_daily} | Poly: {payload.poly}")
+    columnar = wants_columnar(request.headers.get("accept"))
+    try:
+        results = await EXTRACT_EXECUTOR.run(
+            resmooth_timeseries,
+            payload.handles,
             gap_fill=payload.gap_fill,
             win_raw=payload.win_raw,
             win_daily=payload.win_daily,
-            poly=payload.poly
+            poly=payload.poly,
+            columnar=columnar
         )
+        if columnar:
+            return await _columnar_response(results, request)
         return results
+    except ExecutorBusy:
+        raise
     except Exception as e:
         print(f"❌ Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/timeseries/upload")
+@app.post("/api/timeseries/export")
+async def export_from_json(payload: RoiRequest):
+    """
+    Same inputs as /api/timeseries/json, streamed back as a ZIP with one CSV
+    per site (written as each site finishes) plus sites.geojson.
+    """
+    print(f"Export Request | Pts: {len(payload.roi)} | Buf: {payload.buffer} | Vars: {payload.variables} | Qual: {payload.quality}")
+    chunks = EXTRACT_EXECUTOR.stream(
+        _export_zip, payload.roi,
+        buffer=payload.buffer,
+        variables=payload.variables,
+        quality=payload.quality,
+        gap_fill=payload.gap_fill,
+        win_raw=payload.win_raw,
+        win_daily=payload.win_daily,
+        poly=payload.poly,
+        resolution=payload.resolution
+    )
+    return await _zip_response(chunks)
+
+
+@app.post("/api/timeseries/export/upload")
+async def export_from_upload(
+    file: UploadFile = File(...),
+    buffer: float = Form(500),
+    variables: List[str] = Form(["s"]),
+    quality: List[str] = Form(["filt"]),
+    gap_fill: int = Form(24),
+    win_raw: int = Form(25),
+    win_daily: int = Form(25),
+    poly: int = Form(2),
+    resolution: str = Form("native")
+):
+    """Same inputs as /api/timeseries/upload, streamed back as a ZIP of CSVs."""
+    tmp_path, _ = await run_in_threadpool(_save_upload, file)
+
+    print(f"Export Upload: {tmp_path} | Buf: {buffer}")
+    try:
+        chunks = EXTRACT_EXECUTOR.stream(
+            _export_zip, tmp_path, cleanup=partial(_remove_temp_file, tmp_path),
+            buffer=buffer, variables=variables, quality=quality,
+            gap_fill=gap_fill, win_raw=win_raw, win_daily=win_daily, poly=poly, resolution=resolution
+        )
+    except ExecutorBusy:
+        _remove_temp_file(tmp_path)
+        raise
+    return await _zip_response(chunks)
+
+
+@app.post("/api/timeseries/upload", responses={
+    202: {"description": (
+        "With ?job=true: the job was queued; poll /api/jobs/{job_id}. Jobs live in the "
+        "worker process that accepted them, so with several workers /api/jobs/* must "
+        "reach that same worker (single worker or sticky sessions, see utils/jobs.py)."
+    )}
+})
 async def upload_shapefile(
+    request: Request,
     file: UploadFile = File(...), 
     buffer: float = Form(500),
     variables: List[str] = Form(["s"]),
@@ -335,30 +611,148 @@ async def upload_shapefile(
     gap_fill: int = Form(24),
     win_raw: int = Form(25),
     win_daily: int = Form(25),
-    poly: int = Form(2)
+    poly: int = Form(2),
+    resolution: str = Form("native"),
+    stream: bool = False,
+    job: bool = False
 ):
-    suffix = os.path.splitext(file.filename)[1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        shutil.copyfileobj(file.file, tmp)
-        tmp_path = tmp.name
+    """
+    Extracts time series for the sites in an uploaded file. With ?stream=true
+    sites are streamed back as NDJSON; with ?job=true the extraction runs as a
+    background job and the response is 202 with its id (worker-local, see
+    utils/jobs.py).
+    """
+    tmp_path, digest = await run_in_threadpool(_save_upload, file)
+
+    params = dict(
+        buffer=buffer, 
+        variables=variables, 
+        quality=quality,
+        gap_fill=gap_fill, win_raw=win_raw, win_daily=win_daily, poly=poly, resolution=resolution
+    )
+    if job:
+        # Background job: answer with its id straight away, see /api/jobs/{job_id}
+        print(f"File Upload (job): {tmp_path} | Buf: {buffer}")
+        try:
+            new_job = JOBS.submit(tmp_path, params, cleanup=partial(_remove_temp_file, tmp_path))
+        except ExecutorBusy:
+            _remove_temp_file(tmp_path)
+            raise
+        return JSONResponse(status_code=202, content=new_job.to_dict())
+
+    if _wants_ndjson(request, stream):
+        print(f"File Upload (stream): {tmp_path} | Buf: {buffer}")
+        try:
+            sites = EXTRACT_EXECUTOR.stream(iter_glacier_timeseries, tmp_path, batch_size=STREAM_BATCH_SIZE, **params)
+        except ExecutorBusy:
+            _remove_temp_file(tmp_path)
+            raise
+        # The temp file is needed until the last site is out
+        return StreamingResponse(
+            _ndjson_lines(sites, cleanup=partial(_remove_temp_file, tmp_path)),
+            media_type="application/x-ndjson"
+        )
 
+    columnar = wants_columnar(request.headers.get("accept"))
     try:
         print(f"File Upload: {tmp_path} | Buf: {buffer}")
-        results = get_glacier_timeseries(
-            tmp_path, 
-            buffer=buffer, 
-            variables=variables, 
-            quality=quality,
-            gap_fill=gap_fill, win_raw=win_raw, win_daily=win_daily, poly=poly
-        )
+        results = await _extract(tmp_path, columnar=columnar, cleanup=partial(_remove_temp_file, tmp_path), file_digest=digest, **params)
+        if columnar and "error" not in results:
+            return await _columnar_response(results, request)
         return results
+    except ExecutorBusy:
+        raise
     except Exception as e:
         print(f"Error processing file: {e}")
         return {"status": "error", "message": str(e)}
-    finally:
-        if os.path.exists(tmp_path):
-            try: os.remove(tmp_path)
-            except PermissionError: pass
+
+# --- BACKGROUND JOBS ---
+def _get_job(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found (it may have expired, or been started by another server worker)")
+    return job
+
+
+def _finished_job(job_id):
+    job = _get_job(job_id)
+    if job.status not in FINISHED:
+        raise HTTPException(status_code=409, detail=f"Job is still {job.status}")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+def job_status(job_id: str):
+    """Status and per-site progress of a background extraction job."""
+    return _get_job(job_id).to_dict()
+
+
+@app.delete("/api/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancels a job; sites already extracted stay available."""
+    job = _get_job(job_id)
+    job.cancel()
+    return job.to_dict()
+
+
+@app.get("/api/jobs/{job_id}/results")
+def job_results(job_id: str):
+    """Results of a finished job, in the same shape as /api/timeseries/upload."""
+    return _finished_job(job_id).results
+
+
+@app.get("/api/jobs/{job_id}/results.zip")
+def job_results_zip(job_id: str):
+    """Results of a finished job as a ZIP with one CSV per site."""
+    job = _finished_job(job_id)
+    return StreamingResponse(
+        iter_sites_zip(list(job.results.items())),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="velocity_data_{job_id[:8]}.zip"'}
+    )
+
+
+# --- BASINS ---
+@app.get("/api/basins")
+def basins_index():
+    """Basins with pre-computed time series (see utils/build_basin_store.py)."""
+    try:
+        return {"status": "success", "basins": list_basins()}
+    except ExtractionError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@app.get("/api/basins/{basin_id}")
+async def basin_timeseries(
+    basin_id: str,
+    request: Request,
+    variables: List[str] = Query(["s"]),
+    quality: List[str] = Query(["filt"]),
+    gap_fill: int = 24,
+    win_raw: int = 25,
+    win_daily: int = 25,
+    poly: int = 2
+):
+    """
+    Time series of one basin from the pre-computed basin store, in the same
+    shape as /api/timeseries/json. No polygon extraction is done.
+    """
+    columnar = wants_columnar(request.headers.get("accept"))
+    try:
+        results = await EXTRACT_EXECUTOR.run(
+            get_basin_timeseries, basin_id,
+            variables=variables, quality=quality,
+            gap_fill=gap_fill, win_raw=win_raw, win_daily=win_daily, poly=poly,
+            columnar=columnar
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown basin: {basin_id}")
+    except ExtractionError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if columnar:
+        return await _columnar_response(results, request)
+    return results
+
 
 if __name__ == "__main__":
     print("🚀 FastAPI Server starting on http://localhost:8000")
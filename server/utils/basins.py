@@ -0,0 +1,233 @@
+"""
+Pre-computed time series for the named glacier basins drawn on the
+Antarctic map (static/apbasinoutlines.geojson).
+
+utils/build_basin_store.py rasterizes every basin onto the store grid and
+writes its masked per-date medians and valid-pixel counts, for every
+variable and quality, to <store>_basins.zarr (dims basin x time, one chunk
+per basin and variable). Serving a basin is then a fixed-size read plus the
+usual smoothing stage, however large the basin.
+"""
+import os
+import hashlib
+import threading
+from pathlib import Path
+
+import numpy as np
+import geopandas as gpd
+import xarray as xr
+
+from .stores import DATA_STORES, basins_path, get_store, store_version
+from .extract_zarr_ts import BASE_VARS, ExtractionError, _prepare_raw_series, _smooth_raw_series, _site_payload
+from .ts_cache import TIMESERIES_CACHE, RAW_SERIES_CACHE
+from .metrics import timed
+
+BASIN_REGION = os.getenv("SHIVER_BASIN_REGION", "Antarctica")
+BASIN_OUTLINES = Path(os.getenv(
+    "SHIVER_BASIN_OUTLINES",
+    str(Path(__file__).resolve().parent.parent / "static" / "apbasinoutlines.geojson")
+))
+
+# Feature properties tried, in order, as the basin id (positions are used otherwise)
+ID_COLUMNS = ('basin_id', 'id', 'ID', 'fid')
+
+
+def basin_store_path(region=BASIN_REGION):
+    info = DATA_STORES[region]
+    return Path(info.get('basins_path') or basins_path(info['path']))
+
+
+def load_outlines(path=None):
+    """Basin outlines as a GeoDataFrame in EPSG:4326 with 'basin_id' and 'name' columns."""
+    gdf = gpd.read_file(path or BASIN_OUTLINES)
+    if gdf.crs is not None:
+        gdf = gdf.to_crs("EPSG:4326")
+
+    ids = None
+    for col in ID_COLUMNS:
+        if col in gdf.columns and gdf[col].notna().all() and gdf[col].is_unique:
+            ids = gdf[col].astype(str).values
+            break
+    if ids is None:
+        ids = np.array([str(i) for i in range(len(gdf))])
+
+    names = gdf['name'].fillna('').astype(str).values if 'name' in gdf.columns else np.full(len(gdf), '')
+    return gpd.GeoDataFrame({'basin_id': ids, 'name': names}, geometry=gdf.geometry.values, crs="EPSG:4326")
+
+
+def basin_display_name(basin_id, name):
+    return name if name and name != 'n/a' else f"Basin_{basin_id}"
+
+
+class BasinStore:
+    """
+    An open basin store, valid for one version of the region's Zarr store.
+    Basin ids map to row positions, so a lookup is a dict access plus one
+    chunk per variable.
+    """
+
+    def __init__(self, path, source):
+        self.path = Path(path)
+        self.source = source
+        self.version = store_version(self.path)
+        self.ds = xr.open_zarr(self.path, consolidated=True)
+
+        self.ids = [str(v) for v in self.ds['basin'].values.tolist()]
+        self.index = {basin_id: i for i, basin_id in enumerate(self.ids)}
+        self.names = [str(v) for v in self.ds['name'].values.tolist()]
+        self.lat = self.ds['lat'].values
+        self.lon = self.ds['lon'].values
+        self.n_pixels = self.ds['n_pixels'].values
+
+        self.spatial = [name for name, var in self.ds.data_vars.items()
+                        if var.dims == ('basin', 'time') and not name.endswith('_count')]
+        # Time-only variables are the same for every basin: load them once
+        time_only = [name for name, var in self.ds.data_vars.items() if var.dims == ('time',)]
+        self.time_only = self.ds[time_only].to_dataframe()
+
+    def describe(self, position):
+        return {
+            "id": self.ids[position],
+            "name": basin_display_name(self.ids[position], self.names[position]),
+            "lat": round(float(self.lat[position]), 5),
+            "lon": round(float(self.lon[position]), 5),
+            "n_pixels": int(self.n_pixels[position]),
+        }
+
+    def raw_frame(self, position, target_keys):
+        """
+        The per-date table for one basin, in the same shape as a live
+        masked extraction (requested keys, BASE_VARS and 'valid_count').
+        """
+        missing = [k for k in target_keys if k not in self.spatial]
+        if missing:
+            raise KeyError(f"Not in basin store: {', '.join(missing)}")
+
+        count_col = target_keys[0] if target_keys else 's_filt'
+        names = list(set(target_keys + ([count_col] if count_col in self.spatial else [])))
+        row = self.ds[names + [f"{name}_count" for name in names]].isel(basin=position).load()
+
+        df = self.time_only[[c for c in BASE_VARS if c in self.time_only.columns]].copy()
+        for key in target_keys:
+            df[key] = row[key].values
+        if count_col in self.spatial:
+            df['valid_count'] = row[f"{count_col}_count"].values.astype(np.int64)
+        else:
+            df['valid_count'] = df['time_separation'].notnull().astype(np.int64)
+        return df
+
+
+_BASINS = {"source": None, "version": None, "store": None}
+_BASINS_LOCK = threading.Lock()
+
+
+def get_basin_store(region=BASIN_REGION):
+    """
+    The open BasinStore, or None when it hasn't been built or was built from
+    another version of the Zarr store. Re-opened after a store reload or a
+    rebuild.
+    """
+    source = get_store(region)
+    path = basin_store_path(region)
+    version = store_version(path) if path.exists() else None
+
+    with _BASINS_LOCK:
+        if _BASINS["source"] is source and _BASINS["version"] == version:
+            return _BASINS["store"]
+
+        basins = None
+        if version is not None:
+            try:
+                candidate = BasinStore(path, source)
+                attrs = candidate.ds.attrs
+                if attrs.get('source_version') == source.version and attrs.get('complete'):
+                    basins = candidate
+                else:
+                    print(f"⚠️ {region} basin store is stale or incomplete, rebuild it with: python -m utils.build_basin_store")
+            except Exception as e:
+                print(f"⚠️ Could not open {region} basin store: {e}")
+
+        _BASINS.update(source=source, version=version, store=basins)
+        return basins
+
+
+def list_basins(region=BASIN_REGION):
+    basins = get_basin_store(region)
+    if basins is None:
+        raise ExtractionError("Basin time series have not been built for the current data.")
+    return [basins.describe(i) for i in range(len(basins.ids))]
+
+
+def get_basin_timeseries(
+    basin_id,
+    variables=['s'],
+    quality=['filt'],
+    gap_fill=24,
+    win_raw=25,
+    win_daily=25,
+    poly=2,
+    columnar=False,
+    region=BASIN_REGION
+):
+    """
+    One basin's time series from the basin store, in the same shape as
+    get_glacier_timeseries ({name: site_data}). Raises ExtractionError when
+    the store isn't available and KeyError for an unknown basin id.
+    """
+    with timed("open"):
+        basins = get_basin_store(region)
+    if basins is None:
+        raise ExtractionError("Basin time series have not been built for the current data.")
+    position = basins.index[str(basin_id)]
+    info = basins.describe(position)
+
+    target_keys = [f"{v}_{q}" for v in variables for q in quality]
+    raw_params = (tuple(variables), tuple(quality))
+    smoothing = (gap_fill, win_raw, win_daily, poly)
+    key = repr(('basin', region, basins.source.version, basins.version, info["id"]) + raw_params)
+    handle = hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+
+    # Same two cache levels as a live extraction, so /api/timeseries/resmooth works too
+    site_data = TIMESERIES_CACHE.get((handle,) + smoothing)
+    if site_data is None:
+        raw_df = RAW_SERIES_CACHE.get(handle)
+        if raw_df is None:
+            if info["n_pixels"] == 0:
+                raw_df = {"status": "error", "message": "Location outside data coverage."}
+            else:
+                try:
+                    with timed("select"):
+                        frame = basins.raw_frame(position, target_keys)
+                    with timed("median"):
+                        raw_df = _prepare_raw_series(frame, target_keys)
+                except KeyError as e:
+                    raw_df = {"status": "error", "message": f"Basin read failed: {e}"}
+                if not isinstance(raw_df, dict):
+                    RAW_SERIES_CACHE.put(handle, raw_df)
+
+        if isinstance(raw_df, dict):
+            site_data = raw_df
+        else:
+            with timed("smooth"):
+                site_data = _smooth_raw_series(
+                    raw_df, target_keys=target_keys,
+                    gap_fill=gap_fill, win_raw=win_raw, win_daily=win_daily, poly=poly
+                )
+            TIMESERIES_CACHE.put((handle,) + smoothing, site_data)
+
+    meta = {
+        "site_name": info["name"],
+        "basin_id": info["id"],
+        "region": region,
+        "buffer_used": 0,
+        "lat": info["lat"],
+        "lon": info["lon"],
+        "type": "Polygon",
+        "variables": variables,
+        "quality": quality,
+        "params": { "gap": gap_fill, "win_raw": win_raw, "win_daily": win_daily, "poly": poly }
+    }
+    if site_data.get("status") == "success":
+        meta["raw_handle"] = handle
+    with timed("serialize"):
+        return {info["name"]: _site_payload(dict(site_data, meta=meta), columnar)}
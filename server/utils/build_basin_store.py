@@ -0,0 +1,139 @@
+"""
+Builds the basin time-series store (see utils/basins.py): the masked median
+series of every basin in the outline GeoJSON, for every variable and
+quality in the region's date_pair.zarr.
+
+Run from the server directory:
+    python -m utils.build_basin_store
+    python -m utils.build_basin_store --outlines static/apbasinoutlines.geojson --force
+
+Re-running against an unchanged store and outline file does nothing. After
+the Zarr store is rewritten, run it again: until then the server reports the
+basin store as stale and /api/basins answers 404.
+"""
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import shapely
+import dask.array as da
+import xarray as xr
+import zarr
+
+from .stores import DATA_STORES, get_store, store_version
+from .extract_zarr_ts import _plan_site, _choose_reader
+from .spatial_median import blockwise_spatial_median
+from .basins import BASIN_REGION, BASIN_OUTLINES, basin_store_path, load_outlines
+
+
+def _pixels(plan):
+    """Positional (iy, ix) arrays of a planned site (mask or single pixel)."""
+    if plan['kind'] == 'mask':
+        return plan['iy'], plan['ix']
+    return np.array([plan['iy']]), np.array([plan['ix']])
+
+
+def _create_template(ds, out_path, basins, plans, spatial, time_only, zarr_format):
+    n_basins, n_time = len(basins), ds.sizes['time']
+    data_vars = {}
+    for name in spatial:
+        data_vars[name] = (('basin', 'time'), da.full((n_basins, n_time), np.nan, dtype=ds[name].dtype, chunks=(1, n_time)))
+        data_vars[f"{name}_count"] = (('basin', 'time'), da.zeros((n_basins, n_time), dtype='int32', chunks=(1, n_time)))
+    for name in time_only:
+        data_vars[name] = ds[name].load()
+
+    centroids = shapely.centroid(basins.geometry.values)
+    template = xr.Dataset(data_vars, coords={
+        'basin': basins['basin_id'].values.astype(str),
+        'time': ds['time'].values,
+        'name': ('basin', basins['name'].values.astype(str)),
+        'lat': ('basin', shapely.get_y(centroids)),
+        'lon': ('basin', shapely.get_x(centroids)),
+        'n_pixels': ('basin', np.array([0 if 'status' in plan else len(_pixels(plan)[0]) for plan in plans], dtype='int64')),
+    })
+    template.attrs.update({'complete': False})
+    template.to_zarr(out_path, mode='w', compute=False, consolidated=True, zarr_format=zarr_format)
+    # Coordinates and time-only variables are small: write them now
+    template.drop_vars([f"{name}{suffix}" for name in spatial for suffix in ("", "_count")]).to_zarr(
+        out_path, region={'basin': slice(None), 'time': slice(None)}
+    )
+
+
+def build_basin_store(region=BASIN_REGION, outlines=None, force=False):
+    outlines = outlines or BASIN_OUTLINES
+    src_path = DATA_STORES[region]['path']
+    out_path = basin_store_path(region)
+
+    if not src_path.exists():
+        print(f"⚠️ Skipping {region}: {src_path} not found")
+        return None
+    if not outlines.exists():
+        print(f"⚠️ Skipping {region}: {outlines} not found")
+        return None
+
+    store = get_store(region)
+    outlines_version = store_version(outlines)
+    if not force and out_path.exists():
+        try:
+            attrs = xr.open_zarr(out_path, consolidated=True).attrs
+            if (attrs.get('source_version') == store.version and attrs.get('outlines_version') == outlines_version
+                    and attrs.get('complete')):
+                print(f"✅ {region}: {out_path.name} is up to date")
+                return out_path
+        except Exception:
+            pass
+
+    ds = store.ds
+    spatial = [name for name, var in ds.data_vars.items() if set(var.dims) == {'time', 'y', 'x'}]
+    time_only = [name for name, var in ds.data_vars.items() if var.dims == ('time',)]
+
+    basins = load_outlines(outlines)
+    proj_geoms = store.grid.project(basins.geometry.values)
+    plans = [_plan_site(store, geom, 0) for geom in proj_geoms]
+
+    zarr_format = zarr.open_group(str(src_path), mode='r').metadata.zarr_format
+    _create_template(ds, out_path, basins, plans, spatial, time_only, zarr_format)
+
+    print(f"🧱 {region}: {len(basins)} basins, {len(spatial)} variables, {ds.sizes['time']} time steps -> {out_path.name}")
+    t0 = time.time()
+    for i, plan in enumerate(plans):
+        if 'status' in plan:
+            print(f"   {basins['basin_id'].iloc[i]}: {plan['message']}")
+            continue
+
+        # Same masked pixels and reducers as a live extraction of the outline
+        iy, ix = _pixels(plan)
+        # Block by block along time, so continent-sized basins stay within the median memory budget
+        reader = _choose_reader(store, plan)
+        indexers = {'y': xr.DataArray(iy, dims='pixel'), 'x': xr.DataArray(ix, dims='pixel')}
+        medians, counts = blockwise_spatial_median(reader.source, reader.time_order, spatial, spatial, indexers, ['pixel'])
+
+        block = medians.drop_vars(['time', 'x', 'y'], errors='ignore')
+        for name in spatial:
+            block[f"{name}_count"] = counts[name].astype('int32').drop_vars(['time', 'x', 'y'], errors='ignore')
+        block.expand_dims(basin=1).to_zarr(out_path, region={'basin': slice(i, i + 1), 'time': slice(None)})
+
+        if (i + 1) % 10 == 0 or i + 1 == len(plans):
+            print(f"   {i + 1}/{len(plans)} basins ({time.time() - t0:.0f}s)")
+
+    group = zarr.open_group(str(out_path), mode='r+')
+    group.attrs.update({'source_version': store.version, 'outlines_version': outlines_version, 'complete': True})
+    zarr.consolidate_metadata(str(out_path))
+
+    print(f"✅ {region}: basin store built in {time.time() - t0:.0f}s")
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-compute the time series of every basin outline.")
+    parser.add_argument("--region", default=BASIN_REGION, choices=list(DATA_STORES), help=f"Region of the outlines (default: {BASIN_REGION})")
+    parser.add_argument("--outlines", type=Path, default=None, help="Basin outline GeoJSON (default: static/apbasinoutlines.geojson)")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if up to date")
+    args = parser.parse_args()
+
+    build_basin_store(args.region, args.outlines, args.force)
+
+
+if __name__ == "__main__":
+    main()
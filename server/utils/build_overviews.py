@@ -0,0 +1,163 @@
+"""
+Builds the overview levels of each region's date_pair.zarr.
+
+A level with factor f holds, for every date and every f x f block of store
+pixels (a "cell"), the median of each spatial variable over the block and
+its number of valid pixels (<var>_count). At 200 m pixels the default
+factors 5 and 25 give 1 km and 5 km levels. Large-area requests made with
+resolution='auto' are answered from the coarsest level whose cells still
+trace the requested area closely enough (see _plan_overview in
+utils/extract_zarr_ts.py).
+
+Run from the server directory:
+    python -m utils.build_overviews
+    python -m utils.build_overviews --region Greenland --factor 5 --factor 25 --memory-mb 1024
+
+Levels are written in the store's on-disk time order, one spatial block of
+cells and a few time chunks at a time, so each source chunk is read once per
+block. Re-running against an unchanged store does nothing; after the store
+is rewritten the levels are rebuilt (until then the server ignores them).
+"""
+import time
+import argparse
+import warnings
+
+import numpy as np
+import dask.array as da
+import xarray as xr
+import zarr
+
+from .stores import DATA_STORES, OVERVIEW_FACTORS, overview_path, store_version
+from .spatial_median import time_blocks
+
+# Side of an output chunk in store pixels (rounded to whole cells); the
+# builder reads one such block, all variables, a few time chunks at a time
+BLOCK_PIXELS = 256
+
+
+def _cell_coords(values, factor):
+    """Cell centres along one axis: the mean of the pixel coordinates in each cell."""
+    n_cells = -(-len(values) // factor)
+    padded = np.full(n_cells * factor, np.nan)
+    padded[:len(values)] = values
+    return np.nanmean(padded.reshape(n_cells, factor), axis=1)
+
+
+def cell_reduce(data, factor):
+    """
+    Per-cell median and valid count of a (time, y, x) block whose y/x sizes
+    need not be multiples of factor (edge cells are partial).
+    """
+    n_time, ny, nx = data.shape
+    cy, cx = -(-ny // factor), -(-nx // factor)
+    padded = np.full((n_time, cy * factor, cx * factor), np.nan, dtype=data.dtype)
+    padded[:, :ny, :nx] = data
+    cells = padded.reshape(n_time, cy, factor, cx, factor).transpose(0, 1, 3, 2, 4).reshape(n_time, cy, cx, -1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) # all-NaN cells are expected
+        medians = np.nanmedian(cells, axis=-1).astype(data.dtype)
+    counts = np.isfinite(cells).sum(axis=-1).astype(np.int32)
+    return medians, counts
+
+
+def _create_template(source, out_path, factor, cell_chunk, spatial, time_only, version, zarr_format):
+    y = _cell_coords(source['y'].values, factor)
+    x = _cell_coords(source['x'].values, factor)
+    t_chunks = source[spatial[0]].chunks[source[spatial[0]].dims.index('time')]
+    shape = (source.sizes['time'], len(y), len(x))
+    chunks = (t_chunks, cell_chunk, cell_chunk)
+
+    data_vars = {}
+    for name in spatial:
+        data_vars[name] = (('time', 'y', 'x'), da.full(shape, np.nan, dtype=source[name].dtype, chunks=chunks), source[name].attrs)
+        data_vars[f"{name}_count"] = (('time', 'y', 'x'), da.zeros(shape, dtype='int32', chunks=chunks))
+    for name in time_only:
+        data_vars[name] = (('time',), source[name].data, source[name].attrs)
+
+    res = abs(float(source['x'].values[1] - source['x'].values[0])) if source.sizes['x'] > 1 else 0.0
+    template = xr.Dataset(data_vars, coords={'time': source['time'].values, 'y': y, 'x': x})
+    template.attrs.update({
+        'source_version': version, 'factor': factor, 'resolution': res * factor, 'complete': False
+    })
+    template.to_zarr(out_path, mode='w', compute=False, consolidated=True, zarr_format=zarr_format)
+    # Time-only variables are tiny: write them now rather than per block
+    template[time_only].load().drop_vars(['time', 'y', 'x'], errors='ignore').to_zarr(
+        out_path, region={'time': slice(None)}
+    )
+
+
+def build_overview(region, factor, memory_mb=512, force=False):
+    info = DATA_STORES[region]
+    src_path = info['path']
+    out_path = overview_path(src_path, factor)
+
+    if not src_path.exists():
+        print(f"⚠️ Skipping {region}: {src_path} not found")
+        return None
+
+    version = store_version(src_path)
+    if not force and out_path.exists():
+        try:
+            attrs = xr.open_zarr(out_path, consolidated=True).attrs
+            if attrs.get('source_version') == version and attrs.get('complete') and attrs.get('factor') == factor:
+                print(f"✅ {region}: {out_path.name} is up to date")
+                return out_path
+        except Exception:
+            pass
+
+    # On-disk time order: every time block is a run of whole source chunks
+    source = xr.open_zarr(src_path, consolidated=True)
+    spatial = [name for name, var in source.data_vars.items() if set(var.dims) == {'time', 'y', 'x'}]
+    time_only = [name for name, var in source.data_vars.items() if var.dims == ('time',)]
+
+    cell_chunk = max(BLOCK_PIXELS // factor, 1)
+    block = cell_chunk * factor
+    zarr_format = zarr.open_group(str(src_path), mode='r').metadata.zarr_format
+    _create_template(source, out_path, factor, cell_chunk, spatial, time_only, version, zarr_format)
+
+    blocks = [(y0, x0) for y0 in range(0, source.sizes['y'], block) for x0 in range(0, source.sizes['x'], block)]
+    print(f"🧱 {region}: x{factor} overview, {len(spatial)} variables, "
+          f"{len(blocks)} blocks of {block}x{block} px -> {out_path.name}")
+    t0 = time.time()
+
+    for n, (y0, x0) in enumerate(blocks, start=1):
+        ys = slice(y0, min(y0 + block, source.sizes['y']))
+        xs = slice(x0, min(x0 + block, source.sizes['x']))
+        cys = slice(y0 // factor, -(-ys.stop // factor))
+        cxs = slice(x0 // factor, -(-xs.stop // factor))
+        n_pixels = (ys.stop - ys.start) * (xs.stop - xs.start)
+        # One variable at a time keeps memory to one variable's block
+        for start, stop in time_blocks(source, spatial[:1], n_pixels, memory_mb * 1024 * 1024):
+            out = {}
+            for name in spatial:
+                data = source[name].isel(time=slice(start, stop), y=ys, x=xs).values
+                medians, counts = cell_reduce(data, factor)
+                out[name] = (('time', 'y', 'x'), medians)
+                out[f"{name}_count"] = (('time', 'y', 'x'), counts)
+            xr.Dataset(out).to_zarr(out_path, region={'time': slice(start, stop), 'y': cys, 'x': cxs})
+        if n % 10 == 0 or n == len(blocks):
+            print(f"   {n}/{len(blocks)} blocks ({time.time() - t0:.0f}s)")
+
+    group = zarr.open_group(str(out_path), mode='r+')
+    group.attrs['complete'] = True
+    zarr.consolidate_metadata(str(out_path))
+
+    print(f"✅ {region}: x{factor} overview built in {time.time() - t0:.0f}s")
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build coarse overview levels of the date_pair stores.")
+    parser.add_argument("--region", action="append", choices=list(DATA_STORES), help="Region(s) to build (default: all)")
+    parser.add_argument("--factor", action="append", type=int, help=f"Cell size in store pixels (default: {', '.join(map(str, OVERVIEW_FACTORS))})")
+    parser.add_argument("--memory-mb", type=int, default=512, help="Approximate memory per block and variable (default: 512)")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if up to date")
+    args = parser.parse_args()
+
+    for region in args.region or list(DATA_STORES):
+        for factor in args.factor or OVERVIEW_FACTORS:
+            build_overview(region, factor, args.memory_mb, args.force)
+
+
+if __name__ == "__main__":
+    main()
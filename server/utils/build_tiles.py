@@ -0,0 +1,131 @@
+"""
+Pre-renders the tile pyramid of each region/layer into an MBTiles archive.
+
+Run from the server directory:
+    python -m utils.build_tiles --max-zoom 10 --workers 8
+    python -m utils.build_tiles --region Greenland --layer speed --max-zoom 12
+
+Tiles are rendered with utils.tiles.render_tile, so they are byte-identical to
+what the live /api/tiles endpoint serves. The server answers from the archive
+for the zooms it covers and renders live beyond them. Re-run after a TIFF is
+regenerated: archives built from an older TIFF version are ignored.
+"""
+import os
+import argparse
+import hashlib
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from rio_tiler.io import Reader
+
+from .tiles import TIFF_PATHS, render_tile
+from .tile_cache import file_version
+from .tile_archive import ARCHIVE_DIR, archive_path
+
+SCHEMA = """
+CREATE TABLE metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE images (tile_id TEXT PRIMARY KEY, tile_data BLOB);
+CREATE TABLE map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT);
+CREATE UNIQUE INDEX map_index ON map (zoom_level, tile_column, tile_row);
+CREATE VIEW tiles AS
+    SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+           map.tile_row AS tile_row, images.tile_data AS tile_data
+    FROM map JOIN images ON images.tile_id = map.tile_id;
+"""
+
+COMMIT_EVERY = 2000
+
+
+def _render_job(job):
+    region, layer_type, version, z, x, y = job
+    return z, x, y, render_tile(region, layer_type, z, x, y, version)
+
+
+def list_tiles(file_path, min_zoom, max_zoom):
+    """Every web-mercator tile intersecting the COG, for zooms min..max."""
+    with Reader(file_path) as cog:
+        if hasattr(cog, "get_geographic_bounds"): # rio-tiler >= 7
+            west, south, east, north = cog.get_geographic_bounds(cog.tms.rasterio_geographic_crs)
+        else:
+            west, south, east, north = cog.geographic_bounds
+        if min_zoom is None:
+            min_zoom = cog.minzoom
+        tiles = list(cog.tms.tiles(west, south, east, north, zooms=list(range(min_zoom, max_zoom + 1))))
+    return min_zoom, tiles
+
+
+def build_archive(region, layer_type, max_zoom, min_zoom=None, workers=None):
+    file_path = TIFF_PATHS[region][layer_type]
+    if not file_path.exists():
+        print(f"⚠️ Skipping {region}/{layer_type}: {file_path} not found")
+        return None
+
+    version = file_version(file_path)
+    min_zoom, tiles = list_tiles(file_path, min_zoom, max_zoom)
+    out_path = archive_path(region, layer_type)
+    tmp_path = out_path.with_suffix(".mbtiles.tmp")
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    print(f"🧱 {region}/{layer_type}: {len(tiles)} tiles, zoom {min_zoom}-{max_zoom} -> {out_path.name}")
+    t0 = time.time()
+
+    conn = sqlite3.connect(tmp_path)
+    conn.executescript(SCHEMA)
+    metadata = {
+        "name": f"SHIVER {region} {layer_type}",
+        "format": "png",
+        "type": "overlay",
+        "minzoom": str(min_zoom),
+        "maxzoom": str(max_zoom),
+        "source": str(file_path),
+        "source_version": version,
+        "complete": "0",
+    }
+    conn.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+
+    jobs = [(region, layer_type, version, t.z, t.x, t.y) for t in tiles]
+    unique_images = set()
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for z, x, y, content in pool.map(_render_job, jobs, chunksize=32):
+            # Identical tiles (e.g. fully transparent ones) are stored once
+            tile_id = hashlib.md5(content).hexdigest()
+            if tile_id not in unique_images:
+                conn.execute("INSERT OR IGNORE INTO images VALUES (?, ?)", (tile_id, content))
+                unique_images.add(tile_id)
+            conn.execute("INSERT OR REPLACE INTO map VALUES (?, ?, ?, ?)", (z, x, (1 << z) - 1 - y, tile_id))
+
+            done += 1
+            if done % COMMIT_EVERY == 0:
+                conn.commit()
+                print(f"   {done}/{len(jobs)} tiles ({time.time() - t0:.0f}s)")
+
+    conn.execute("UPDATE metadata SET value = '1' WHERE name = 'complete'")
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, out_path)
+
+    print(f"✅ {region}/{layer_type}: {done} tiles ({len(unique_images)} unique) in {time.time() - t0:.0f}s")
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render tile pyramids into MBTiles archives.")
+    parser.add_argument("--region", action="append", choices=list(TIFF_PATHS), help="Region(s) to build (default: all)")
+    parser.add_argument("--layer", action="append", choices=["speed", "count", "trend"], help="Layer(s) to build (default: all)")
+    parser.add_argument("--min-zoom", type=int, default=None, help="Lowest zoom (default: the COG's minzoom)")
+    parser.add_argument("--max-zoom", type=int, default=10, help="Highest zoom to pre-render (default: 10)")
+    parser.add_argument("--workers", type=int, default=None, help="Render processes (default: CPU count)")
+    args = parser.parse_args()
+
+    print(f"Archive directory: {ARCHIVE_DIR}")
+    for region in args.region or list(TIFF_PATHS):
+        for layer_type in args.layer or list(TIFF_PATHS[region]):
+            build_archive(region, layer_type, args.max_zoom, args.min_zoom, args.workers)
+
+
+if __name__ == "__main__":
+    main()
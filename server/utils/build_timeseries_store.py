@@ -0,0 +1,159 @@
+"""
+Builds the time-major companion of each region's date_pair.zarr.
+
+date_pair.zarr is chunked for mosaicking, so a single-pixel time series
+decompresses a large spatial tile for every time chunk. The companion holds
+the same variables rechunked to small spatial chunks spanning the full time
+axis, so a point read touches one chunk per variable.
+
+Run from the server directory:
+    python -m utils.build_timeseries_store
+    python -m utils.build_timeseries_store --region Greenland --chunk 16 --memory-mb 1024
+
+The copy is written block by block, with each block sized to --memory-mb, and
+finished blocks are recorded in a progress file next to the output, so an
+interrupted build resumes where it stopped. Re-running against an unchanged
+store does nothing; after the store is rewritten the companion is rebuilt
+(until then the server ignores it and reads the original).
+"""
+import os
+import json
+import math
+import time
+import argparse
+
+import xarray as xr
+import zarr
+
+from .stores import DATA_STORES, store_version, timeseries_path
+
+
+def _spatial_vars(ds):
+    return [name for name, var in ds.data_vars.items() if set(var.dims) == {'time', 'y', 'x'}]
+
+
+def _block_size(ds, chunk, memory_bytes):
+    """Side of the square spatial block (a multiple of chunk) loaded per variable."""
+    itemsize = max(ds[name].dtype.itemsize for name in _spatial_vars(ds))
+    per_pixel = ds.sizes['time'] * itemsize
+    side = int(math.sqrt(memory_bytes / per_pixel)) // chunk * chunk
+    return max(side, chunk)
+
+
+def _read_progress(progress_path, version, chunk, block):
+    try:
+        progress = json.loads(progress_path.read_text())
+    except (OSError, ValueError):
+        return None
+    if progress.get('source_version') != version or progress.get('chunk') != chunk or progress.get('block') != block:
+        return None
+    return progress
+
+
+def _write_progress(progress_path, progress):
+    tmp_path = progress_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(progress))
+    os.replace(tmp_path, progress_path)
+
+
+def _create_template(ds, out_path, version, chunk, zarr_format):
+    """Writes metadata, coordinates and the (small) time-only variables."""
+    spatial = _spatial_vars(ds)
+    template = ds.copy()
+    for name in template.variables:
+        template[name].encoding.pop('preferred_chunks', None)
+        template[name].encoding.pop('chunks', None)
+
+    time_only = [name for name in template.data_vars if name not in spatial]
+    for name in time_only:
+        template[name].encoding['chunks'] = (ds.sizes['time'],)
+
+    template = template.chunk({'time': -1, 'y': chunk, 'x': chunk})
+    for name in spatial:
+        template[name].encoding['chunks'] = (ds.sizes['time'], chunk, chunk)
+
+    template.attrs.update({'source_version': version, 'complete': False})
+    # Same zarr format as the source, so its compressor settings carry over
+    template.to_zarr(out_path, mode='w', compute=False, consolidated=True, zarr_format=zarr_format)
+
+    # Time-only variables are tiny: write them now rather than per block
+    template[time_only].load().drop_vars(['time', 'y', 'x'], errors='ignore').to_zarr(
+        out_path, region={'time': slice(None)}
+    )
+
+
+def build_timeseries_store(region, chunk=16, memory_mb=512, force=False):
+    info = DATA_STORES[region]
+    src_path = info['path']
+    out_path = info.get('ts_path') or timeseries_path(src_path)
+    progress_path = out_path.with_name(out_path.name + ".progress.json")
+
+    if not src_path.exists():
+        print(f"⚠️ Skipping {region}: {src_path} not found")
+        return None
+
+    version = store_version(src_path)
+    if not force and out_path.exists():
+        try:
+            attrs = xr.open_zarr(out_path, consolidated=True).attrs
+            if attrs.get('source_version') == version and attrs.get('complete'):
+                print(f"✅ {region}: {out_path.name} is up to date")
+                return out_path
+        except Exception:
+            pass
+
+    ds = xr.open_zarr(src_path, consolidated=True).sortby('time')
+    spatial = _spatial_vars(ds)
+    block = _block_size(ds, chunk, memory_mb * 1024 * 1024)
+
+    progress = None if force else _read_progress(progress_path, version, chunk, block)
+    if progress is None or not out_path.exists():
+        zarr_format = zarr.open_group(str(src_path), mode='r').metadata.zarr_format
+        _create_template(ds, out_path, version, chunk, zarr_format)
+        progress = {'source_version': version, 'chunk': chunk, 'block': block, 'done': []}
+        _write_progress(progress_path, progress)
+    done = {tuple(b) for b in progress['done']}
+
+    blocks = [(y0, x0) for y0 in range(0, ds.sizes['y'], block) for x0 in range(0, ds.sizes['x'], block)]
+    print(f"🧱 {region}: {len(spatial)} variables, {ds.sizes['time']} time steps, "
+          f"{len(blocks)} blocks of {block}x{block} px ({len(done)} already done) -> {out_path.name}")
+    t0 = time.time()
+
+    coords = ['time', 'y', 'x']
+    for n, (y0, x0) in enumerate(blocks, start=1):
+        if (y0, x0) in done:
+            continue
+        ys = slice(y0, min(y0 + block, ds.sizes['y']))
+        xs = slice(x0, min(x0 + block, ds.sizes['x']))
+        # One variable at a time keeps memory to a single block
+        for name in spatial:
+            data = ds[[name]].isel(y=ys, x=xs).load()
+            data.drop_vars(coords).to_zarr(out_path, region={'time': slice(None), 'y': ys, 'x': xs})
+
+        progress['done'].append([y0, x0])
+        _write_progress(progress_path, progress)
+        print(f"   {n}/{len(blocks)} blocks ({time.time() - t0:.0f}s)")
+
+    group = zarr.open_group(str(out_path), mode='r+')
+    group.attrs['complete'] = True
+    zarr.consolidate_metadata(str(out_path))
+    progress_path.unlink()
+
+    print(f"✅ {region}: time-series store built in {time.time() - t0:.0f}s")
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build time-major companion stores for point time-series reads.")
+    parser.add_argument("--region", action="append", choices=list(DATA_STORES), help="Region(s) to build (default: all)")
+    parser.add_argument("--chunk", type=int, default=16, help="Spatial chunk size in pixels (default: 16)")
+    parser.add_argument("--memory-mb", type=int, default=512, help="Approximate memory per block (default: 512)")
+    parser.add_argument("--force", action="store_true", help="Rebuild from scratch even if up to date")
+    args = parser.parse_args()
+
+    for region in args.region or list(DATA_STORES):
+        build_timeseries_store(region, args.chunk, args.memory_mb, args.force)
+
+
+if __name__ == "__main__":
+    main()
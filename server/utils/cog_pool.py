@@ -0,0 +1,141 @@
+import threading
+from contextlib import contextmanager
+
+from rio_tiler.io import Reader
+
+from .tile_cache import file_version
+
+
+class ReaderPool:
+    """
+    Bounded, thread-safe pool of open rio_tiler Readers for one COG.
+
+    A rasterio dataset can't be shared between threads, so each concurrent
+    tile gets its own Reader, but Readers are reused instead of re-opening the
+    GeoTIFF (and re-reading its header/IFDs) on every request.
+
+    Health checks: when the file's version changes, idle Readers are dropped
+    and new ones opened; a Reader that raised during use is closed rather than
+    returned to the pool.
+    """
+
+    def __init__(self, path, max_size=4, acquire_timeout=30):
+        self.path = path
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.version = None
+        self._idle = []
+        self._open_count = 0
+        self._cond = threading.Condition()
+
+    def _open(self):
+        cog = Reader(self.path)
+        try:
+            _warm_overviews(cog)
+        except Exception as e:
+            print(f"⚠️ Overview warm-up failed for {self.path}: {e}")
+        return cog
+
+    def _discard(self, cog):
+        try:
+            cog.close()
+        except Exception:
+            pass
+
+    def _check_version(self, version):
+        # Caller holds self._cond
+        if version != self.version:
+            for cog in self._idle:
+                self._discard(cog)
+                self._open_count -= 1
+            self._idle = []
+            self.version = version
+
+    @contextmanager
+    def reader(self, version=None):
+        """
+        Yields an open Reader for exclusive use. Blocks (up to acquire_timeout)
+        when max_size Readers are already checked out.
+        """
+        if version is None:
+            version = file_version(self.path)
+
+        cog = None
+        with self._cond:
+            self._check_version(version)
+            while not self._idle and self._open_count >= self.max_size:
+                if not self._cond.wait(timeout=self.acquire_timeout):
+                    raise TimeoutError(f"No free reader for {self.path}")
+                self._check_version(version)
+            if self._idle:
+                cog = self._idle.pop()
+            else:
+                self._open_count += 1
+
+        if cog is None:
+            try:
+                cog = self._open()
+            except Exception:
+                with self._cond:
+                    self._open_count -= 1
+                    self._cond.notify()
+                raise
+
+        healthy = True
+        try:
+            yield cog
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            with self._cond:
+                if healthy and version == self.version:
+                    self._idle.append(cog)
+                else:
+                    self._discard(cog)
+                    self._open_count -= 1
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            for cog in self._idle:
+                self._discard(cog)
+                self._open_count -= 1
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            return {"open": self._open_count, "idle": len(self._idle), "max": self.max_size}
+
+
+def _warm_overviews(cog):
+    """
+    Touches every overview level so GDAL has read their IFDs, and reads the
+    smallest one (what low-zoom tiles use) into the block cache.
+    """
+    cog.dataset.overviews(1)
+    cog.preview(max_size=256)
+
+
+# --- POOL REGISTRY ---
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_reader_pool(key, path, max_size=4):
+    """One ReaderPool per key (e.g. (region, layer_type)), created on first use."""
+    pool = _POOLS.get(key)
+    if pool is not None and pool.path == path:
+        return pool
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None or pool.path != path:
+            if pool is not None:
+                pool.close()
+            pool = ReaderPool(path, max_size=max_size)
+            _POOLS[key] = pool
+    return pool
+
+
+def pool_stats():
+    return {"/".join(key): pool.stats() for key, pool in _POOLS.items()}
@@ -0,0 +1,270 @@
+import threading
+import numpy as np
+import matplotlib.cm as cm
+
+# Layers coloured with a matplotlib ramp (everything else uses the region palette)
+CMAPS = {
+    "trend": cm.bwr,     # 'bwr' = Blue-White-Red (0=Blue, 0.5=White, 1=Red), positive = red
+    "count": cm.viridis,
+}
+
+# Data values where a layer's alpha changes (see _alpha_mask). Each edge is the
+# smallest float32 value on the new side of the threshold.
+_TINY = np.nextafter(np.float32(0), np.float32(1))
+ALPHA_EDGES = {
+    "speed": [_TINY, np.float32(20)],
+    "trend": [np.nextafter(np.float32(-0.5), np.float32(0)), np.float32(0.5)],
+    "count": [_TINY],
+}
+
+
+# --- REFERENCE STYLING (per pixel) ---
+# This is the original tile colouring. The tile hot path no longer runs it:
+# it's only evaluated once per LUT bin when a lookup table is built.
+
+def _alpha_mask(layer_type, data):
+    alpha_mask = np.zeros(data.shape, dtype=np.uint8)
+
+    if layer_type == "speed":
+        # Fast ice (> 20 m/yr) -> Solid Opaque
+        alpha_mask[data >= 20] = 255
+        # Slow/Stagnant ice (0-20 m/yr) -> Semi-transparent
+        # This de-emphasizes noise in stable areas
+        alpha_mask[(data > 0) & (data < 20)] = 60
+
+    elif layer_type == "trend":
+        # Mask out NaNs
+        alpha_mask[~np.isnan(data)] = 255
+        # Make areas with a weak trend very transparent
+        alpha_mask[(data > -0.5) & (data < 0.5)] = 40
+
+    else:
+        # For data density, we want to see everything that exists.
+        # If we make low counts transparent, the deep purple of Viridis
+        # will vanish against the map background.
+        alpha_mask[data > 0] = 255
+
+    return alpha_mask
+
+
+def _normalise(region, layer_type, data):
+    if layer_type == "speed":
+        # Log scale between 1 m/yr and a region-specific max
+        max_v = 800.0 if region == "Antarctica" else 400.0
+        min_v = 1.0
+
+        log_min = np.log10(min_v)
+        log_max = np.log10(max_v)
+
+        safe_data = np.where(data > min_v, data, min_v)
+        log_data = np.log10(safe_data)
+        norm = (log_data - log_min) / (log_max - log_min)
+
+    elif layer_type == "trend":
+        # Diverging scale in m/yr^2
+        if region == "Antarctica":
+            min_v, max_v = -15, 15
+        else:
+            min_v, max_v = -2.5, 2.5
+        norm = (data - min_v) / (max_v - min_v)
+
+    else:
+        # Count layer (percent of finite pixels)
+        min_v, max_v = 0, 90
+        norm = (data - min_v) / (max_v - min_v)
+
+    return np.clip(norm, 0, 1)
+
+
+def style_reference(region, layer_type, data, palette):
+    """
+    Colours a float32 array pixel by pixel. Returns uint8 RGBA of shape
+    data.shape + (4,). palette is the (N, 3) uint8 region palette or None.
+    """
+    norm = _normalise(region, layer_type, data)
+    rgba_image = np.zeros(data.shape + (4,), dtype=np.uint8)
+
+    if layer_type in CMAPS:
+        cm_data = CMAPS[layer_type](norm)
+        rgba_image[..., 0] = (cm_data[..., 0] * 255).astype(np.uint8)
+        rgba_image[..., 1] = (cm_data[..., 1] * 255).astype(np.uint8)
+        rgba_image[..., 2] = (cm_data[..., 2] * 255).astype(np.uint8)
+    elif palette is not None and len(palette) > 0:
+        indices = (norm * (len(palette) - 1)).astype(np.int32)
+        rgba_image[..., 0:3] = palette[indices]
+    else:
+        # Grey Fallback
+        idx_byte = (norm * 255).astype(np.uint8)
+        rgba_image[..., 0] = idx_byte
+        rgba_image[..., 1] = idx_byte
+        rgba_image[..., 2] = idx_byte
+
+    rgba_image[..., 3] = _alpha_mask(layer_type, data)
+    return rgba_image
+
+
+def _colour_bin(region, layer_type, data, palette):
+    """
+    Which colour style_reference picks for each (non-NaN) value, as an integer
+    that never decreases as data increases.
+    """
+    norm = _normalise(region, layer_type, data)
+    if layer_type in CMAPS:
+        n = CMAPS[layer_type].N
+        xa = norm * n
+        xa[xa == n] = n - 1 # Same quantisation as matplotlib's Colormap
+        return xa.astype(np.int64)
+    if palette is not None and len(palette) > 0:
+        return (norm * (len(palette) - 1)).astype(np.int64)
+    return (norm * 255).astype(np.uint8).astype(np.int64)
+
+
+# --- LOOKUP TABLES ---
+
+def _f32_to_ukey(values):
+    """
+    Maps float32 values to uint32 keys with the same ordering (negative floats
+    get their magnitude bits flipped). NaNs land below -inf or above +inf.
+    """
+    bits = np.asarray(values, dtype=np.float32).view(np.int32)
+    ordered = bits ^ ((bits >> 31) & 0x7FFFFFFF)
+    return (ordered ^ np.int32(-0x80000000)).view(np.uint32)
+
+
+def _ukey_to_f32(keys):
+    ordered = (np.asarray(keys, dtype=np.int64).astype(np.uint32) ^ np.uint32(0x80000000)).view(np.int32)
+    bits = ordered ^ ((ordered >> 31) & 0x7FFFFFFF)
+    return bits.view(np.float32)
+
+
+def _colour_edges(region, layer_type, palette):
+    """
+    Smallest float32 value at which each colour bin starts, found by bisection
+    over the float32 ordering (bins are monotonic in the data).
+    """
+    lo_key = int(_f32_to_ukey([-np.inf])[0])
+    hi_key = int(_f32_to_ukey([np.inf])[0])
+    first_bin = _colour_bin(region, layer_type, _ukey_to_f32([lo_key]), palette)[0]
+    last_bin = _colour_bin(region, layer_type, _ukey_to_f32([hi_key]), palette)[0]
+
+    targets = np.arange(first_bin + 1, last_bin + 1)
+    lo = np.full(len(targets), lo_key, dtype=np.int64)   # bin(lo) < target
+    hi = np.full(len(targets), hi_key, dtype=np.int64)   # bin(hi) >= target
+    while len(targets) and np.any(hi - lo > 1):
+        mid = lo + (hi - lo) // 2
+        reached = _colour_bin(region, layer_type, _ukey_to_f32(mid), palette) >= targets
+        hi = np.where(reached, mid, hi)
+        lo = np.where(reached, lo, mid)
+    return _ukey_to_f32(hi)
+
+
+class ColourLUT:
+    """
+    Data-space lookup table for one (region, layer), with alpha folded in.
+
+    The float32 data is quantised on its order-preserving bit pattern: the top
+    bits pick a bucket, and each bucket stores the bin at its start plus the
+    (at most a couple of) bin edges inside it. Colouring a tile is a few
+    integer ops, a couple of gathers and one fancy-index into `table`, with no
+    log10, masks or matplotlib calls, and gives exactly the style_reference
+    colours.
+    """
+
+    def __init__(self, region, layer_type, palette, max_buckets=2 ** 18, max_inner=2):
+        edges = np.concatenate([
+            _colour_edges(region, layer_type, palette),
+            np.asarray(ALPHA_EDGES.get(layer_type, []), dtype=np.float32),
+        ])
+        edges = np.unique(edges[np.isfinite(edges)]).astype(np.float32)
+        self.edges = edges
+
+        # Bins in key order: NaN | -inf.. | edges[0].. | ... | edges[-1]..+inf | NaN
+        representatives = np.concatenate([[np.nan, -np.inf], edges, [np.nan]]).astype(np.float32)
+        self.table = style_reference(region, layer_type, representatives, palette)
+        self._table_u32 = np.ascontiguousarray(self.table).view(np.uint32).ravel()
+
+        edge_keys = np.concatenate([
+            _f32_to_ukey([-np.inf]), _f32_to_ukey(edges), _f32_to_ukey([np.inf]) + np.uint32(1)
+        ]).astype(np.int64)
+
+        # Coarsest buckets that still leave <= max_inner edges inside any bucket
+        shift = 32 - int(np.log2(max_buckets))
+        while shift < 32 and self._max_inner(edge_keys, shift + 1) <= max_inner:
+            shift += 1
+
+        n_buckets = 2 ** (32 - shift)
+        self.shift = np.uint32(shift)
+        self.base = np.searchsorted(edge_keys, np.arange(n_buckets, dtype=np.int64) << shift, side='right').astype(np.int32)
+
+        # Edges strictly after their bucket's start, padded with the largest key
+        # (only a NaN can reach it, and the extra +1 is clipped back to NaN)
+        bucket_of_edge = edge_keys >> shift
+        inside = edge_keys > (bucket_of_edge << shift)
+        self.inner = []
+        slot = np.zeros(n_buckets, dtype=np.int64)
+        for key, bucket in zip(edge_keys[inside], bucket_of_edge[inside]):
+            j = slot[bucket]
+            if j == len(self.inner):
+                self.inner.append(np.full(n_buckets, 0xFFFFFFFF, dtype=np.uint32))
+            self.inner[j][bucket] = key
+            slot[bucket] += 1
+
+    @staticmethod
+    def _max_inner(edge_keys, shift):
+        buckets = edge_keys >> shift
+        inside = edge_keys > (buckets << shift)
+        return np.bincount(buckets[inside]).max() if inside.any() else 0
+
+    def apply(self, data):
+        ukey = _f32_to_ukey(data)
+        bucket = ukey >> self.shift
+        bins = self.base.take(bucket)
+        for inner_keys in self.inner:
+            bins += ukey >= inner_keys.take(bucket)
+        rgba = self._table_u32.take(bins, mode='clip')
+        return rgba.view(np.uint8).reshape(data.shape + (4,))
+
+    def verify(self, region, layer_type, palette, n_samples=200000, seed=0):
+        """Checks the LUT against style_reference on edge and random values."""
+        rng = np.random.default_rng(seed)
+        probes = np.concatenate([
+            self.edges,
+            np.nextafter(self.edges, np.float32(-np.inf)),
+            np.nextafter(self.edges, np.float32(np.inf)),
+            rng.uniform(-50, 1000, n_samples).astype(np.float32),
+            rng.normal(0, 3, n_samples).astype(np.float32),
+            np.array([np.nan, -np.nan, np.inf, -np.inf, 0.0, -0.0], dtype=np.float32),
+        ]).astype(np.float32)
+        return np.array_equal(self.apply(probes), style_reference(region, layer_type, probes, palette))
+
+
+_LUTS = {}
+_LUTS_LOCK = threading.Lock()
+
+
+def get_lut(region, layer_type, palette):
+    """
+    Returns the cached ColourLUT for (region, layer), building and verifying it
+    on first use. Returns None if the LUT doesn't reproduce style_reference,
+    in which case callers should colour per pixel instead.
+    """
+    key = (region, layer_type, id(palette))
+    if key in _LUTS:
+        return _LUTS[key]
+
+    with _LUTS_LOCK:
+        if key not in _LUTS:
+            lut = ColourLUT(region, layer_type, palette)
+            if not lut.verify(region, layer_type, palette):
+                print(f"⚠️ Colour LUT mismatch for {region}/{layer_type}, using per-pixel colouring")
+                lut = None
+            _LUTS[key] = lut
+    return _LUTS[key]
+
+
+def colourise(region, layer_type, data, palette):
+    """float32 tile data -> uint8 RGBA, via the LUT when available."""
+    lut = get_lut(region, layer_type, palette)
+    if lut is None:
+        return style_reference(region, layer_type, data, palette)
+    return lut.apply(data)
@@ -0,0 +1,123 @@
+"""
+Compact binary encoding of time-series results ("columnar"), an alternative
+to the JSON layout for clients that send Accept: application/x-shiver-columnar.
+
+Layout (little-endian), gzip-compressed for clients whose Accept-Encoding
+allows it (sent with Content-Encoding: gzip) and plain otherwise:
+
+    b"SHVC" | uint32 format version | uint32 header length | header (UTF-8 JSON,
+    space-padded so the buffers start on an 8-byte boundary) | column buffers
+
+The header lists the sites in order:
+
+    {"sites": [{"name", "status", "message"?, "meta"?,
+                "start": "YYYY-MM-DD", "n_days",
+                "columns": [{"name", "dtype", "offset", "length"}, ...]}, ...]}
+
+Dates are not sent: day i of a site is start + i days. Every column has
+n_days values. "count" is int32; "error", "dt", "<var>.raw" and
+"<var>.smoothed" are float32 rounded to 0.1, with NaN for gaps. Offsets are
+in bytes from the start of the buffer section and everything is 8-byte
+aligned, so a browser can wrap the columns directly in Float32Array /
+Int32Array views of the (decompressed) response.
+"""
+import gzip
+import json
+import struct
+
+import numpy as np
+
+MEDIA_TYPE = "application/x-shiver-columnar"
+MAGIC = b"SHVC"
+GZIP_MAGIC = b"\x1f\x8b"
+FORMAT_VERSION = 1
+
+
+def wants_columnar(accept_header):
+    return MEDIA_TYPE in (accept_header or "")
+
+
+def accepts_gzip(accept_encoding_header):
+    """
+    True when an Accept-Encoding header allows gzip (explicitly or via "*",
+    with a non-zero q). No header means the plain body.
+    """
+    qualities = {}
+    for coding in (accept_encoding_header or "").lower().split(","):
+        name, *params = [part.strip() for part in coding.split(";")]
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        qualities[name] = q
+    return qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0))) > 0
+
+
+def _site_columns(series):
+    yield "count", series["count"].astype("<i4")
+    yield "error", np.round(series["error"], 1).astype("<f4")
+    yield "dt", np.round(series["dt"], 1).astype("<f4")
+    for key, values in series["variables"].items():
+        yield f"{key}.raw", np.round(values["raw"], 1).astype("<f4")
+        yield f"{key}.smoothed", np.round(values["smoothed"], 1).astype("<f4")
+
+
+def encode_columnar(results, compress=True, compresslevel=6):
+    """
+    Encodes {site_name: site_data} (from get_glacier_timeseries(...,
+    columnar=True)) into the binary layout above, gzip-compressed unless
+    compress is False.
+    """
+    sites, buffers = [], []
+    offset = 0
+    for site_name, site_data in results.items():
+        site = {"name": site_name, "status": site_data.get("status")}
+        if "message" in site_data: site["message"] = site_data["message"]
+        if "meta" in site_data: site["meta"] = site_data["meta"]
+
+        series = site_data.get("series")
+        if series is not None:
+            site["start"] = series["start"].strftime("%Y-%m-%d")
+            site["n_days"] = series["n_days"]
+            site["columns"] = []
+            for name, column in _site_columns(series):
+                data = column.tobytes()
+                site["columns"].append({
+                    "name": name, "dtype": column.dtype.name, "offset": offset, "length": len(column)
+                })
+                padding = -len(data) % 8
+                buffers.append(data + b"\0" * padding)
+                offset += len(data) + padding
+        sites.append(site)
+
+    header = json.dumps({"sites": sites}, separators=(",", ":")).encode("utf-8")
+    header += b" " * (-(12 + len(header)) % 8)
+    body = MAGIC + struct.pack("<II", FORMAT_VERSION, len(header)) + header + b"".join(buffers)
+    return gzip.compress(body, compresslevel=compresslevel) if compress else body
+
+
+def decode_columnar(content):
+    """
+    Inverse of encode_columnar, for Python clients and tests (content may be
+    gzip-compressed or not, e.g. already decoded by the HTTP client):
+    {site_name: {"status", "meta", "start", "columns": {name: ndarray}}}.
+    """
+    body = gzip.decompress(content) if content[:2] == GZIP_MAGIC else content
+    if body[:4] != MAGIC:
+        raise ValueError("Not a columnar time-series payload")
+    _, header_len = struct.unpack("<II", body[4:12])
+    header = json.loads(body[12:12 + header_len])
+    data_start = 12 + header_len
+
+    results = {}
+    for site in header["sites"]:
+        columns = {}
+        for col in site.pop("columns", []):
+            start = data_start + col["offset"]
+            columns[col["name"]] = np.frombuffer(body, dtype=np.dtype(col["dtype"]).newbyteorder("<"), count=col["length"], offset=start)
+        site["columns"] = columns
+        results[site.pop("name")] = site
+    return results
@@ -0,0 +1,94 @@
+"""
+Raw data tiles: the values under a map tile, for clients that colour tiles
+themselves (GET /api/tiles/{region}/{layer}/{z}/{x}/{y}.bin). A PNG tile bakes
+in the log stretch, region limits, alpha thresholds and colour ramp; a data
+tile doesn't, so any restyling is done in the browser with no server work.
+
+Layout (little-endian), stored gzip-compressed and sent with
+Content-Encoding: gzip to clients whose Accept-Encoding allows it (plain
+otherwise):
+
+    b"SHVT" | uint32 format version | uint32 header length | header (UTF-8 JSON,
+    space-padded so the values start on an 8-byte boundary) | values
+
+    {"width", "height", "dtype", "scale", "offset", "nodata"}
+
+Values are row-major, width x height, top row first. Two encodings:
+
+- "uint16" (default): value = offset + q * scale, with scale and offset per
+  tile (the tile's own min/max over 65534 steps) and q == nodata (65535)
+  where there is no data. The error is at most scale / 2.
+- "float16": the values as half floats (about 3 significant digits), NaN
+  where there is no data; nodata is null. Values beyond float16's range are
+  clipped to it.
+"""
+import gzip
+import json
+import struct
+
+import numpy as np
+
+MEDIA_TYPE = "application/x-shiver-tile"
+MAGIC = b"SHVT"
+GZIP_MAGIC = b"\x1f\x8b"
+FORMAT_VERSION = 1
+
+DTYPES = ("uint16", "float16")
+UINT16_NODATA = 65535
+_FLOAT16_MAX = float(np.finfo(np.float16).max)
+
+
+def quantize(data, valid, dtype="uint16"):
+    """(values, header fields) for a 2D float array, with pixels outside valid as nodata."""
+    valid = valid & np.isfinite(data)
+    if dtype == "float16":
+        values = np.where(valid, np.clip(data, -_FLOAT16_MAX, _FLOAT16_MAX), np.nan).astype("<f2")
+        return values, {"scale": 1.0, "offset": 0.0, "nodata": None}
+
+    if dtype != "uint16":
+        raise ValueError(f"Unknown data tile dtype: {dtype}")
+    if not valid.any():
+        return np.full(data.shape, UINT16_NODATA, dtype="<u2"), {"scale": 1.0, "offset": 0.0, "nodata": UINT16_NODATA}
+
+    offset = float(data[valid].min())
+    span = float(data[valid].max()) - offset
+    scale = span / (UINT16_NODATA - 1) if span > 0 else 1.0
+    q = np.rint((np.where(valid, data, offset) - offset) / scale)
+    values = np.where(valid, np.clip(q, 0, UINT16_NODATA - 1), UINT16_NODATA).astype("<u2")
+    return values, {"scale": scale, "offset": offset, "nodata": UINT16_NODATA}
+
+
+def encode_data_tile(data, valid, dtype="uint16", compresslevel=6):
+    """Encodes a 2D float array (valid: boolean mask of the same shape) into the layout above."""
+    values, fields = quantize(data, valid, dtype)
+    height, width = values.shape
+    header = json.dumps({"width": width, "height": height, "dtype": dtype, **fields}, separators=(",", ":")).encode("utf-8")
+    header += b" " * (-(12 + len(header)) % 8)
+    body = MAGIC + struct.pack("<II", FORMAT_VERSION, len(header)) + header + values.tobytes()
+    return gzip.compress(body, compresslevel=compresslevel)
+
+
+def empty_data_tile(dtype="uint16", size=256):
+    """A tile with no data, for tiles outside the layer."""
+    return encode_data_tile(np.full((size, size), np.nan, dtype="float32"), np.zeros((size, size), dtype=bool), dtype)
+
+
+def decode_data_tile(content):
+    """
+    Inverse of encode_data_tile, for Python clients and tests (content may be
+    gzip-compressed or not, e.g. already decoded by the HTTP client): (float32
+    array with NaN for nodata, header).
+    """
+    body = gzip.decompress(content) if content[:2] == GZIP_MAGIC else content
+    if body[:4] != MAGIC:
+        raise ValueError("Not a data tile")
+    _, header_len = struct.unpack("<II", body[4:12])
+    header = json.loads(body[12:12 + header_len])
+    dtype = "<u2" if header["dtype"] == "uint16" else "<f2"
+    values = np.frombuffer(body, dtype=dtype, count=header["width"] * header["height"], offset=12 + header_len)
+    values = values.reshape(header["height"], header["width"])
+
+    data = values.astype("float32")
+    if header["nodata"] is not None:
+        data = np.where(values == header["nodata"], np.nan, header["offset"] + data * header["scale"]).astype("float32")
+    return data, header
@@ -0,0 +1,189 @@
+import os
+import asyncio
+import threading
+import contextvars
+import multiprocessing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+
+class ExecutorBusy(Exception):
+    """Raised instead of queueing when an executor's backlog is full."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} executor is busy")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """
+    Thread pool with a cap on queued work. Blocking work (GDAL, Zarr, numpy,
+    PNG encoding) runs here instead of on the event loop, and each kind of work
+    gets its own pool so a batch upload can't starve tile requests.
+
+    Once max_workers jobs are running and max_queue are waiting, run() raises
+    ExecutorBusy straight away (the API turns that into a 503 + Retry-After).
+    """
+
+    def __init__(self, name, max_workers, max_queue, retry_after=1):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"shiver-{name}")
+        self._pending = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _admit(self):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ExecutorBusy(self.name, self.retry_after)
+            self._pending += 1
+
+    def _release(self, *_):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, func, *args, **kwargs):
+        self._admit()
+        try:
+            loop = asyncio.get_running_loop()
+            # Carry the caller's context (request stage timings) into the worker
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self._pool, partial(context.run, func, *args, **kwargs))
+        finally:
+            self._release()
+
+    def submit(self, func, *args, **kwargs):
+        """Fire-and-forget version of run(): returns a concurrent Future."""
+        self._admit()
+        try:
+            future = self._pool.submit(func, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def stream(self, gen_func, *args, max_buffered=8, **kwargs):
+        """
+        Runs generator function gen_func on the pool and returns an async
+        iterator over what it yields. Admission happens here, so ExecutorBusy
+        is raised before a response has started. At most max_buffered items
+        wait for a slow consumer; the generator is stopped if the consumer
+        goes away.
+        """
+        self._admit()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=max_buffered)
+        stopped = threading.Event()
+
+        def put(item):
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while True:
+                try:
+                    return future.result(timeout=1)
+                except FutureTimeout:
+                    if stopped.is_set():
+                        future.cancel()
+                        return
+
+        def produce():
+            items = None
+            try:
+                items = gen_func(*args, **kwargs)
+                for item in items:
+                    if stopped.is_set():
+                        return
+                    put(("item", item))
+            except Exception as e:
+                put(("error", e))
+            finally:
+                if hasattr(items, "close"):
+                    items.close()
+                put(("done", None))
+
+        try:
+            future = loop.run_in_executor(self._pool, contextvars.copy_context().run, produce)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+
+        async def items():
+            try:
+                while True:
+                    kind, item = await queue.get()
+                    if kind == "done":
+                        return
+                    if kind == "error":
+                        raise item
+                    yield item
+            finally:
+                stopped.set()
+
+        return items()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "in_flight": min(self._pending, self.max_workers),
+                "queued": max(self._pending - self.max_workers, 0),
+                "max_queue": self.max_queue,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+TILE_EXECUTOR = BoundedExecutor(
+    "tiles",
+    max_workers=int(os.getenv("SHIVER_TILE_WORKERS", "8")),
+    max_queue=int(os.getenv("SHIVER_TILE_QUEUE", "64")),
+    retry_after=1
+)
+EXTRACT_EXECUTOR = BoundedExecutor(
+    "extract",
+    max_workers=int(os.getenv("SHIVER_EXTRACT_WORKERS", "4")),
+    max_queue=int(os.getenv("SHIVER_EXTRACT_QUEUE", "16")),
+    retry_after=5
+)
+
+
+# --- OPTIONAL PROCESS POOL FOR SMOOTHING ---
+# Off by default (SHIVER_SMOOTHING_PROCESSES=0). When enabled, batch requests
+# spread the per-site savgol/daily-median work over processes. 'spawn' is used
+# because forking a process that already runs threads (GDAL, dask) is unsafe.
+
+SMOOTHING_PROCESSES = int(os.getenv("SHIVER_SMOOTHING_PROCESSES", "0"))
+SMOOTHING_MIN_SITES = int(os.getenv("SHIVER_SMOOTHING_MIN_SITES", "8")) # Smaller batches stay in-thread
+
+_smoothing_pool = None
+_smoothing_lock = threading.Lock()
+
+
+def get_smoothing_pool():
+    """The shared smoothing ProcessPoolExecutor, or None when disabled."""
+    global _smoothing_pool
+    if SMOOTHING_PROCESSES <= 0:
+        return None
+    if _smoothing_pool is None:
+        with _smoothing_lock:
+            if _smoothing_pool is None:
+                _smoothing_pool = ProcessPoolExecutor(
+                    max_workers=SMOOTHING_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+    return _smoothing_pool
+
+
+def shutdown_executors():
+    TILE_EXECUTOR.shutdown()
+    EXTRACT_EXECUTOR.shutdown()
+    if _smoothing_pool is not None:
+        _smoothing_pool.shutdown(wait=False, cancel_futures=True)
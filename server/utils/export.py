@@ -0,0 +1,114 @@
+import io
+import re
+import csv
+import json
+import zipfile
+
+
+def _smoothing_suffix(meta):
+    params = meta.get("params") or {}
+    return f"_gf{params.get('gap')}_wr{params.get('win_raw')}_wd{params.get('win_daily')}_p{params.get('poly')}"
+
+
+def site_csv_name(site_name, site_data, index):
+    """
+    Same naming as the frontend download:
+    SiteName_Buffer_Lat_Lon_SmoothingParams.csv, with generated Site_N names
+    renumbered from 1.
+    """
+    meta = site_data.get("meta") or {}
+    name = meta.get("site_name") or site_name or "Site"
+    if re.fullmatch(r"Site_\d+", name):
+        name = f"Site_{index + 1}"
+    buf = meta.get("buffer_used", "")
+    if isinstance(buf, float):
+        buf = f"{buf:g}"
+    lat, lon = meta.get("lat", 0.0), meta.get("lon", 0.0)
+    return f"{name}_{buf}m_{lat:.3f}_{lon:.3f}{_smoothing_suffix(meta)}.csv"
+
+
+def site_csv(site_data):
+    """
+    One site's series as CSV text, with the frontend's columns:
+    Date, Error_m_yr, Time_Separation_days, Pixel_Count, then one (raw)
+    column per variable.
+    """
+    data = site_data.get("data")
+    if not data:
+        return ""
+
+    keys = [k for k in data if k not in ("dates", "error", "dt", "count")]
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(["Date", "Error_m_yr", "Time_Separation_days", "Pixel_Count"] + keys)
+
+    columns = [data["dates"], data.get("error"), data.get("dt"), data.get("count")]
+    columns += [data[k]["raw"] for k in keys]
+    blank = [None] * len(data["dates"])
+    for row in zip(*[col if col is not None else blank for col in columns]):
+        writer.writerow(["" if v is None else v for v in row])
+    return out.getvalue()
+
+
+def sites_geojson(sites):
+    """FeatureCollection of the extracted site locations, [(site_name, site_data), ...]."""
+    features = []
+    for index, (site_name, site_data) in enumerate(sites):
+        meta = site_data.get("meta") or {}
+        name = site_name
+        if re.fullmatch(r"Site_\d+", name):
+            name = f"Site_{index + 1}"
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [meta.get("lon"), meta.get("lat")]},
+            "properties": {
+                "id": index + 1,
+                "name": name,
+                "buffer_m": meta.get("buffer_used"),
+                "region": meta.get("region"),
+                "status": site_data.get("status"),
+            }
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+class _ChunkSink:
+    """Write-only, non-seekable file object that hands its bytes out in chunks."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_sites_zip(sites):
+    """
+    Streams a ZIP with one CSV per site plus sites.geojson, as byte chunks.
+    sites is an iterable of (site_name, site_data); each CSV is emitted as
+    soon as its site comes in, so neither the archive nor the series are held
+    in memory. Sites that failed are listed in the GeoJSON only.
+    """
+    sink = _ChunkSink()
+    written = []
+    # On a non-seekable sink zipfile writes sizes after each entry (data descriptors)
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for index, (site_name, site_data) in enumerate(sites):
+            if site_data.get("status") == "success":
+                zf.writestr(site_csv_name(site_name, site_data, index), site_csv(site_data))
+            # Only what the GeoJSON needs is kept, not the series
+            written.append((site_name, {"status": site_data.get("status"), "meta": site_data.get("meta")}))
+            chunk = sink.take()
+            if chunk:
+                yield chunk
+        zf.writestr("sites.geojson", json.dumps(sites_geojson(written), indent=2))
+    yield sink.take()
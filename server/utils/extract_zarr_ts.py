@@ -1,51 +1,28 @@
 import xarray as xr
+import dask
 import pandas as pd
 import geopandas as gpd
 from shapely.geometry import Point, Polygon
 import numpy as np
+import hashlib
 from pathlib import Path
-import platform
+from functools import partial, lru_cache
 from scipy.signal import savgol_filter
 
-# --- 1. CONFIGURATION & ENVIRONMENT DETECTION ---
+from .stores import COMPANION_MAX_PIXELS, OVERVIEW_MIN_PIXELS, OVERVIEW_TOLERANCE, get_store
+from .interval_median import daily_interval_median, pair_day_bounds
+from .spatial_median import MEDIAN_MEMORY_MB, blockwise_spatial_median, budget_groups, selection_bytes, weighted_nanmedian
+from .executors import get_smoothing_pool, SMOOTHING_MIN_SITES
+from .ts_cache import TIMESERIES_CACHE, RAW_SERIES_CACHE, MASK_CACHE
+from .metrics import timed
 
-current_os = platform.system()
+# Per-date variables every site reads besides the requested ones
+BASE_VARS = ['u_err_rock', 'u_err_off_ice', 'v_err_rock', 'v_err_off_ice', 'time_separation']
 
-if current_os == "Windows":
-    desktop_gr_path = Path("R:/SCADI/output/Sentinel1/Greenland/mosaic/subregions/lev/date_pair.zarr")
-    desktop_ant_path = Path("R:/SCADI/output/Sentinel1/Antarctica/mosaic/subregions/peninsula/date_pair.zarr")
 
-    if desktop_gr_path.exists():
-        print("🖥️  Environment: Windows (Desktop - Full Data)")
-        DATA_STORES = {
-            'Greenland': {'path': desktop_gr_path, 'crs': "EPSG:3413"},
-            'Antarctica': {'path': desktop_ant_path, 'crs': "EPSG:3031"}
-        }
-    else:
-        print("💻  Environment: Windows (Laptop - Mini Data)")
-        DATA_STORES = {
-            'Greenland': {
-                'path': Path("D:/work/Fellowship_Leeds/SCADI/output/Sentinel1/Greenland/mosaic/subregions/lev/mini_date_pair.zarr"),
-                'crs': "EPSG:3413"
-            },
-            'Antarctica': {
-                'path': Path("D:/work/Fellowship_Leeds/SCADI/output/Sentinel1/Antarctica/mosaic/subregions/peninsula/mini_date_pair.zarr"), 
-                'crs': "EPSG:3031"
-            }
-        }
-else:
-    print("🚀 Environment: Linux (HPC Production)")
-    base_hpc_path = Path("/mnt/parscratch/users/gg1bjd/SCADI/output/Sentinel1")
-    DATA_STORES = {
-        'Greenland': {
-            'path': base_hpc_path / "Greenland/mosaic/subregions/lev/date_pair.zarr",
-            'crs': "EPSG:3413"
-        },
-        'Antarctica': {
-            'path': base_hpc_path / "Antarctica/mosaic/subregions/peninsula/date_pair.zarr",
-            'crs': "EPSG:3031"
-        }
-    }
+class ExtractionError(Exception):
+    """A request that can't be processed at all (as opposed to a failing site)."""
+
 
 def get_glacier_timeseries(
     location_input, 
@@ -56,28 +33,108 @@ def get_glacier_timeseries(
     gap_fill=24,
     win_raw=25,
     win_daily=25,
-    poly=2
+    poly=2,
+    columnar=False,
+    resolution='native'
 ):
-    results = {}
-    
+    """
+    {site_name: site_data} for every site, or {'error': ...}. Runs in the
+    calling thread; the endpoints coalesce identical concurrent requests
+    (keyed by request_key) before it gets a worker.
+    """
+    try:
+        return dict(iter_glacier_timeseries(
+            location_input, buffer=buffer, name_column=name_column, variables=variables, quality=quality,
+            gap_fill=gap_fill, win_raw=win_raw, win_daily=win_daily, poly=poly, columnar=columnar,
+            resolution=resolution
+        ))
+    except ExtractionError as e:
+        return {"error": str(e)}
+
+
+def request_key(location_input, params, file_digest=None):
+    """
+    Normalized key of an extraction request (inputs as given, before any
+    parsing), or None for inputs that can't be keyed cheaply. Files are keyed
+    on file_digest, a digest of their content taken while they were saved
+    (uploads land in a fresh temp file each time); this never reads them.
+    """
+    if isinstance(location_input, (list, tuple)):
+        points = [location_input] if location_input and isinstance(location_input[0], (int, float)) else location_input
+        try:
+            sites = tuple((float(lat), float(lon)) for lat, lon in points)
+        except (TypeError, ValueError):
+            return None
+    elif isinstance(location_input, gpd.GeoDataFrame):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(location_input.crs).encode())
+        for geom in location_input.geometry.to_wkb():
+            digest.update(geom)
+        attributes = location_input.drop(columns=location_input.geometry.name)
+        digest.update(attributes.to_json(orient='split', default_handler=str).encode())
+        sites = ('gdf', digest.hexdigest())
+    elif isinstance(location_input, (str, Path)) and file_digest is not None:
+        sites = ('file', Path(location_input).suffix.lower(), file_digest)
+    else:
+        return None
+
+    normalized = tuple(
+        (name, tuple(value) if isinstance(value, list) else value) for name, value in sorted(params.items())
+    )
+    return (sites, normalized)
+
+
+def iter_glacier_timeseries(
+    location_input,
+    buffer=500,
+    name_column=None,
+    variables=['s'],
+    quality=['filt'],
+    gap_fill=24,
+    win_raw=25,
+    win_daily=25,
+    poly=2,
+    batch_size=None,
+    columnar=False,
+    resolution='native'
+):
+    """
+    Generator version of get_glacier_timeseries: yields (site_name, site_data)
+    as sites finish. Sites are extracted batch_size at a time (all at once when
+    None), so memory stays bounded by one batch. Raises ExtractionError if the
+    input can't be processed at all.
+
+    With columnar=True successful sites carry their daily series as numpy
+    arrays under 'series' instead of JSON lists under 'data' (see
+    utils/columnar.py).
+
+    With resolution='auto' large windows and polygons may be read from an
+    overview level of the store (see _plan_overview); each result's
+    meta['resolution'] says which level was used.
+    """
+    if resolution not in ('native', 'auto'):
+        raise ExtractionError(f"Unknown resolution mode: {resolution} (use 'native' or 'auto')")
+
     # 1. Parse Input
-    gdf = _load_input_to_gdf(location_input)
+    with timed("parse"):
+        gdf = _load_input_to_gdf(location_input)
     if gdf.empty:
-        return {"error": "Input file contains no geometries."}
+        raise ExtractionError("Input file contains no geometries.")
 
     # 2. Detect Region
     first_geom = gdf.geometry.iloc[0]
     ref_lat = first_geom.centroid.y
     region = 'Antarctica' if ref_lat < 0 else 'Greenland'
-    store_info = DATA_STORES[region]
     
-    # 3. Open Zarr
+    # 3. Fetch the already-open, time-sorted store
     try:
-        ds = xr.open_zarr(store_info['path'], consolidated=True).sortby('time')
+        with timed("open"):
+            store = get_store(region)
     except Exception as e:
-        return {"error": f"Could not open data store: {str(e)}"}
+        raise ExtractionError(f"Could not open data store: {str(e)}")
 
-    # 4. Iterate Sites
+    # 4. Resolve per-site names and buffers
+    site_names, site_buffers = [], []
     for idx, row in gdf.iterrows():
         site_name = f"Site_{idx}"
         if name_column and name_column in gdf.columns: site_name = str(row[name_column])
@@ -88,90 +145,510 @@ def get_glacier_timeseries(
         if 'buffer' in gdf.columns:
             try: current_buffer = float(row['buffer'])
             except (ValueError, TypeError): current_buffer = buffer
-            
-        site_data = _process_single_site(
-            ds, row.geometry, store_info['crs'], current_buffer, variables, quality,
-            gap_fill, win_raw, win_daily, poly
+
+        site_names.append(site_name)
+        site_buffers.append(current_buffer)
+
+    # 5. Extract the sites batch by batch (one reprojection, chunk-grouped reads per batch)
+    step = batch_size or len(gdf)
+    for start in range(0, len(gdf), step):
+        stop = start + step
+        geometries = gdf.geometry.iloc[start:stop]
+        site_results = _process_sites(
+            store, geometries, site_buffers[start:stop], variables, quality,
+            gap_fill, win_raw, win_daily, poly, resolution
         )
-        
-        centroid = row.geometry.centroid
-        meta = {
-            "site_name": site_name,
-            "region": region,
-            "buffer_used": current_buffer,
-            "lat": round(centroid.y, 5),
-            "lon": round(centroid.x, 5),
-            "type": "Polygon" if isinstance(row.geometry, Polygon) else "Point",
-            "variables": variables,
-            "quality": quality,
-            "params": { "gap": gap_fill, "win_raw": win_raw, "win_daily": win_daily, "poly": poly }
-        }
 
-        if 'meta' in site_data:
-            site_data['meta'].update(meta)
+        for geometry, site_name, current_buffer, site_data in zip(
+            geometries, site_names[start:stop], site_buffers[start:stop], site_results
+        ):
+            centroid = geometry.centroid
+            meta = {
+                "site_name": site_name,
+                "region": region,
+                "buffer_used": current_buffer,
+                "lat": round(centroid.y, 5),
+                "lon": round(centroid.x, 5),
+                "type": "Polygon" if isinstance(geometry, Polygon) else "Point",
+                "variables": variables,
+                "quality": quality,
+                "params": { "gap": gap_fill, "win_raw": win_raw, "win_daily": win_daily, "poly": poly }
+            }
+
+            if 'meta' in site_data:
+                site_data['meta'].update(meta)
+            else:
+                site_data['meta'] = meta
+
+            with timed("serialize"):
+                payload = _site_payload(site_data, columnar)
+            yield site_name, payload
+
+
+def _process_single_site(store, geometry, buffer, variables, quality_list, gap_fill, win_raw, win_daily, poly,
+                         resolution='native'):
+    geometries = gpd.GeoSeries([geometry], crs="EPSG:4326")
+    return _site_payload(_process_sites(
+        store, geometries, [buffer], variables, quality_list,
+        gap_fill, win_raw, win_daily, poly, resolution
+    )[0])
+
+
+def _process_sites(store, geometries, buffers, variables, quality_list, gap_fill, win_raw, win_daily, poly,
+                   resolution='native'):
+    """
+    Batch extraction for many sites against one store.
+
+    All geometries are reprojected in a single call. Single-pixel sites are
+    read with one vectorised pointwise selection; window and polygon-mask
+    sites are grouped by the Zarr chunks they touch and each group is
+    computed in one pass, so a chunk shared by several sites is only read once.
+    Raw per-date series are cached under a handle for the pixels they read
+    (see _raw_handle), and finished results under handle + smoothing
+    parameters, so repeat clicks skip the read and slider changes only
+    re-smooth. With resolution='auto', large sites that an overview level
+    traces closely enough are read from that level instead (_plan_overview).
+    Returns one result dict per input geometry, in order.
+    """
+    ds = store.ds
+    # One vectorised pass through the store's cached Transformer
+    with timed("reproject"):
+        proj_geoms = store.grid.project(geometries.to_crs("EPSG:4326").values)
+
+    target_keys = []
+    for v in variables:
+        for q in quality_list:
+            target_keys.append(f"{v}_{q}")
+
+    vars_to_keep = list(set(target_keys + BASE_VARS))
+
+    count_col = target_keys[0] if target_keys else 's_filt'
+    if count_col not in ds: count_col = 'time_separation'
+
+    raw_params = (tuple(variables), tuple(quality_list))
+    smoothing = (gap_fill, win_raw, win_daily, poly)
+    results = [None] * len(proj_geoms)
+    handles, raw = {}, {}
+    pixel_sites, window_sites = {}, {} # keyed by the StoreHandle that reads them
+    overview_sites = {} # keyed by the OverviewLevel that answers them
+    levels = {} # site -> level description for its meta
+    frames = {}
+
+    # --- Selection: which pixels each site reads and what the caches hold, then the pixel reads ---
+    with timed("select"):
+        for i, (proj_geom, buffer) in enumerate(zip(proj_geoms, buffers)):
+            plan = _plan_site(store, proj_geom, buffer)
+            if 'status' in plan:
+                results[i] = plan
+                continue
+            if resolution == 'auto':
+                plan = _plan_overview(store, plan)
+                levels[i] = _level_meta(store, plan)
+
+            # Two cache levels: the finished result, then the raw series it's built from
+            handles[i] = _raw_handle(store, plan, raw_params)
+            cached = TIMESERIES_CACHE.get((handles[i],) + smoothing)
+            if cached is not None:
+                results[i] = cached
+                continue
+            cached_raw = RAW_SERIES_CACHE.get(handles[i])
+            if cached_raw is not None:
+                raw[i] = cached_raw
+            elif plan['kind'] == 'pixel':
+                pixel_sites.setdefault(_choose_reader(store, plan), []).append((i, plan))
+            elif plan['kind'] == 'overview':
+                overview_sites.setdefault(plan['level'], []).append((i, plan))
+            else:
+                window_sites.setdefault(_choose_reader(store, plan), []).append((i, plan))
+
+        # --- Single pixels: one vectorised read for every point ---
+        for reader, sites in pixel_sites.items():
+            try:
+                frames.update(_read_pixels(reader.ds, vars_to_keep, count_col, sites))
+            except Exception as e:
+                for i, _ in sites:
+                    results[i] = {"status": "error", "message": f"Pixel selection failed: {e}"}
+
+    # --- Windows (spatial medians): one pass per group of sites sharing chunks ---
+    with timed("median"):
+        for reader, sites in window_sites.items():
+            for group in _group_by_chunks(reader, sites):
+                try:
+                    frames.update(_read_windows(reader, vars_to_keep, count_col, group))
+                except Exception as e:
+                    for i, _ in group:
+                        results[i] = {"status": "error", "message": f"Window read failed: {e}"}
+
+        # --- Overview cells: medians of medians, weighted by valid pixels ---
+        for level, sites in overview_sites.items():
+            try:
+                frames.update(_read_overview(level, vars_to_keep, count_col, sites))
+            except Exception as e:
+                for i, _ in sites:
+                    results[i] = {"status": "error", "message": f"Overview read failed: {e}"}
+
+        # --- Raw stage: per-date series, cached for re-smoothing ---
+        for i, df in frames.items():
+            raw_df = _prepare_raw_series(df, target_keys)
+            if isinstance(raw_df, dict):
+                results[i] = raw_df
+            else:
+                RAW_SERIES_CACHE.put(handles[i], raw_df)
+                raw[i] = raw_df
+
+    # --- Smoothing stage: optionally spread over processes for big batches ---
+    smooth = partial(
+        _smooth_raw_series, target_keys=target_keys,
+        gap_fill=gap_fill, win_raw=win_raw, win_daily=win_daily, poly=poly
+    )
+    with timed("smooth"):
+        smoothing_pool = get_smoothing_pool()
+        if smoothing_pool is not None and len(raw) >= SMOOTHING_MIN_SITES:
+            built = smoothing_pool.map(smooth, raw.values(), chunksize=4)
         else:
-            site_data['meta'] = meta
-            
-        results[site_name] = site_data
+            built = map(smooth, raw.values())
+        for i, site_data in zip(list(raw.keys()), built):
+            TIMESERIES_CACHE.put((handles[i],) + smoothing, site_data)
+            results[i] = site_data
+
+    # Fresh dicts per request: callers attach their own 'meta', cache entries stay untouched
+    for i, handle in handles.items():
+        if results[i].get('status') == 'success':
+            meta = {"raw_handle": handle}
+            if i in levels: meta["resolution"] = levels[i]
+            results[i] = dict(results[i], meta=meta)
 
     return results
 
 
-def _process_single_site(ds, geometry, target_crs, buffer, variables, quality_list, gap_fill, win_raw, win_daily, poly):
+def _raw_handle(store, plan, raw_params):
+    """
+    Handle of a site's raw series: a digest of the store (and its version),
+    the snapped pixel or pixel window the site reads, and variables/quality.
+    Nearby clicks resolving to the same pixels share one handle.
+    """
+    if plan['kind'] == 'pixel':
+        pixels = ('pixel', plan['iy'], plan['ix'])
+    elif plan['kind'] == 'mask':
+        pixels = ('mask', plan['digest'])
+    elif plan['kind'] == 'overview':
+        pixels = ('overview', plan['level'].factor, plan['digest'])
+    else:
+        ys = plan['ys'].indices(store.ds.sizes['y'])
+        xs = plan['xs'].indices(store.ds.sizes['x'])
+        pixels = ('window', ys, xs)
+    key = repr((store.region, store.version, pixels) + raw_params)
+    return hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+
+
+def resmooth_timeseries(handles, gap_fill=24, win_raw=25, win_daily=25, poly=2, columnar=False):
+    """
+    Re-runs only the smoothing stage on cached raw series (see the 'raw_handle'
+    in each result's meta). Handles that have expired come back as errors and
+    need a fresh extraction.
+    """
+    smoothing = (gap_fill, win_raw, win_daily, poly)
+    results = {}
+    for handle in handles:
+        site_data = TIMESERIES_CACHE.get((handle,) + smoothing)
+        if site_data is None:
+            raw_df = RAW_SERIES_CACHE.get(handle)
+            if raw_df is None:
+                results[handle] = {"status": "error", "message": "Raw series expired, please re-extract."}
+                continue
+            with timed("smooth"):
+                site_data = _smooth_raw_series(
+                    raw_df, target_keys=raw_df.attrs['target_keys'],
+                    gap_fill=gap_fill, win_raw=win_raw, win_daily=win_daily, poly=poly
+                )
+            TIMESERIES_CACHE.put((handle,) + smoothing, site_data)
+
+        with timed("serialize"):
+            results[handle] = _site_payload(dict(site_data, meta={
+                "raw_handle": handle,
+                "params": { "gap": gap_fill, "win_raw": win_raw, "win_daily": win_daily, "poly": poly }
+            }), columnar)
+    return results
+
 
-    temp_gdf = gpd.GeoDataFrame({'geometry': [geometry]}, crs="EPSG:4326").to_crs(target_crs)
-    proj_geom = temp_gdf.geometry.iloc[0]
-    
-    x_min, x_max = ds.x.min().item(), ds.x.max().item()
-    y_min, y_max = ds.y.min().item(), ds.y.max().item()
-    if y_min > y_max: y_min, y_max = y_max, y_min
+def _plan_site(store, proj_geom, buffer):
+    """
+    Works out which pixels a (projected) site reads, as positional indices:
+    {'kind': 'pixel', 'iy', 'ix'}, {'kind': 'window', 'ys', 'xs'} for
+    buffered points, {'kind': 'mask', 'iy', 'ix', 'digest'} for polygons
+    (see _plan_polygon), or an error dict if the site is outside the store.
+    """
+    grid = store.grid
 
     px, py = proj_geom.centroid.x, proj_geom.centroid.y
-    if not (x_min <= px <= x_max) or not (y_min <= py <= y_max):
+    if not grid.contains(px, py):
         return {"status": "error", "message": "Location outside data coverage."}
     
-    is_single_pixel = False
+    window = None
     if isinstance(proj_geom, Point):
-        if buffer <= 0: is_single_pixel = True 
-        else: minx, miny, maxx, maxy = proj_geom.buffer(buffer).bounds
+        if buffer > 0: window = grid.window(*proj_geom.buffer(buffer).bounds)
     else:
+        plan = _plan_polygon(store, proj_geom, buffer)
+        if plan is not None:
+            return plan
+
+    if window is None:
+        # Nearest pixel centre (what ds.sel(..., method='nearest') picks)
+        iy, ix = grid.nearest(px, py)
+        return {"kind": "pixel", "iy": iy, "ix": ix}
+
+    ys, xs = window
+    return {"kind": "window", "ys": ys, "xs": xs}
+
+
+def _plan_polygon(store, proj_geom, buffer):
+    """
+    Rasterizes a (buffered) polygon onto the store grid: the positional
+    indices of the pixels whose centres fall inside it, plus a digest of that
+    pixel set. None when it covers no pixel centre (a sliver thinner than a
+    pixel), so the caller falls back to the nearest pixel.
+    Masks are cached by geometry, so repeat requests skip buffering and
+    rasterizing.
+    """
+    geom_digest = hashlib.blake2b(proj_geom.wkb, digest_size=16).hexdigest()
+    key = (store.region, store.version, geom_digest, buffer)
+    plan = MASK_CACHE.get(key)
+    if plan is None:
         if buffer > 0: proj_geom = proj_geom.buffer(buffer)
-        minx, miny, maxx, maxy = proj_geom.bounds
+        iy = ix = np.empty(0, dtype=np.int32)
+        window = store.grid.window(*proj_geom.bounds)
+        if window is not None:
+            iy, ix = np.nonzero(store.grid.mask(proj_geom, window))
+            iy = (iy + window[0].indices(store.grid.ny)[0]).astype(np.int32)
+            ix = (ix + window[1].indices(store.grid.nx)[0]).astype(np.int32)
+        digest = hashlib.blake2b(iy.tobytes() + ix.tobytes(), digest_size=12).hexdigest()
+        plan = {"kind": "mask", "iy": iy, "ix": ix, "digest": digest}
+        MASK_CACHE.put(key, plan)
+    return plan if len(plan['iy']) else None
+
+
+def _plan_pixels(store, plan):
+    """Positional (iy, ix) of every store pixel a window or mask plan reads."""
+    if plan['kind'] == 'mask':
+        return plan['iy'], plan['ix']
+    iy, ix = np.meshgrid(
+        np.arange(*plan['ys'].indices(store.grid.ny)), np.arange(*plan['xs'].indices(store.grid.nx)), indexing='ij'
+    )
+    return iy.ravel(), ix.ravel()
+
+
+def _plan_overview(store, plan):
+    """
+    resolution='auto': answers a large window or polygon from the coarsest
+    overview level that traces it closely enough. A level's cells stand in
+    for the site when at least half of their pixels are in it; the level is
+    usable if the pixels those cells add or miss are at most
+    OVERVIEW_TOLERANCE of the site's. Returns {'kind': 'overview', 'level',
+    'cy', 'cx', 'mismatch', 'digest'}, or the plan unchanged.
+    """
+    if not store.overviews or plan['kind'] not in ('window', 'mask'):
+        return plan
+    iy, ix = _plan_pixels(store, plan)
+    n_pixels = len(iy)
+    if n_pixels < OVERVIEW_MIN_PIXELS:
+        return plan
+
+    for level in reversed(store.overviews):
+        f = level.factor
+        n_cx = level.ds.sizes['x']
+        cells, inside = np.unique((iy // f).astype(np.int64) * n_cx + ix // f, return_counts=True)
+        cy, cx = cells // n_cx, cells % n_cx
+        # Edge cells hold fewer than f x f pixels
+        cell_pixels = np.minimum(f, store.grid.ny - cy * f) * np.minimum(f, store.grid.nx - cx * f)
+        keep = inside * 2 >= cell_pixels
+        mismatch = (np.sum(cell_pixels[keep] - inside[keep]) + np.sum(inside[~keep])) / n_pixels
+        if keep.any() and mismatch <= OVERVIEW_TOLERANCE:
+            cy, cx = cy[keep].astype(np.int32), cx[keep].astype(np.int32)
+            digest = hashlib.blake2b(cy.tobytes() + cx.tobytes(), digest_size=12).hexdigest()
+            return {"kind": "overview", "level": level, "cy": cy, "cx": cx, "mismatch": float(mismatch), "digest": digest}
+    return plan
+
+
+def _level_meta(store, plan):
+    """meta['resolution'] of a site: the level it was read from."""
+    if plan['kind'] != 'overview':
+        return {"level": "native", "factor": 1, "pixel_size_m": abs(store.grid.dx)}
+    level = plan['level']
+    return {
+        "level": level.name,
+        "factor": level.factor,
+        "pixel_size_m": level.resolution,
+        "cells": len(plan['cy']),
+        "area_mismatch": round(plan['mismatch'], 4),
+    }
 
-    if not is_single_pixel:
-        y_slice = slice(maxy, miny) if ds.y[0] > ds.y[-1] else slice(miny, maxy)
-        try:
-            subset = ds.sel(x=slice(minx, maxx), y=y_slice)
-            if subset.x.size == 0 or subset.y.size == 0: is_single_pixel = True 
-        except Exception: is_single_pixel = True
 
-    target_keys = []
-    for v in variables:
-        for q in quality_list:
-            target_keys.append(f"{v}_{q}")
-            
-    base_vars = ['u_err_rock', 'u_err_off_ice', 'v_err_rock', 'v_err_off_ice', 'time_separation']
-    vars_to_keep = list(set(target_keys + base_vars))
-    
-    if is_single_pixel:
-        try:
-            subset = ds.sel(x=proj_geom.centroid.x, y=proj_geom.centroid.y, method='nearest')
-        except Exception as e:
-            return {"status": "error", "message": f"Pixel selection failed: {e}"}
-        
-        count_col = target_keys[0] if target_keys else 's_filt'
-        if count_col not in subset: count_col = 'time_separation'
-        
+def _choose_reader(store, plan):
+    """
+    Points and small windows read from the time-major companion store when
+    there is one (one small chunk per variable instead of a spatial tile per
+    time chunk); large polygons stay on the original store.
+    """
+    if store.companion is None:
+        return store
+    if plan['kind'] == 'mask':
+        if len(plan['iy']) > COMPANION_MAX_PIXELS:
+            return store
+    elif plan['kind'] == 'window':
+        n_y = len(range(*plan['ys'].indices(store.ds.sizes['y'])))
+        n_x = len(range(*plan['xs'].indices(store.ds.sizes['x'])))
+        if n_y * n_x > COMPANION_MAX_PIXELS:
+            return store
+    return store.companion
+
+
+def _site_chunks(store, plan):
+    """Set of (y_chunk, x_chunk) ids a planned site touches."""
+    if plan['kind'] == 'pixel':
+        y_ids = store.chunk_ids('y', plan['iy'], plan['iy'] + 1)
+        x_ids = store.chunk_ids('x', plan['ix'], plan['ix'] + 1)
+    elif plan['kind'] == 'mask':
+        # Only the chunks holding masked pixels, not the polygon's bounding box
+        y_ids = store.chunk_of('y', plan['iy']).tolist()
+        x_ids = store.chunk_of('x', plan['ix']).tolist()
+        return set(zip(y_ids, x_ids))
+    else:
+        ys = range(*plan['ys'].indices(store.ds.sizes['y']))
+        xs = range(*plan['xs'].indices(store.ds.sizes['x']))
+        y_ids = store.chunk_ids('y', min(ys), max(ys) + 1)
+        x_ids = store.chunk_ids('x', min(xs), max(xs) + 1)
+    return {(cy, cx) for cy in y_ids for cx in x_ids}
+
+
+def _group_by_chunks(store, sites):
+    """
+    Splits [(i, plan), ...] into groups of sites connected by shared chunks
+    (union-find), so each group can be read in one pass.
+    """
+    parent = list(range(len(sites)))
+
+    def find(a):
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    chunk_owner = {}
+    for pos, (_, plan) in enumerate(sites):
+        for chunk in _site_chunks(store, plan):
+            if chunk in chunk_owner:
+                parent[find(pos)] = find(chunk_owner[chunk])
+            else:
+                chunk_owner[chunk] = pos
+
+    groups = {}
+    for pos, site in enumerate(sites):
+        groups.setdefault(find(pos), []).append(site)
+    return list(groups.values())
+
+
+def _read_pixels(ds, vars_to_keep, count_col, pixel_sites):
+    """One pointwise (vectorised) isel for all single-pixel sites."""
+    iy = xr.DataArray([plan['iy'] for _, plan in pixel_sites], dims='site')
+    ix = xr.DataArray([plan['ix'] for _, plan in pixel_sites], dims='site')
+    points = ds[vars_to_keep].isel(y=iy, x=ix).load()
+
+    frames = {}
+    for k, (i, _) in enumerate(pixel_sites):
+        subset = points.isel(site=k)
         pixel_counts = subset[count_col].notnull().astype(int)
-        df = subset[vars_to_keep].to_dataframe()
+        df = subset.to_dataframe()
         df['valid_count'] = pixel_counts.to_series()
-    else:
-        count_col = target_keys[0] if target_keys else 's_filt'
-        if count_col not in subset: count_col = 'time_separation'
-        pixel_counts = subset[count_col].count(dim=['x', 'y'])
-        df = subset[vars_to_keep].median(dim=['x', 'y'], keep_attrs=True).to_dataframe()
+        frames[i] = df
+    return frames
+
+
+def _read_windows(reader, vars_to_keep, count_col, window_sites):
+    """
+    Spatial median + valid count per window or polygon mask. Masked pixels
+    are picked out with a pointwise isel, so only the chunks they fall in are
+    read. Sites whose (time x pixels) cubes fit in the median memory budget
+    are computed together in one pass, as many per pass as fit in it
+    together; larger ones are reduced block by block along time
+    (utils/spatial_median.py), so memory stays within the budget.
+    """
+    ds = reader.ds
+    budget = MEDIAN_MEMORY_MB * 1024 * 1024
+    lazy, large = [], []
+    for i, plan in window_sites:
+        if plan['kind'] == 'mask':
+            indexers = {'y': xr.DataArray(plan['iy'], dims='pixel'), 'x': xr.DataArray(plan['ix'], dims='pixel')}
+            dims = ['pixel']
+            n_pixels = len(plan['iy'])
+        else:
+            indexers = {'y': plan['ys'], 'x': plan['xs']}
+            dims = ['x', 'y']
+            n_pixels = len(range(*plan['ys'].indices(ds.sizes['y']))) * len(range(*plan['xs'].indices(ds.sizes['x'])))
+
+        size = selection_bytes(ds, vars_to_keep, n_pixels)
+        if size > budget:
+            large.append((i, indexers, dims))
+            continue
+        subset = ds[vars_to_keep].isel(**indexers)
+        pixel_counts = subset[count_col].count(dim=dims)
+        medians = subset.median(dim=dims, keep_attrs=True)
+        lazy.append((i, medians, pixel_counts, size))
+
+    results = []
+    for group in budget_groups([size for *_, size in lazy], budget):
+        computed = dask.compute(*[(lazy[p][1], lazy[p][2]) for p in group])
+        results.extend((lazy[p][0], medians, pixel_counts) for p, (medians, pixel_counts) in zip(group, computed))
+    for i, indexers, dims in large:
+        medians, counts = blockwise_spatial_median(
+            reader.source, reader.time_order, vars_to_keep, [count_col], indexers, dims, budget
+        )
+        results.append((i, medians, counts[count_col]))
+
+    frames = {}
+    for i, medians, pixel_counts in results:
+        df = medians.to_dataframe()
         df['valid_count'] = pixel_counts.to_series()
+        frames[i] = df
+    return frames
+
+
+def _read_overview(level, vars_to_keep, count_col, overview_sites):
+    """
+    Per-date series of sites read from an overview level: for each variable
+    the median of its cells' medians, weighted by their valid pixels, and the
+    summed valid pixels of count_col. Same frame layout as _read_windows.
+    """
+    ds = level.ds
+    spatial = [v for v in vars_to_keep if f"{v}_count" in ds]
+    per_date = ds[[v for v in vars_to_keep if v not in spatial]].load()
+    count_name = f"{count_col}_count" if count_col in spatial else None
+
+    frames = {}
+    for i, plan in overview_sites:
+        cells = ds[spatial + [f"{v}_count" for v in spatial]].isel(
+            y=xr.DataArray(plan['cy'], dims='cell'), x=xr.DataArray(plan['cx'], dims='cell')
+        ).load()
+        columns = {}
+        for v in vars_to_keep:
+            if v in spatial:
+                columns[v] = weighted_nanmedian(cells[v].values, cells[f"{v}_count"].values)
+            else:
+                columns[v] = per_date[v].values
+        df = pd.DataFrame(columns, index=ds.indexes['time'])
+        if count_name is not None:
+            df['valid_count'] = cells[count_name].values.sum(axis=1)
+        else:
+            df['valid_count'] = per_date[count_col].notnull().values.astype(int)
+        frames[i] = df
+    return frames
+
 
+def _prepare_raw_series(df, target_keys):
+    """
+    Raw stage: the per-date site table with empty dates dropped, the combined
+    error added and duplicate dates merged. Returns an error dict if nothing
+    is left.
+    """
     present_keys = [k for k in target_keys if k in df.columns]
     if present_keys:
         df = df.dropna(subset=present_keys, how='all')
@@ -192,6 +669,18 @@ def _process_single_site(ds, geometry, target_crs, buffer, variables, quality_li
         if 'valid_count' in df.columns: agg_rules['valid_count'] = 'sum'
         df = df.groupby(level=0).agg(agg_rules)
 
+    df.attrs['target_keys'] = target_keys
+    return df
+
+
+def _smooth_raw_series(df, target_keys, gap_fill, win_raw, win_daily, poly):
+    """
+    Smoothing stage: turns a prepared raw series into the smoothed daily
+    series, as arrays on a daily axis ({"status", "series"}; see
+    _series_to_json for the JSON layout).
+    """
+    present_keys = [k for k in target_keys if k in df.columns]
+
     # =========================================================================
     # PROCESSING LOOP
     # =========================================================================
@@ -207,16 +696,13 @@ def _process_single_site(ds, geometry, target_crs, buffer, variables, quality_li
     # Prepare common data arrays on the full timeline
     df_daily = df.reindex(full_idx) 
 
-    def clean_nans(data_series):
-        if hasattr(data_series, 'values'): data_series = data_series.values 
-        if len(data_series) == 0: return []
-        return [x if (pd.notnull(x) and np.isfinite(x)) else None for x in np.round(data_series, 1).tolist()]
-
-    output_data = {
-        "dates": full_idx.strftime('%Y-%m-%d').tolist(), 
-        "error": clean_nans(df_daily['error_m_yr']),
-        "dt": clean_nans(df_daily['time_separation']),
-        "count": df_daily['valid_count'].fillna(0).astype(int).tolist()
+    series = {
+        "start": full_idx[0],
+        "n_days": len(full_idx),
+        "error": df_daily['error_m_yr'].values,
+        "dt": df_daily['time_separation'].values,
+        "count": df_daily['valid_count'].fillna(0).astype(int).values,
+        "variables": {}
     }
 
     for key in present_keys:
@@ -253,34 +739,21 @@ def _process_single_site(ds, geometry, target_crs, buffer, variables, quality_li
             pass
 
         # --- STEP 2: DAILY MEDIAN (Trend Line Calculation) ---
-        time_sep_days = pd.to_timedelta(df['time_separation'], unit='D')
-        starts = df.index - (time_sep_days / 2)
-        ends   = df.index + (time_sep_days / 2)
-        
-        daily_stack = []
-        for i in range(len(df)):
-            if pd.isna(current_speed_series.iloc[i]): continue 
-            
-            s_date = starts.iloc[i].floor('D')
-            e_date = ends.iloc[i].ceil('D')
-            
-            # For the trend line generation, we use the smoothed point value if available
-            val_to_use = current_speed_series.iloc[i]
-            try:
-                if pd.notnull(processed_raw_series.loc[df.index[i]]):
-                    val_to_use = processed_raw_series.loc[df.index[i]]
-            except: pass
-
-            date_rng = pd.date_range(start=s_date, end=e_date, freq='D')
-            if not date_rng.empty:
-                daily_stack.append(pd.DataFrame({'date': date_rng, 'speed': val_to_use}))
-
-        if daily_stack:
-            big_df = pd.concat(daily_stack)
-            daily_ts = big_df.groupby('date')['speed'].median()
-            daily_ts = daily_ts.reindex(full_idx)
-        else:
-            daily_ts = pd.Series(dtype=float, index=full_idx)
+        # Each pair covers [mid - dt/2, mid + dt/2]; every day takes the median
+        # of the pairs covering it. For the trend line we use the smoothed point
+        # value where available, falling back to the raw value.
+        smoothed_vals = processed_raw_series.reindex(df.index).values
+        raw_vals = current_speed_series.values
+        use_smoothed = pd.notnull(smoothed_vals) & pd.notnull(raw_vals)
+        # Keep the raw dtype unless a smoothed (float64) value is actually used
+        pair_dtype = np.result_type(smoothed_vals, raw_vals) if use_smoothed.any() else raw_vals.dtype
+        pair_vals = np.where(use_smoothed, smoothed_vals, raw_vals).astype(pair_dtype)
+
+        start_days, end_days = pair_day_bounds(df.index, df['time_separation'].values, full_idx)
+        daily_ts = pd.Series(
+            daily_interval_median(start_days, end_days, pair_vals, len(full_idx)),
+            index=full_idx
+        )
 
         # --- STEP 3: DAILY SMOOTHING & GAP RE-MASKING ---
         daily_ts_filled = daily_ts.interpolate(method='time', limit=gap_fill)
@@ -306,19 +779,63 @@ def _process_single_site(ds, geometry, target_crs, buffer, variables, quality_li
             
         trend_on_dates = daily_final 
 
-        output_data[key] = {
-            # 'raw': Full length array (365 days), but mostly Nones. Points only on valid days.
-            "raw": clean_nans(processed_raw_series), 
+        series["variables"][key] = {
+            # 'raw': Full length array (365 days), but mostly NaN. Points only on valid days.
+            "raw": processed_raw_series.values,
             # 'smoothed': Full length array (365 days), values everywhere except large gaps.
-            "smoothed": clean_nans(trend_on_dates)              
+            "smoothed": trend_on_dates.values
         }
 
     return {
         "status": "success",
-        "data": output_data
+        "series": series
     }
 
 
+def _clean_nans(values):
+    """Rounded to 0.1, as a list with None for NaN/inf."""
+    rounded = np.round(values, 1)
+    out = rounded.tolist()
+    for i in np.flatnonzero(~np.isfinite(rounded)).tolist():
+        out[i] = None
+    return out
+
+
+@lru_cache(maxsize=256)
+def _date_strings(start, n_days):
+    return tuple(pd.date_range(start=start, periods=n_days, freq='D').strftime('%Y-%m-%d'))
+
+
+def _series_to_json(series):
+    """Daily series -> the JSON layout: ISO dates and lists rounded to 0.1 with None for gaps."""
+    output_data = {
+        "dates": list(_date_strings(series["start"], series["n_days"])), 
+        "error": _clean_nans(series["error"]),
+        "dt": _clean_nans(series["dt"]),
+        "count": series["count"].tolist()
+    }
+    for key, values in series["variables"].items():
+        output_data[key] = {
+            "raw": _clean_nans(values["raw"]), 
+            "smoothed": _clean_nans(values["smoothed"])
+        }
+    return output_data
+
+
+def _site_payload(site_data, columnar=False):
+    """
+    Final form of a site result. Successful results carry their daily series
+    as arrays ('series') internally; unless columnar is set they're converted
+    to the JSON layout ('data').
+    """
+    if columnar or 'series' not in site_data:
+        return site_data
+    payload = {"status": site_data["status"], "data": _series_to_json(site_data["series"])}
+    if 'meta' in site_data:
+        payload['meta'] = site_data['meta']
+    return payload
+
+
 def _load_input_to_gdf(loc_input):
     if isinstance(loc_input, (str, Path)):
         path_str = str(loc_input)
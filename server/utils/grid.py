@@ -0,0 +1,121 @@
+import math
+import numpy as np
+import shapely
+from affine import Affine
+from pyproj import Transformer
+from rasterio.features import rasterize
+
+# Fraction of a pixel within which an arithmetic index counts as a whole number
+# (absorbs float error when a bound sits exactly on a pixel centre)
+_INDEX_TOLERANCE = 1e-6
+
+
+class GridDescriptor:
+    """
+    Geometry of one store's x/y grid, worked out once per store:
+    a cached lon/lat -> store CRS Transformer, the affine transform, extents
+    and orientation. Maps projected coordinates to positional pixel indices
+    arithmetically (for use with isel) instead of label lookups.
+
+    Irregular grids fall back to index lookups with the same results as
+    ds.sel(..., method='nearest') and ds.sel(x=slice, y=slice).
+    """
+
+    def __init__(self, x_index, y_index, crs):
+        self.crs = crs
+        self.x_index = x_index
+        self.y_index = y_index
+        self.nx, self.ny = len(x_index), len(y_index)
+
+        x_vals = np.asarray(x_index, dtype=np.float64)
+        y_vals = np.asarray(y_index, dtype=np.float64)
+        self.x_min, self.x_max = float(x_vals.min()), float(x_vals.max())
+        self.y_min, self.y_max = float(y_vals.min()), float(y_vals.max())
+        self.y_descending = bool(y_vals[0] > y_vals[-1])
+
+        # Pixel centres: x = x0 + ix * dx, y = y0 + iy * dy (dy < 0 when y descends)
+        self.x0, self.y0 = float(x_vals[0]), float(y_vals[0])
+        self.dx = float(x_vals[1] - x_vals[0]) if self.nx > 1 else 1.0
+        self.dy = float(y_vals[1] - y_vals[0]) if self.ny > 1 else -1.0
+        self.regular = (
+            self.dx != 0 and self.dy != 0
+            and np.allclose(np.diff(x_vals), self.dx, rtol=0, atol=abs(self.dx) * 1e-6)
+            and np.allclose(np.diff(y_vals), self.dy, rtol=0, atol=abs(self.dy) * 1e-6)
+        )
+
+        # Affine transform of the pixel corners (rasterio convention)
+        self.transform = Affine(self.dx, 0.0, self.x0 - self.dx / 2, 0.0, self.dy, self.y0 - self.dy / 2)
+        self.transformer = Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+
+    @classmethod
+    def from_dataset(cls, ds, crs):
+        return cls(ds.indexes['x'], ds.indexes['y'], crs)
+
+    # --- Coordinates ---
+
+    def project(self, geometries):
+        """Array of lon/lat shapely geometries -> the same geometries in the store CRS."""
+        return shapely.transform(
+            np.asarray(geometries, dtype=object),
+            lambda coords: np.column_stack(self.transformer.transform(coords[:, 0], coords[:, 1]))
+        )
+
+    def contains(self, px, py):
+        return (self.x_min <= px <= self.x_max) and (self.y_min <= py <= self.y_max)
+
+    # --- Pixel indexing ---
+
+    def nearest(self, px, py):
+        """(iy, ix) of the pixel centre nearest to a projected point."""
+        if not self.regular:
+            ix = int(self.x_index.get_indexer([px], method='nearest')[0])
+            iy = int(self.y_index.get_indexer([py], method='nearest')[0])
+            return iy, ix
+        ix = min(max(int(round((px - self.x0) / self.dx)), 0), self.nx - 1)
+        iy = min(max(int(round((py - self.y0) / self.dy)), 0), self.ny - 1)
+        return iy, ix
+
+    def window(self, minx, miny, maxx, maxy):
+        """
+        (ys, xs) positional slices of the pixels whose centres fall inside the
+        bounds (inclusive), or None if there are none.
+        """
+        if not self.regular:
+            y_lo, y_hi = (maxy, miny) if self.y_descending else (miny, maxy)
+            try:
+                xs = self.x_index.slice_indexer(minx, maxx)
+                ys = self.y_index.slice_indexer(y_lo, y_hi)
+            except Exception:
+                return None
+        else:
+            xs = self._axis_slice(minx, maxx, self.x0, self.dx, self.nx)
+            ys = self._axis_slice(miny, maxy, self.y0, self.dy, self.ny)
+        if len(range(*xs.indices(self.nx))) == 0 or len(range(*ys.indices(self.ny))) == 0:
+            return None
+        return ys, xs
+
+    def mask(self, geometry, window):
+        """
+        Boolean array over a window from window(): True for the pixels whose
+        centres fall inside the (projected) geometry.
+        """
+        ys, xs = window
+        y_start, y_stop, _ = ys.indices(self.ny)
+        x_start, x_stop, _ = xs.indices(self.nx)
+        shape = (y_stop - y_start, x_stop - x_start)
+        if self.regular:
+            transform = self.transform * Affine.translation(x_start, y_start)
+            burned = rasterize([geometry], out_shape=shape, transform=transform, fill=0, default_value=1, dtype='uint8')
+            return burned.astype(bool)
+        xx, yy = np.meshgrid(self.x_index[x_start:x_stop], self.y_index[y_start:y_stop])
+        return shapely.contains_xy(geometry, xx, yy)
+
+    @staticmethod
+    def _axis_slice(lo, hi, origin, step, n):
+        a, b = (lo - origin) / step, (hi - origin) / step
+        if step < 0:
+            a, b = b, a
+        start = math.ceil(a - _INDEX_TOLERANCE)
+        stop = math.floor(b + _INDEX_TOLERANCE) + 1
+        start, stop = max(start, 0), min(stop, n)
+        return slice(start, max(stop, start))
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+
+def daily_interval_median(start_days, end_days, values, n_days):
+    """
+    Per-day median over a set of overlapping [start, end] day intervals.
+
+    Each interval i contributes values[i] to every day from start_days[i] to
+    end_days[i] inclusive (integer offsets into a daily axis of length n_days).
+    Days outside [0, n_days) are dropped; NaN values or bounds are ignored.
+
+    This is the array equivalent of building a pd.date_range per image pair,
+    concatenating them and running groupby('date').median(): the intervals are
+    expanded with np.repeat, sorted once by (day, value) and the middle
+    element(s) of each day are picked out directly.
+
+    Returns a float array of length n_days with NaN on days no interval covers.
+    """
+    start_days = np.asarray(start_days, dtype=np.float64)
+    end_days = np.asarray(end_days, dtype=np.float64)
+    values = np.asarray(values)
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(np.float64)
+
+    if not (~np.isnan(values)).any():
+        # No value at all: the old loop had nothing to group and returned a float64 series
+        return np.full(max(n_days, 0), np.nan)
+
+    out = np.full(n_days, np.nan, dtype=values.dtype)
+    if n_days <= 0:
+        return out
+
+    keep = np.isfinite(values) & np.isfinite(start_days) & np.isfinite(end_days)
+    if not keep.any():
+        return out
+
+    # Clip to the daily axis (same as reindexing onto full_idx afterwards)
+    starts = np.maximum(start_days[keep].astype(np.int64), 0)
+    ends = np.minimum(end_days[keep].astype(np.int64), n_days - 1)
+    lengths = ends - starts + 1
+    vals = values[keep]
+
+    covering = lengths > 0
+    if not covering.any():
+        return out
+    starts, lengths, vals = starts[covering], lengths[covering], vals[covering]
+
+    # Expand every interval into one (day, value) row per covered day
+    total = int(lengths.sum())
+    first_row = np.cumsum(lengths) - lengths
+    days = np.repeat(starts, lengths) + (np.arange(total) - np.repeat(first_row, lengths))
+    day_vals = np.repeat(vals, lengths)
+
+    # Sort by day, then by value within each day
+    order = np.lexsort((day_vals, days))
+    day_vals = day_vals[order]
+
+    counts = np.bincount(days, minlength=n_days)
+    group_start = np.cumsum(counts) - counts
+    covered = counts > 0
+
+    lo = group_start[covered] + (counts[covered] - 1) // 2
+    hi = group_start[covered] + counts[covered] // 2
+    out[covered] = (day_vals[lo] + day_vals[hi]) / 2
+    return out
+
+
+def pair_day_bounds(mid_dates, time_separation, full_idx):
+    """
+    Converts image-pair mid dates + separations (days) into day offsets on
+    full_idx: start = floor(mid - dt/2), end = ceil(mid + dt/2).
+
+    Returns float arrays; NaN marks pairs whose interval can't be placed on
+    full_idx (missing separation, or a daily axis that isn't midnight-aligned,
+    in which case no calendar day lands on it).
+    """
+    time_sep_days = pd.to_timedelta(np.asarray(time_separation), unit='D')
+    starts = (mid_dates - (time_sep_days / 2)).floor('D')
+    ends = (mid_dates + (time_sep_days / 2)).ceil('D')
+
+    one_day_ns = pd.Timedelta(days=1).value
+    origin = full_idx[0]
+
+    def _to_days(edges):
+        offset = (edges - origin)
+        valid = ~offset.isna()
+        offset_ns = np.asarray(offset.as_unit('ns').asi8, dtype=np.int64)
+        days = np.full(len(offset_ns), np.nan)
+        on_grid = valid & (offset_ns % one_day_ns == 0)
+        days[on_grid] = offset_ns[on_grid] // one_day_ns
+        return days
+
+    return _to_days(starts), _to_days(ends)
@@ -0,0 +1,162 @@
+"""
+Background extraction jobs (POST /api/timeseries/upload?job=true, then
+/api/jobs/{job_id}).
+
+Jobs, their progress and their results live in the memory of the worker
+process that accepted the upload, and run on that process's JOB_EXECUTOR.
+With several uvicorn workers (e.g. sharing SHIVER_SHARED_CACHE) another
+worker doesn't know the job: a status, cancel or results request that
+lands there gets a 404. Run the job endpoints on a single worker, or route
+/api/jobs/* to the worker that created the job (sticky sessions). Jobs also
+don't survive a restart.
+"""
+import os
+import time
+import uuid
+import threading
+
+from .executors import BoundedExecutor
+from .extract_zarr_ts import iter_glacier_timeseries, _load_input_to_gdf
+
+
+# Background extraction jobs run on their own pool, so a long batch never
+# holds a web worker or the interactive extraction pool.
+JOB_EXECUTOR = BoundedExecutor(
+    "jobs",
+    max_workers=int(os.getenv("SHIVER_JOB_WORKERS", "2")),
+    max_queue=int(os.getenv("SHIVER_JOB_QUEUE", "32")),
+    retry_after=30
+)
+JOB_TTL = float(os.getenv("SHIVER_JOB_TTL", "3600")) # Seconds a finished job is kept
+JOB_BATCH_SIZE = int(os.getenv("SHIVER_JOB_BATCH", "16"))
+
+FINISHED = ("done", "failed", "cancelled")
+
+
+class Job:
+    """
+    One background extraction: status, per-site progress and the results
+    collected so far. Status goes queued -> running -> done/failed/cancelled.
+    """
+
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = "queued"
+        self.message = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.total = None
+        self.succeeded = 0
+        self.failed = 0
+        self.results = {}
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self, location_input, cleanup=None):
+        try:
+            if self._cancel.is_set():
+                return self._finish("cancelled")
+            with self._lock:
+                self.status = "running"
+                self.started = time.time()
+
+            gdf = _load_input_to_gdf(location_input)
+            if cleanup:
+                # The upload isn't needed once parsed
+                cleanup()
+                cleanup = None
+            with self._lock:
+                self.total = len(gdf)
+
+            sites = iter_glacier_timeseries(gdf, batch_size=JOB_BATCH_SIZE, **self.params)
+            for site_name, site_data in sites:
+                with self._lock:
+                    self.results[site_name] = site_data
+                    if site_data.get("status") == "success": self.succeeded += 1
+                    else: self.failed += 1
+                if self._cancel.is_set():
+                    sites.close()
+                    return self._finish("cancelled")
+            self._finish("done")
+        except Exception as e:
+            print(f"❌ Job {self.id} failed: {e}")
+            self._finish("failed", str(e))
+        finally:
+            if cleanup: cleanup()
+
+    def _finish(self, status, message=None):
+        with self._lock:
+            self.status = status
+            self.message = message
+            self.finished = time.time()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def expired(self, now):
+        return self.finished is not None and now - self.finished > JOB_TTL
+
+    def to_dict(self):
+        with self._lock:
+            completed = self.succeeded + self.failed
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "message": self.message,
+                "progress": {
+                    "total": self.total,
+                    "completed": completed,
+                    "succeeded": self.succeeded,
+                    "failed": self.failed,
+                    "fraction": round(completed / self.total, 3) if self.total else None,
+                },
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+                "expires": self.finished + JOB_TTL if self.finished else None,
+            }
+
+
+class JobManager:
+    """
+    In-process job registry (one per worker, see the module docstring).
+    Finished jobs are dropped JOB_TTL seconds after they end.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, location_input, params, cleanup=None):
+        """Queues a job (raises ExecutorBusy when the job queue is full)."""
+        self._purge()
+        job = Job(params)
+        self.executor.submit(job.run, location_input, cleanup)
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        self._purge()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _purge(self):
+        now = time.time()
+        with self._lock:
+            for job_id in [j for j, job in self._jobs.items() if job.expired(now)]:
+                del self._jobs[job_id]
+
+    def stats(self):
+        self._purge()
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
+
+
+JOBS = JobManager(JOB_EXECUTOR)
@@ -0,0 +1,292 @@
+"""
+Request instrumentation: per-stage timings for each request, reported back
+in a Server-Timing header and aggregated into histograms that /metrics
+exports in the Prometheus text format (with cache and executor gauges).
+
+Code marks a stage with `with timed("smooth"): ...`. Stages are collected
+per request through a context variable (BoundedExecutor copies it into its
+worker threads), so library code doesn't need to know about requests.
+Stages that run outside a request (background jobs, CLI tools) go straight
+to the histograms under route="background".
+"""
+import math
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Seconds; tiles and cache hits sit at the low end, cold batch extractions at the top
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Thread-safe Prometheus-style histogram with labels."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series = {} # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]!r}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Histograms plus collectors: callables run at scrape time that return
+    [(name, type, help, [(labels dict, value), ...]), ...], for values that
+    already live elsewhere (cache and executor stats).
+    """
+
+    def __init__(self):
+        self.histograms = []
+        self.collectors = []
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        histogram = Histogram(name, documentation, labelnames, buckets)
+        self.histograms.append(histogram)
+        return histogram
+
+    def collector(self, func):
+        self.collectors.append(func)
+        return func
+
+    def expose(self):
+        lines = []
+        for histogram in self.histograms:
+            lines += histogram.expose()
+        families = {}
+        for collect in self.collectors:
+            try:
+                for name, kind, documentation, samples in collect():
+                    family = families.setdefault(name, (kind, documentation, []))
+                    family[2].extend(samples)
+            except Exception as e:
+                print(f"⚠️ Metrics collector failed: {e}")
+        for name, (kind, documentation, samples) in families.items():
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+            for labels, value in samples:
+                if value is None:
+                    continue
+                lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "shiver_stage_seconds", "Time spent per request stage.", ("route", "stage")
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "shiver_request_seconds", "Time to the end of each HTTP response.", ("route", "method", "status")
+)
+
+
+# --- Per-request stage timings ---
+
+class RequestTimings:
+    """Stage timings of one request (a stage that runs several times is summed)."""
+
+    def __init__(self):
+        self.stages = {} # name -> [seconds, count]
+        self.observations = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            total = self.stages.setdefault(stage, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+            self.observations.append((stage, seconds))
+
+    def header(self, total=None):
+        """Server-Timing value, e.g. 'open;dur=0.4, smooth;dur=12.1;desc="x3"'."""
+        with self._lock:
+            parts = []
+            for stage, (seconds, count) in self.stages.items():
+                part = f"{stage};dur={seconds * 1e3:.1f}"
+                if count > 1:
+                    part += f';desc="x{count}"'
+                parts.append(part)
+        if total is not None:
+            parts.append(f"total;dur={total * 1e3:.1f}")
+        return ", ".join(parts)
+
+    def flush(self, route):
+        with self._lock:
+            observations, self.observations = self.observations, []
+        for stage, seconds in observations:
+            STAGE_SECONDS.observe((route, stage), seconds)
+
+
+_CURRENT = contextvars.ContextVar("shiver_request_timings", default=None)
+
+
+def record_stage(stage, seconds):
+    timings = _CURRENT.get()
+    if timings is not None:
+        timings.record(stage, seconds)
+    else:
+        STAGE_SECONDS.observe(("background", stage), seconds)
+
+
+@contextmanager
+def timed(stage):
+    """Times the enclosed block as one stage of the current request."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - t0)
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware: collects the stage timings of each HTTP request, adds
+    them as a Server-Timing header when the response starts, and records
+    them (plus the request duration) under the matched route's path.
+    Streaming responses only report the stages finished before their first
+    byte in the header; the histograms get everything.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timings = RequestTimings()
+        token = _CURRENT.set(timings)
+        t0 = time.perf_counter()
+        status = [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.header(time.perf_counter() - t0).encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _CURRENT.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            timings.flush(route)
+            REQUEST_SECONDS.observe((route, scope.get("method", ""), str(status[0])), time.perf_counter() - t0)
+
+
+# --- Collectors for stats kept elsewhere ---
+
+# stats() key -> (metric, type, help); TTLCache 'size' is in bytes for every cache we export
+_CACHE_METRICS = {
+    "hits": ("shiver_cache_hits_total", "counter", "Cache hits."),
+    "disk_hits": ("shiver_cache_disk_hits_total", "counter", "Cache hits served from the disk tier."),
+    "shared_hits": ("shiver_cache_shared_hits_total", "counter", "Cache hits served from the cross-worker shared tier."),
+    "misses": ("shiver_cache_misses_total", "counter", "Cache misses."),
+    "expired": ("shiver_cache_expired_total", "counter", "Entries dropped at lookup because their TTL ran out."),
+    "evictions": ("shiver_cache_evictions_total", "counter", "Entries pushed out by the size limit."),
+    "entries": ("shiver_cache_entries", "gauge", "Entries held."),
+    "bytes": ("shiver_cache_bytes", "gauge", "Bytes held."),
+    "size": ("shiver_cache_bytes", "gauge", "Bytes held."),
+    "hit_rate": ("shiver_cache_hit_ratio", "gauge", "Hits per lookup since start."),
+}
+
+
+def cache_collector(caches):
+    """Collector for {name: cache with stats()} (TileCache / TTLCache)."""
+    def collect():
+        families = {}
+        for cache_name, cache in caches.items():
+            for key, value in cache.stats().items():
+                if key in _CACHE_METRICS:
+                    name, kind, documentation = _CACHE_METRICS[key]
+                    families.setdefault(name, (kind, documentation, []))[2].append(({"cache": cache_name}, value))
+        return [(name, kind, documentation, samples) for name, (kind, documentation, samples) in families.items()]
+    return collect
+
+
+def executor_collector(executors):
+    """Collector for BoundedExecutors: queue depth, running work and rejections."""
+    def collect():
+        queued, in_flight, workers, rejected = [], [], [], []
+        for executor in executors:
+            stats = executor.stats()
+            labels = {"executor": executor.name}
+            queued.append((labels, stats["queued"]))
+            in_flight.append((labels, stats["in_flight"]))
+            workers.append((labels, stats["workers"]))
+            rejected.append((labels, stats["rejected"]))
+        return [
+            ("shiver_executor_queued", "gauge", "Work waiting for a worker.", queued),
+            ("shiver_executor_in_flight", "gauge", "Work currently running.", in_flight),
+            ("shiver_executor_workers", "gauge", "Worker threads.", workers),
+            ("shiver_executor_rejected_total", "counter", "Submissions refused with 503 (queue full).", rejected),
+        ]
+    return collect
+
+
+def flight_collector(flights):
+    """Collector for SingleFlights: calls, computations and the work coalescing saved."""
+    def collect():
+        calls, executions, shared, saved, in_flight = [], [], [], [], []
+        for flight in flights:
+            stats = flight.stats()
+            labels = {"flight": flight.name}
+            calls.append((labels, stats["calls"]))
+            executions.append((labels, stats["executions"]))
+            shared.append((labels, stats["shared"]))
+            saved.append((labels, stats["saved_s"]))
+            in_flight.append((labels, stats["in_flight"]))
+        return [
+            ("shiver_singleflight_calls_total", "counter", "Calls that went through coalescing.", calls),
+            ("shiver_singleflight_executions_total", "counter", "Computations actually run.", executions),
+            ("shiver_singleflight_shared_total", "counter", "Calls answered by another call's computation.", shared),
+            ("shiver_singleflight_saved_seconds_total", "counter", "Computation time not repeated thanks to sharing.", saved),
+            ("shiver_singleflight_in_flight", "gauge", "Computations running now.", in_flight),
+        ]
+    return collect
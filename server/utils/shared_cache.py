@@ -0,0 +1,234 @@
+"""
+Cache tier shared by every worker process on a node.
+
+With several uvicorn workers each in-memory cache (TileCache, TTLCache) is
+per process: a tile rendered by one worker is cold in the others. A
+CacheBackend sits behind those memory caches; SQLiteCache is the on-disk
+implementation, one SQLite file (WAL mode) that all workers open:
+
+- writes are transactions, so a reader never sees a half-written entry,
+  whichever worker wrote it;
+- the file is bounded by SHIVER_SHARED_CACHE_MB; the least recently used
+  entries (and anything expired) are evicted by the writer that goes over;
+- entries live in namespaces. Tiles use one per source file version, and
+  time-series keys carry the store version, so a new version of the data
+  never reads old entries (they age out through the LRU).
+
+Background jobs are not shared between workers (see utils/jobs.py).
+
+Enable it with SHIVER_SHARED_CACHE=/path/to/cache.sqlite. Values are pickled:
+the file is as trusted as the server's own memory, keep it on a private path.
+"""
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+SHARED_CACHE_PATH = os.getenv("SHIVER_SHARED_CACHE")
+SHARED_CACHE_MB = int(os.getenv("SHIVER_SHARED_CACHE_MB", "1024"))
+
+# Bumped when the layout of cached values changes, so old entries aren't unpickled
+CACHE_FORMAT = 1
+
+# Eviction frees down to this share of max_bytes, so it doesn't run on every put
+LOW_WATERMARK = 0.9
+# A hit only refreshes an entry's LRU position if it is older than this (seconds),
+# so most hits stay read-only
+TOUCH_INTERVAL = 60.0
+
+
+class CacheBackend(ABC):
+    """
+    Byte store under the memory caches: get/put of bytes by (namespace, key),
+    both strings. Implementations must be safe across threads and processes.
+    """
+
+    @abstractmethod
+    def get(self, namespace, key):
+        """The bytes stored under (namespace, key), or None if missing or expired."""
+
+    @abstractmethod
+    def put(self, namespace, key, value, ttl=None):
+        """Stores value (bytes), expiring after ttl seconds if given."""
+
+    def stats(self):
+        return {}
+
+    def get_object(self, namespace, key):
+        """get() for a pickled value; undecodable entries count as misses."""
+        blob = self.get(namespace, key)
+        if blob is None:
+            return None
+        try:
+            return pickle.loads(blob)
+        except Exception:
+            return None
+
+    def put_object(self, namespace, key, value, ttl=None):
+        self.put(namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ttl)
+
+
+class SQLiteCache(CacheBackend):
+    """
+    CacheBackend in one SQLite file, shared by every process that opens it.
+    Connections are per thread (and per process, as forked workers can't
+    reuse their parent's).
+    """
+
+    def __init__(self, path, max_bytes=SHARED_CACHE_MB * 1024 * 1024, timeout=10.0):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires REAL,
+                    accessed REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                );
+                CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+                CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+                INSERT OR IGNORE INTO usage VALUES (0, 0);
+            """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL") # A crash may lose recent entries, never corrupt the file
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def get(self, namespace, key):
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, expires, accessed FROM entries WHERE namespace=? AND key=?", (namespace, key)
+            ).fetchone()
+            if row is not None and row[1] is not None and row[1] < now:
+                row = None
+            if row is not None and now - row[2] > TOUCH_INTERVAL:
+                conn.execute("UPDATE entries SET accessed=? WHERE namespace=? AND key=?", (now, namespace, key))
+        except sqlite3.Error as e:
+            self._count("errors")
+            print(f"⚠️ Shared cache read failed: {e}")
+            return None
+
+        self._count("hits" if row is not None else "misses")
+        return row[0] if row is not None else None
+
+    def put(self, namespace, key, value, ttl=None):
+        now = time.time()
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        expires = now + ttl if ttl is not None else None
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                old = conn.execute("SELECT size FROM entries WHERE namespace=? AND key=?", (namespace, key)).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                    (namespace, key, sqlite3.Binary(value), size, expires, now)
+                )
+                conn.execute("UPDATE usage SET bytes = bytes + ? WHERE id = 0", (size - (old[0] if old else 0),))
+                total = conn.execute("SELECT bytes FROM usage WHERE id = 0").fetchone()[0]
+                if total > self.max_bytes:
+                    self._evict(conn, total, now)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            self._count("errors")
+            print(f"⚠️ Shared cache write failed: {e}")
+
+    def _evict(self, conn, total, now):
+        """Drops expired entries, then least recently used ones, down to the low watermark (in the put's transaction)."""
+        target = int(self.max_bytes * LOW_WATERMARK)
+        freed = conn.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM entries WHERE expires < ?", (now,)).fetchone()
+        conn.execute("DELETE FROM entries WHERE expires < ?", (now,))
+        total -= freed[0]
+        evicted = freed[1]
+
+        while total > target:
+            rows = conn.execute("SELECT rowid, size FROM entries ORDER BY accessed LIMIT 256").fetchall()
+            if not rows:
+                break
+            victims = []
+            for rowid, size in rows:
+                if total <= target:
+                    break
+                victims.append((rowid,))
+                total -= size
+            conn.executemany("DELETE FROM entries WHERE rowid=?", victims)
+            evicted += len(victims)
+
+        conn.execute("UPDATE usage SET bytes = ? WHERE id = 0", (max(total, 0),))
+        self._count("evictions", evicted)
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM entries")
+        conn.execute("UPDATE usage SET bytes = 0 WHERE id = 0")
+        conn.execute("COMMIT")
+
+    def stats(self):
+        try:
+            entries, size = self._conn().execute(
+                "SELECT (SELECT COUNT(*) FROM entries), (SELECT bytes FROM usage WHERE id = 0)"
+            ).fetchone()
+        except sqlite3.Error:
+            entries = size = None
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": str(self.path),
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits, # this process only, like every counter here
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "errors": self.errors,
+            }
+
+
+def open_shared_cache(path=SHARED_CACHE_PATH):
+    """The node's SQLiteCache, or None when SHIVER_SHARED_CACHE isn't set or the file can't be opened."""
+    if not path:
+        return None
+    try:
+        cache = SQLiteCache(path)
+        print(f"🗄️ Shared cache: {path} ({cache.max_bytes // (1024 * 1024)} MB)")
+        return cache
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️ Could not open shared cache {path}: {e}")
+        return None
+
+
+SHARED_CACHE = open_shared_cache()
@@ -0,0 +1,72 @@
+"""
+Coalescing of identical concurrent work ("single flight"): the first caller
+for a key runs the computation, callers that arrive while it is running
+wait for it and get the same result (or exception) instead of computing it
+again. Nothing is kept once the computation finishes, that's the caches' job.
+
+Typical case: a class opening the map at once, all asking for the same
+first tiles and the same demo glacier within a few hundred milliseconds.
+"""
+import time
+import asyncio
+import threading
+
+from .metrics import record_stage
+
+
+class SingleFlight:
+    """
+    Coalesces coroutines on the event loop (do_async): followers await the
+    leader's task, so they don't hold an executor slot while they wait.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._tasks = {}  # key -> [asyncio.Task, waiters]
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.shared = 0
+        self.saved_seconds = 0.0 # leader run time, once per follower that didn't redo it
+
+    async def do_async(self, key, func, *args, **kwargs):
+        """await func(*args, **kwargs), shared with any identical coroutine already running."""
+        with self._lock:
+            self.calls += 1
+            entry = self._tasks.get(key)
+            leader = entry is None
+            if leader:
+                # A task of its own: a leader that disconnects doesn't cancel it for the followers
+                t0 = time.perf_counter()
+                entry = self._tasks[key] = [asyncio.ensure_future(func(*args, **kwargs)), 0]
+                entry[0].add_done_callback(lambda task: self._finish_task(key, entry, t0))
+            else:
+                entry[1] += 1
+                self.shared += 1
+
+        t0 = time.perf_counter()
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            if not leader:
+                record_stage("coalesced", time.perf_counter() - t0)
+
+    def _finish_task(self, key, entry, t0):
+        task, waiters = entry
+        with self._lock:
+            if self._tasks.get(key) is entry:
+                del self._tasks[key]
+            self.executions += 1
+            self.saved_seconds += waiters * (time.perf_counter() - t0)
+        if not task.cancelled():
+            task.exception() # Retrieved even if every waiter has gone, no "never retrieved" warning
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "shared": self.shared,
+                "in_flight": len(self._tasks),
+                "saved_s": round(self.saved_seconds, 3),
+            }
@@ -0,0 +1,140 @@
+"""
+Memory-bounded spatial median for large windows and polygons.
+
+subset.median(dim=['x', 'y']) over a big outline has dask pull in the whole
+(time x y x) cube for every variable at once. blockwise_spatial_median walks
+the store along time instead, a few time chunks at a time within a byte
+budget, and reduces each block to its per-date medians and valid-pixel counts
+before loading the next. Blocks follow the store's own (unsorted) time chunks,
+so each chunk is read once; the per-date rows are put back into time order at
+the end. The median of a date doesn't depend on its neighbours, so the result
+is identical to the one-pass computation.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+# Bytes of pixel data one large-site extraction may hold at once (all parallel blocks together)
+MEDIAN_MEMORY_MB = int(os.getenv("SHIVER_MEDIAN_MEMORY_MB", "256"))
+# Time blocks reduced in parallel (each gets an equal share of the budget)
+MEDIAN_WORKERS = int(os.getenv("SHIVER_MEDIAN_WORKERS", "1"))
+
+
+def selection_bytes(ds, variables, n_pixels):
+    """Bytes a (time x n_pixels) read of the spatial variables would take in memory."""
+    per_step = sum(ds[v].dtype.itemsize for v in variables if 'x' in ds[v].dims and 'y' in ds[v].dims)
+    return per_step * n_pixels * ds.sizes['time']
+
+
+def time_blocks(ds, variables, n_pixels, budget_bytes):
+    """
+    [(start, stop), ...] positional time ranges covering ds: whole time chunks
+    grouped up to budget_bytes, a chunk on its own split into slices when even
+    it is over budget.
+    """
+    n_time = ds.sizes['time']
+    per_step = max(selection_bytes(ds, variables, n_pixels) // max(n_time, 1), 1)
+    max_steps = max(int(budget_bytes // per_step), 1)
+
+    chunks = None
+    for v in variables:
+        var = ds[v]
+        if var.chunks and 'time' in var.dims:
+            chunks = var.chunks[var.dims.index('time')]
+            break
+    edges = np.concatenate([[0], np.cumsum(chunks)]) if chunks else np.array([0, n_time])
+
+    blocks = []
+    start = 0
+    for chunk_start, stop in zip(edges[:-1].tolist(), edges[1:].tolist()):
+        if stop - start <= max_steps:
+            continue
+        # Close the block before this chunk (if it holds anything), then split oversize chunks
+        if chunk_start > start:
+            blocks.append((start, chunk_start))
+            start = chunk_start
+        while stop - start > max_steps:
+            blocks.append((start, start + max_steps))
+            start += max_steps
+    if start < n_time:
+        blocks.append((start, n_time))
+    return blocks
+
+
+def budget_groups(sizes, budget_bytes):
+    """
+    [[position, ...], ...]: consecutive runs of sizes whose total stays within
+    budget_bytes, so each run can be computed in one pass. An item over budget
+    on its own gets a group of its own.
+    """
+    groups, total = [], 0
+    for position, size in enumerate(sizes):
+        if not groups or total + size > budget_bytes:
+            groups.append([])
+            total = 0
+        groups[-1].append(position)
+        total += size
+    return groups
+
+
+def blockwise_spatial_median(source, time_order, variables, count_vars, indexers, dims,
+                             budget_bytes=None, workers=None):
+    """
+    Spatial median of source[variables].isel(**indexers) over dims, and the
+    valid-pixel count of each of count_vars, block by block along time.
+
+    source is the store as laid out on disk and time_order the positions that
+    sort it by time (StoreHandle.source / .time_order); the results come back
+    in that sorted order. Returns (medians, counts) Datasets, like the lazy
+    one-pass computation once loaded.
+    """
+    budget_bytes = budget_bytes or MEDIAN_MEMORY_MB * 1024 * 1024
+    workers = max(workers or MEDIAN_WORKERS, 1)
+
+    subset = source[variables].isel(**indexers)
+    n_pixels = int(np.prod([subset.sizes[d] for d in dims]))
+    blocks = time_blocks(source, variables, n_pixels, budget_bytes // workers)
+
+    def reduce_block(block):
+        start, stop = block
+        data = subset.isel(time=slice(start, stop)).load()
+        return data.median(dim=dims, keep_attrs=True), data[count_vars].count(dim=dims)
+
+    if workers > 1 and len(blocks) > 1:
+        with ThreadPoolExecutor(workers) as pool:
+            reduced = list(pool.map(reduce_block, blocks))
+    else:
+        reduced = [reduce_block(block) for block in blocks]
+
+    medians = xr.concat([m for m, _ in reduced], dim='time', data_vars='all', coords='minimal', compat='override')
+    counts = xr.concat([c for _, c in reduced], dim='time', coords='minimal', compat='override')
+    return medians.isel(time=time_order), counts.isel(time=time_order)
+
+
+def weighted_nanmedian(values, weights):
+    """
+    Row-wise weighted median of a (rows, n) array, ignoring NaN values and
+    zero weights; NaN for rows with nothing left. Integer weights act as
+    repeat counts, so with equal weights this is np.nanmedian (the two
+    middle values are averaged when the halves split exactly).
+    """
+    values = np.asarray(values)
+    weights = np.where(np.isfinite(values), np.asarray(weights), 0)
+    order = np.argsort(np.where(weights > 0, values, np.inf), axis=1, kind='stable')
+    values = np.take_along_axis(values, order, axis=1)
+    cumulative = np.cumsum(np.take_along_axis(weights, order, axis=1), axis=1)
+    total = cumulative[:, -1:] if cumulative.shape[1] else np.zeros((len(values), 1))
+
+    rows = np.arange(len(values))
+    out = np.full(len(values), np.nan, dtype=values.dtype if np.issubdtype(values.dtype, np.floating) else np.float64)
+    has_data = total[:, 0] > 0
+    if not has_data.any():
+        return out
+    # First value reaching half the weight; where it's exactly half, average it with the next one
+    lower = np.argmax(cumulative * 2 >= total, axis=1)
+    upper = np.argmax(cumulative * 2 > total, axis=1)
+    low, high = values[rows, lower], values[rows, upper]
+    out[has_data] = np.where(lower == upper, low, (low + high) / 2)[has_data]
+    return out
@@ -0,0 +1,272 @@
+import os
+import threading
+import numpy as np
+import xarray as xr
+from pathlib import Path
+import platform
+
+from .grid import GridDescriptor
+from .synthetic import SYNTHETIC_DATA, synthetic_store_paths
+
+# --- 1. CONFIGURATION & ENVIRONMENT DETECTION ---
+
+current_os = platform.system()
+
+if SYNTHETIC_DATA:
+    # Generated stand-in data (python -m utils.synthetic), e.g. for benchmarks
+    print(f"🧪 Environment: Synthetic data ({SYNTHETIC_DATA})")
+    DATA_STORES = synthetic_store_paths(SYNTHETIC_DATA)
+elif current_os == "Windows":
+    desktop_gr_path = Path("R:/SCADI/output/Sentinel1/Greenland/mosaic/subregions/lev/date_pair.zarr")
+    desktop_ant_path = Path("R:/SCADI/output/Sentinel1/Antarctica/mosaic/subregions/peninsula/date_pair.zarr")
+
+    if desktop_gr_path.exists():
+        print("🖥️  Environment: Windows (Desktop - Full Data)")
+        DATA_STORES = {
+            'Greenland': {'path': desktop_gr_path, 'crs': "EPSG:3413"},
+            'Antarctica': {'path': desktop_ant_path, 'crs': "EPSG:3031"}
+        }
+    else:
+        print("💻  Environment: Windows (Laptop - Mini Data)")
+        DATA_STORES = {
+            'Greenland': {
+                'path': Path("D:/work/Fellowship_Leeds/SCADI/output/Sentinel1/Greenland/mosaic/subregions/lev/mini_date_pair.zarr"),
+                'crs': "EPSG:3413"
+            },
+            'Antarctica': {
+                'path': Path("D:/work/Fellowship_Leeds/SCADI/output/Sentinel1/Antarctica/mosaic/subregions/peninsula/mini_date_pair.zarr"), 
+                'crs': "EPSG:3031"
+            }
+        }
+else:
+    print("🚀 Environment: Linux (HPC Production)")
+    base_hpc_path = Path("/mnt/parscratch/users/gg1bjd/SCADI/output/Sentinel1")
+    DATA_STORES = {
+        'Greenland': {
+            'path': base_hpc_path / "Greenland/mosaic/subregions/lev/date_pair.zarr",
+            'crs': "EPSG:3413"
+        },
+        'Antarctica': {
+            'path': base_hpc_path / "Antarctica/mosaic/subregions/peninsula/date_pair.zarr",
+            'crs': "EPSG:3031"
+        }
+    }
+
+# Time-major companion stores (see utils/build_timeseries_store.py). Point and
+# small-window reads go to the companion when it exists and is up to date.
+COMPANION_MAX_PIXELS = int(os.getenv("SHIVER_TS_STORE_MAX_PIXELS", str(128 * 128)))
+
+
+def timeseries_path(path):
+    """Companion path for a store: date_pair.zarr -> date_pair_timeseries.zarr."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}_timeseries.zarr")
+
+
+def basins_path(path):
+    """Basin time-series store for a store: date_pair.zarr -> date_pair_basins.zarr."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}_basins.zarr")
+
+
+# Overview levels (see utils/build_overviews.py): coarser copies of the store,
+# as multiples of its pixel size, for resolution-aware reads of large areas
+OVERVIEW_FACTORS = tuple(int(f) for f in os.getenv("SHIVER_OVERVIEW_FACTORS", "5,25").split(",") if f.strip())
+# resolution='auto' only considers sites of at least this many store pixels, and a
+# level only if its cells miss / add at most this share of the site's pixels
+OVERVIEW_MIN_PIXELS = int(os.getenv("SHIVER_OVERVIEW_MIN_PIXELS", "2500"))
+OVERVIEW_TOLERANCE = float(os.getenv("SHIVER_OVERVIEW_TOLERANCE", "0.05"))
+
+
+def overview_path(path, factor):
+    """Overview level of a store: date_pair.zarr -> date_pair_overview_x5.zarr."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}_overview_x{factor}.zarr")
+
+
+class OverviewLevel:
+    """
+    One open overview level: per-cell medians and valid counts of factor x
+    factor blocks of store pixels. Cell (cy, cx) covers store pixels
+    [cy * factor, (cy + 1) * factor) x [cx * factor, (cx + 1) * factor).
+    ds is time-sorted like the store's.
+    """
+
+    def __init__(self, path, factor, ds):
+        self.path = Path(path)
+        self.factor = factor
+        self.ds = ds
+        self.resolution = float(ds.attrs.get('resolution', 0.0))
+        self.name = f"{self.resolution:g}m" if self.resolution else f"x{factor}"
+
+
+# --- 2. STORE REGISTRY ---
+# Each DATA_STORES entry is opened once per process and kept time-sorted, so a
+# map click no longer re-parses the consolidated metadata or re-plans the sort.
+
+_REGISTRY = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def store_version(path):
+    """
+    Cheap fingerprint of a store on disk: mtime + size of its consolidated
+    metadata file (zarr v2 '.zmetadata' or v3 'zarr.json').
+    """
+    path = Path(path)
+    for meta_name in ('.zmetadata', 'zarr.json'):
+        meta_path = path / meta_name
+        if meta_path.exists():
+            stat = meta_path.stat()
+            return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    stat = path.stat()
+    return f"{stat.st_mtime_ns:x}-0"
+
+
+class StoreHandle:
+    """
+    An open, time-sorted view of one region's date_pair.zarr plus the grid
+    extents that every request would otherwise recompute. `source` is the
+    unsorted store and `time_order` the positions that sort it (ds is
+    source.isel(time=time_order)), for reads that follow the on-disk chunks.
+
+    `companion` is the time-major copy of the store (a StoreHandle on the same
+    grid), or None when it is missing, incomplete or built from an older
+    version of the store.
+    """
+
+    def __init__(self, region, path, crs, ts_path=None, overview_factors=()):
+        self.region = region
+        self.path = Path(path)
+        self.crs = crs
+        self.version = store_version(self.path)
+
+        # As laid out on disk, and the time-sorted view every read goes through
+        self.source = xr.open_zarr(self.path, consolidated=True)
+        self.time_order = np.argsort(self.source['time'].values, kind='stable') # what sortby picks
+        self.ds = self.source.isel(time=self.time_order)
+
+        # Transformer, affine, extents and orientation, worked out once
+        self.grid = GridDescriptor.from_dataset(self.ds, crs)
+
+        # Chunk edges along x/y (positional), used to group batch reads
+        self.chunk_edges = {'x': np.array([0, self.ds.sizes['x']]), 'y': np.array([0, self.ds.sizes['y']])}
+        for var in self.ds.data_vars.values():
+            if var.chunks and 'x' in var.dims and 'y' in var.dims:
+                for dim in ('x', 'y'):
+                    sizes = var.chunks[var.dims.index(dim)]
+                    self.chunk_edges[dim] = np.concatenate([[0], np.cumsum(sizes)])
+                break
+
+        self.companion = self._open_companion(ts_path) if ts_path else None
+        # Finest first; only levels built from this version of the store
+        self.overviews = [level for level in map(self._open_overview, sorted(overview_factors)) if level is not None]
+
+    def _open_companion(self, ts_path):
+        if not Path(ts_path).exists():
+            return None
+        try:
+            companion = StoreHandle(self.region, ts_path, self.crs)
+        except Exception as e:
+            print(f"⚠️ Could not open {self.region} time-series store: {e}")
+            return None
+
+        attrs = companion.ds.attrs
+        if attrs.get('source_version') != self.version or not attrs.get('complete'):
+            print(f"⚠️ {self.region} time-series store is stale or incomplete, ignoring it")
+            return None
+        # Positional indices are shared between the two, so the grids must match exactly
+        for dim in ('time', 'y', 'x'):
+            if not companion.ds.indexes[dim].equals(self.ds.indexes[dim]):
+                print(f"⚠️ {self.region} time-series store has a different {dim} axis, ignoring it")
+                return None
+        return companion
+
+    def _open_overview(self, factor):
+        path = overview_path(self.path, factor)
+        if not path.exists():
+            return None
+        try:
+            ds = xr.open_zarr(path, consolidated=True)
+        except Exception as e:
+            print(f"⚠️ Could not open {self.region} overview x{factor}: {e}")
+            return None
+
+        attrs = ds.attrs
+        if attrs.get('source_version') != self.version or not attrs.get('complete') or attrs.get('factor') != factor:
+            print(f"⚠️ {self.region} overview x{factor} is stale or incomplete, ignoring it")
+            return None
+        # Written in the store's on-disk time order: sort it the same way
+        if not np.array_equal(ds['time'].values, self.source['time'].values):
+            print(f"⚠️ {self.region} overview x{factor} has a different time axis, ignoring it")
+            return None
+        return OverviewLevel(path, factor, ds.isel(time=self.time_order))
+
+    def contains(self, px, py):
+        return self.grid.contains(px, py)
+
+    def chunk_ids(self, dim, start, stop):
+        """Chunk numbers along dim covering positional range [start, stop)."""
+        edges = self.chunk_edges[dim]
+        first = int(np.searchsorted(edges, start, side='right')) - 1
+        last = int(np.searchsorted(edges, stop - 1, side='right')) - 1
+        return range(first, last + 1)
+
+    def chunk_of(self, dim, positions):
+        """Chunk number along dim of each positional index in an array."""
+        return np.searchsorted(self.chunk_edges[dim], positions, side='right') - 1
+
+
+def get_store(region):
+    """
+    Returns the open StoreHandle for a region, opening it on first use.
+    Raises KeyError for unknown regions and lets open errors propagate.
+    """
+    handle = _REGISTRY.get(region)
+    if handle is not None:
+        return handle
+
+    with _REGISTRY_LOCK:
+        handle = _REGISTRY.get(region)
+        if handle is None:
+            info = DATA_STORES[region]
+            ts_path = info.get('ts_path') or timeseries_path(info['path'])
+            handle = StoreHandle(region, info['path'], info['crs'], ts_path, OVERVIEW_FACTORS)
+            _REGISTRY[region] = handle
+    return handle
+
+
+def reload_store(region=None):
+    """
+    Drops and re-opens one region (or all regions when region is None).
+    Call this after the store has been rewritten on disk.
+    Returns {region: version or error string}.
+    """
+    regions = [region] if region else list(DATA_STORES.keys())
+    status = {}
+    for name in regions:
+        if name not in DATA_STORES:
+            status[name] = "error: unknown region"
+            continue
+        with _REGISTRY_LOCK:
+            _REGISTRY.pop(name, None)
+        try:
+            status[name] = get_store(name).version
+        except Exception as e:
+            status[name] = f"error: {e}"
+    return status
+
+
+def open_all_stores():
+    """Opens every configured store up front (called at server startup)."""
+    status = {}
+    for name in DATA_STORES:
+        try:
+            handle = get_store(name)
+            status[name] = handle.version
+            companion = "with" if handle.companion is not None else "without"
+            print(f"✅ Opened {name} store ({handle.ds.sizes['time']} time steps, {companion} time-series store)")
+        except Exception as e:
+            status[name] = f"error: {e}"
+            print(f"⚠️ Could not open {name} store: {e}")
+    return status
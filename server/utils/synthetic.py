@@ -0,0 +1,198 @@
+"""
+Synthetic stand-ins for the HPC data: a date_pair.zarr and the three tile
+COGs per region. They have the real layout (variables, CRS, chunking,
+unsorted and duplicated dates, NaN gaps) but made-up values. They are used
+for benchmarks and for running the server away from the HPC mount.
+
+Generate once, then point the server at the directory:
+    python -m utils.synthetic --out /tmp/shiver_synthetic --size small
+    SHIVER_SYNTHETIC_DATA=/tmp/shiver_synthetic python main.py
+
+With SHIVER_SYNTHETIC_DATA set, DATA_STORES (utils/stores.py) and
+TIFF_PATHS (utils/tiles.py) point at <dir>/<region>/ instead of the mount.
+"""
+import os
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import dask.array as da
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.shutil import copy as rio_copy
+from pyproj import Transformer
+
+SYNTHETIC_DATA = os.getenv("SHIVER_SYNTHETIC_DATA")
+
+REGIONS = {
+    'Greenland': {'crs': "EPSG:3413", 'centre': (-50.0, 67.0), 'seed': 1},
+    'Antarctica': {'crs': "EPSG:3031", 'centre': (-64.5, -66.5), 'seed': 2},
+}
+
+# n_time x ny x nx pixels at 200 m, chunked (time, y, x) like the mosaics
+SIZES = {
+    'small': {'n_time': 400, 'ny': 100, 'nx': 120, 'chunks': (100, 50, 50), 'cog_size': 1024},
+    'medium': {'n_time': 1000, 'ny': 256, 'nx': 256, 'chunks': (250, 128, 128), 'cog_size': 2048},
+    'large': {'n_time': 2500, 'ny': 512, 'nx': 512, 'chunks': (250, 256, 256), 'cog_size': 4096},
+}
+
+RESOLUTION = 200.0
+LAYERS = ('speed', 'count', 'trend')
+PAIR_SEPARATIONS = np.array([6, 12, 18, 24, 36], dtype='float32') # Sentinel-1 repeat multiples, days
+
+
+def synthetic_store_paths(root):
+    """DATA_STORES for a synthetic data directory."""
+    root = Path(root)
+    return {region: {'path': root / region / "date_pair.zarr", 'crs': info['crs']} for region, info in REGIONS.items()}
+
+
+def synthetic_tiff_paths(root):
+    """TIFF_PATHS for a synthetic data directory."""
+    root = Path(root)
+    return {region: {layer: root / region / f"{layer}_cog.tif" for layer in LAYERS} for region in REGIONS}
+
+
+def _grid(crs, centre, ny, nx):
+    """Pixel-centre coordinates around a lon/lat centre (y descending, as in the stores)."""
+    cx, cy = Transformer.from_crs("EPSG:4326", crs, always_xy=True).transform(*centre)
+    x = cx + (np.arange(nx) - nx / 2) * RESOLUTION
+    y = cy - (np.arange(ny) - ny / 2) * RESOLUTION
+    return x, y
+
+
+def _base_speed(ny, nx):
+    """A glacier trunk running diagonally across the grid, fast at the terminus, slow on the margins (m/yr)."""
+    yy, xx = np.mgrid[0:ny, 0:nx].astype('float64')
+    along = (xx / nx + yy / ny) / 2
+    across = (xx / nx - yy / ny) * min(nx, ny) * RESOLUTION / np.sqrt(2)
+    trunk = np.exp(-(across / 3000.0) ** 2)
+    return (20 + 1500 * trunk * (0.2 + 0.8 * along)).astype('float32')
+
+
+def _dates(n_time, duplicate_fraction, rng):
+    """Pair mid-dates: random days over ten years, some repeated, in unsorted (processing) order."""
+    n_unique = max(1, int(round(n_time * (1 - duplicate_fraction))))
+    days = rng.choice(3650, n_unique, replace=n_unique > 3650)
+    days = np.concatenate([days, rng.choice(days, n_time - n_unique)])
+    return (pd.Timestamp("2015-01-01") + pd.to_timedelta(rng.permutation(days), unit="D")).values
+
+
+def make_store(path, crs, centre, n_time, ny, nx, chunks, nan_fraction=0.4, duplicate_fraction=0.05, seed=0):
+    """
+    Writes a synthetic date_pair.zarr: s/u/v x filt/raw on (time, y, x), the
+    per-date error and time_separation variables, seasonal and trending
+    speeds, per-date coverage gaps and a few duplicate dates.
+    Written one time chunk at a time, so memory stays at one chunk row.
+    """
+    rng = np.random.default_rng(seed)
+    x, y = _grid(crs, centre, ny, nx)
+    time = _dates(n_time, duplicate_fraction, rng)
+    base = _base_speed(ny, nx)
+    angle = np.deg2rad(35.0)
+
+    per_date = {"time_separation": rng.choice(PAIR_SEPARATIONS, n_time)}
+    for name in ("u_err_rock", "u_err_off_ice", "v_err_rock", "v_err_off_ice"):
+        values = rng.gamma(2.0, 3.0, n_time).astype('float32')
+        values[rng.random(n_time) < 0.3] = np.nan
+        per_date[name] = values
+
+    spatial = [f"{v}_{q}" for v in "suv" for q in ("filt", "raw")]
+    t_chunk = chunks[0]
+    data_vars = {
+        name: (("time", "y", "x"), da.full((n_time, ny, nx), np.nan, dtype='float32', chunks=chunks))
+        for name in spatial
+    }
+    data_vars.update({name: (("time",), da.from_array(values, chunks=t_chunk)) for name, values in per_date.items()})
+    template = xr.Dataset(data_vars, coords={"time": time, "y": y, "x": x})
+    template.to_zarr(path, mode="w", compute=False, consolidated=True, zarr_format=2)
+    template[list(per_date)].drop_vars(["time"]).to_zarr(path, region={"time": slice(None)})
+
+    years = (pd.DatetimeIndex(time) - pd.Timestamp("2015-01-01")).days.values / 365.25
+    for t0 in range(0, n_time, t_chunk):
+        ts = slice(t0, min(t0 + t_chunk, n_time))
+        n = ts.stop - ts.start
+        # Seasonal cycle plus a slow speed-up
+        factor = (1 + 0.15 * np.sin(2 * np.pi * (years[ts] - 0.3)) + 0.02 * years[ts]).astype('float32')
+        truth = base[None] * factor[:, None, None]
+
+        # Per-date coverage: most pairs are partly empty, a few almost entirely
+        coverage = np.clip(rng.beta(2.0, 2.0 * nan_fraction / max(1 - nan_fraction, 1e-3), n), 0.02, 1.0)
+        missing = rng.random((n, ny, nx), dtype='float32') > coverage[:, None, None]
+
+        block = {}
+        raw_s = truth + rng.normal(0, 1, truth.shape).astype('float32') * (0.05 * truth + 10)
+        filt_s = truth + rng.normal(0, 1, truth.shape).astype('float32') * (0.02 * truth + 3)
+        raw_s[missing] = np.nan
+        # Filtering drops a further share of pixels on top of the gaps
+        filt_s[missing | (rng.random(missing.shape, dtype='float32') < 0.1)] = np.nan
+        for q, speed in (("raw", raw_s), ("filt", filt_s)):
+            block[f"s_{q}"] = speed
+            block[f"u_{q}"] = speed * np.float32(np.cos(angle))
+            block[f"v_{q}"] = speed * np.float32(np.sin(angle))
+
+        xr.Dataset({name: (("time", "y", "x"), values) for name, values in block.items()}).to_zarr(
+            path, region={"time": ts, "y": slice(None), "x": slice(None)}
+        )
+    return path
+
+
+def make_cogs(paths, crs, centre, size, seed=0):
+    """Writes the speed / count / trend COGs ({layer: path}) on a size x size 200 m grid."""
+    rng = np.random.default_rng(seed)
+    x, y = _grid(crs, centre, size, size)
+    transform = from_origin(x[0] - RESOLUTION / 2, y[0] + RESOLUTION / 2, RESOLUTION, RESOLUTION)
+
+    speed = _base_speed(size, size)
+    layers = {
+        'speed': speed,
+        'count': np.clip(100 * rng.beta(5, 2, (size, size)), 0, 100).astype('float32'),
+        'trend': (0.02 * speed * rng.normal(1, 0.3, (size, size))).astype('float32'),
+    }
+    profile = dict(
+        driver="GTiff", width=size, height=size, count=1, dtype="float32", crs=crs,
+        transform=transform, nodata=np.nan, tiled=True, blockxsize=256, blockysize=256
+    )
+    for layer, values in layers.items():
+        values[rng.random(values.shape) < 0.05] = np.nan
+        path = Path(paths[layer])
+        with tempfile.TemporaryDirectory(dir=path.parent) as tmp_dir:
+            tmp_path = Path(tmp_dir) / path.name
+            with rasterio.open(tmp_path, "w", **profile) as dst:
+                dst.write(values, 1)
+            rio_copy(tmp_path, path, driver="COG", overview_resampling="average")
+    return paths
+
+
+def generate(root, size='small', force=False):
+    """Generates every region's store and COGs under root (skipping what already exists)."""
+    spec = SIZES[size]
+    stores, tiffs = synthetic_store_paths(root), synthetic_tiff_paths(root)
+    for region, info in REGIONS.items():
+        stores[region]['path'].parent.mkdir(parents=True, exist_ok=True)
+        store_path = stores[region]['path']
+        if force or not store_path.exists():
+            print(f"🧪 {region}: writing {spec['n_time']}x{spec['ny']}x{spec['nx']} synthetic store -> {store_path}")
+            make_store(store_path, info['crs'], info['centre'], spec['n_time'], spec['ny'], spec['nx'],
+                       spec['chunks'], seed=info['seed'])
+        if force or not all(p.exists() for p in tiffs[region].values()):
+            print(f"🧪 {region}: writing {spec['cog_size']}px synthetic COGs")
+            make_cogs(tiffs[region], info['crs'], info['centre'], spec['cog_size'], seed=info['seed'])
+    return stores, tiffs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Zarr stores and COGs for benchmarks and local runs.")
+    parser.add_argument("--out", default=SYNTHETIC_DATA, required=SYNTHETIC_DATA is None, help="Output directory (default: $SHIVER_SYNTHETIC_DATA)")
+    parser.add_argument("--size", default="small", choices=list(SIZES), help="Data size preset (default: small)")
+    parser.add_argument("--force", action="store_true", help="Regenerate even if the files exist")
+    args = parser.parse_args()
+
+    generate(args.out, args.size, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+# Pre-rendered pyramids live here, one MBTiles file per region/layer
+ARCHIVE_DIR = Path(os.getenv("SHIVER_TILE_ARCHIVE_DIR") or Path(__file__).resolve().parent.parent / "tile_archives")
+
+
+def archive_path(region, layer_type):
+    return ARCHIVE_DIR / f"{region}_{layer_type}.mbtiles"
+
+
+class TileArchive:
+    """
+    Read-only view of an MBTiles pyramid written by utils.build_tiles.
+
+    Metadata records the source TIFF version it was rendered from, the zoom
+    range and whether the build completed. SQLite connections are per thread.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._local = threading.local()
+
+        meta = dict(self._conn().execute("SELECT name, value FROM metadata").fetchall())
+        self.source_version = meta.get("source_version")
+        self.minzoom = int(meta.get("minzoom", 0))
+        self.maxzoom = int(meta.get("maxzoom", -1))
+        self.complete = meta.get("complete") == "1"
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    def covers(self, version, z):
+        return self.complete and version == self.source_version and self.minzoom <= z <= self.maxzoom
+
+    def get(self, z, x, y):
+        """PNG bytes for a tile, or None if the archive has no such tile."""
+        tms_y = (1 << z) - 1 - y # MBTiles rows are TMS (flipped y)
+        row = self._conn().execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+            (z, x, tms_y)
+        ).fetchone()
+        return row[0] if row else None
+
+
+_ARCHIVES = {}
+_ARCHIVES_LOCK = threading.Lock()
+
+
+def get_archive(region, layer_type):
+    """
+    The open archive for a layer, or None when there isn't one. Re-opens the
+    file if it has been rebuilt since it was last opened.
+    """
+    path = archive_path(region, layer_type)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+    entry = _ARCHIVES.get((region, layer_type))
+    if entry is not None and entry[0] == mtime:
+        return entry[1]
+
+    with _ARCHIVES_LOCK:
+        entry = _ARCHIVES.get((region, layer_type))
+        if entry is None or entry[0] != mtime:
+            try:
+                archive = TileArchive(path)
+            except (OSError, sqlite3.Error) as e:
+                print(f"⚠️ Could not open tile archive {path.name}: {e}")
+                archive = None
+            entry = (mtime, archive)
+            _ARCHIVES[(region, layer_type)] = entry
+    return entry[1]
@@ -0,0 +1,144 @@
+import os
+import hashlib
+import threading
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+
+from .shared_cache import CACHE_FORMAT
+
+
+def file_version(path):
+    """
+    Fingerprint of a source file (mtime + size). Goes into every cache key and
+    versioned tile URL, so a regenerated TIFF invalidates its tiles.
+    """
+    stat = Path(path).stat()
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def make_etag(content: bytes):
+    """Strong ETag from the encoded tile bytes."""
+    return '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+
+
+class TileCache:
+    """
+    LRU cache of rendered tiles: (content, etag) keyed by
+    (region, layer, version, z, x, y).
+
+    Memory tier is bounded by total bytes. The optional disk tier (disk_dir)
+    survives restarts; files are written atomically and laid out per version,
+    so stale versions are simply never read again. The optional shared tier
+    (a CacheBackend, see utils/shared_cache.py) is shared by every worker on
+    the node and size-bounded, with one namespace per source version.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_dir=None, shared=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _disk_path(self, key):
+        region, layer, version, z, x, y = key
+        # Data tiles are cached under "<layer>.<dtype>" (see utils/data_tiles.py)
+        suffix = ".bin" if "." in layer else ".png"
+        return self.disk_dir / region / layer / version / str(z) / str(x) / f"{y}{suffix}"
+
+    @staticmethod
+    def _shared_key(key):
+        region, layer, version, z, x, y = key
+        return f"tiles/v{CACHE_FORMAT}/{region}/{layer}/{version}", f"{z}/{x}/{y}"
+
+    def peek(self, key):
+        """Memory-only lookup (never touches disk), safe to call on the event loop."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if self.shared is not None:
+            content = self.shared.get(*self._shared_key(key))
+            if content is not None:
+                entry = (content, make_etag(content))
+                self._put_memory(key, entry)
+                with self._lock:
+                    self.shared_hits += 1
+                return entry
+
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            try:
+                content = path.read_bytes()
+            except OSError:
+                content = None
+            if content is not None:
+                entry = (content, make_etag(content))
+                self._put_memory(key, entry)
+                with self._lock:
+                    self.disk_hits += 1
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, content: bytes):
+        entry = (content, make_etag(content))
+        self._put_memory(key, entry)
+
+        if self.shared is not None:
+            self.shared.put(*self._shared_key(key), content)
+
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with tempfile.NamedTemporaryFile(dir=path.parent, delete=False, suffix=".tmp") as tmp:
+                    tmp.write(content)
+                os.replace(tmp.name, path)
+            except OSError as e:
+                print(f"⚠️ Tile cache write failed: {e}")
+        return entry
+
+    def _put_memory(self, key, entry):
+        size = len(entry[0])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[0])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+            }
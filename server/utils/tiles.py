@@ -0,0 +1,177 @@
+import io
+import os
+import platform
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from PIL import Image
+
+from rio_tiler.errors import TileOutsideBounds
+
+from .cog_pool import get_reader_pool
+from .colour import colourise, get_lut
+from .data_tiles import DTYPES as DATA_TILE_DTYPES, encode_data_tile, empty_data_tile
+from .tile_archive import get_archive
+from .synthetic import SYNTHETIC_DATA, synthetic_tiff_paths
+from .metrics import timed
+
+# --- 1. CONFIGURATION: TIFF PATHS ---
+current_os = platform.system()
+
+if current_os == "Windows":
+    base_path_gr = Path("R:/SCADI/output/Sentinel1/Greenland/mosaic/subregions/lev/multiyear/20141011_20250826")
+    base_path_ant = Path("R:/SCADI/output/Sentinel1/Antarctica/mosaic/subregions/peninsula/multiyear/20141125_20250805")
+else:
+    base_path_gr = Path("/mnt/parscratch/users/gg1bjd/SCADI/output/Sentinel1/Greenland/mosaic/subregions/lev/multiyear/20141011_20250826")
+    base_path_ant = Path("/mnt/parscratch/users/gg1bjd/SCADI/output/Sentinel1/Antarctica/mosaic/subregions/peninsula/multiyear/20141125_20250805")
+
+if SYNTHETIC_DATA:
+    TIFF_PATHS = synthetic_tiff_paths(SYNTHETIC_DATA)
+else:
+    TIFF_PATHS = {
+        "Greenland": {
+            "speed": base_path_gr / "S_median_20141011_20250826_200m_timefiltered_cog.tif",
+            "count": base_path_gr / "perc_finite_px_20141011_20250826_200m_timefiltered_cog.tif",
+            "trend": base_path_gr.parent / "speed_linear_trend_20141017_20251224_200m_raw_smoothed_spatial3x3_sig_masked.tif"
+        },
+        "Antarctica": {
+            "speed": base_path_ant / "S_median_20141125_20250805_200m_timefiltered_cog.tif",
+            "count": base_path_ant / "perc_finite_px_20141125_20250805_200m_timefiltered_cog.tif",
+            "trend": base_path_ant.parent / "speed_linear_trend_20141201_20251227_200m_raw_smoothed_spatial3x3_sig_masked.tif"
+        }
+    }
+
+# --- 2. DYNAMIC PALETTE LOADING ---
+PALETTE_DIR = Path(__file__).resolve().parent.parent / "palettes"
+PALETTE_FILES = {
+    "Greenland": PALETTE_DIR / "Greenland_palette.txt",
+    "Antarctica": PALETTE_DIR / "Antarctica_palette.txt"
+}
+
+def load_custom_palette(path: Path):
+    """
+    Reads ALL lines from the text file. 
+    Returns numpy array of shape (N, 3).
+    """
+    if not path.exists():
+        print(f"⚠️ Palette not found: {path}")
+        return None
+
+    colors = []
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                parts = line.strip().split()
+                if len(parts) >= 3:
+                    try:
+                        r = int(float(parts[0]))
+                        g = int(float(parts[1]))
+                        b = int(float(parts[2]))
+                        colors.append([r, g, b])
+                    except ValueError:
+                        continue
+        
+        # Convert to numpy array (N rows, 3 columns)
+        palette_arr = np.array(colors, dtype=np.uint8)
+        print(f"✅ Loaded {len(palette_arr)} colors from {path.name}")
+        return palette_arr
+
+    except Exception as e:
+        print(f"❌ Error loading palette {path.name}: {e}")
+        return None
+
+# Load Palettes
+PALETTES = {}
+for region, path in PALETTE_FILES.items():
+    PALETTES[region] = load_custom_palette(path)
+
+def region_palette(region):
+    """The region's palette, falling back to Greenland's."""
+    palette = PALETTES.get(region)
+    if palette is None:
+        palette = PALETTES.get("Greenland")
+    return palette
+
+# --- 3. RENDERING ---
+COG_POOL_SIZE = int(os.getenv("SHIVER_COG_POOL_SIZE", "4")) # Open readers per layer
+
+_empty_buf = io.BytesIO()
+Image.new('RGBA', (256, 256), (0, 0, 0, 0)).save(_empty_buf, format="PNG")
+EMPTY_TILE_PNG = _empty_buf.getvalue()
+EMPTY_DATA_TILES = {dtype: empty_data_tile(dtype) for dtype in DATA_TILE_DTYPES}
+
+
+def warm_tile_readers():
+    """Builds every colour LUT and opens one reader per layer (pulling in its overviews)."""
+    for region, layers in TIFF_PATHS.items():
+        for layer_type, file_path in layers.items():
+            get_lut(region, layer_type, region_palette(region))
+            if not file_path.exists():
+                continue
+            try:
+                with get_reader_pool((region, layer_type), file_path, max_size=COG_POOL_SIZE).reader():
+                    pass
+            except Exception as e:
+                print(f"⚠️ Could not open {region}/{layer_type} tiles: {e}")
+
+
+def render_tile(region: str, layer_type: str, z: int, x: int, y: int, version: Optional[str] = None) -> bytes:
+    """
+    Renders one styled PNG tile from the layer's COG.
+    """
+    file_path = TIFF_PATHS[region][layer_type]
+    pool = get_reader_pool((region, layer_type), file_path, max_size=COG_POOL_SIZE)
+
+    with pool.reader(version) as cog:
+        try:
+            with timed("read"):
+                img = cog.tile(x, y, z)
+        except TileOutsideBounds:
+            return EMPTY_TILE_PNG
+
+    with timed("colour"):
+        data = img.data[0].astype('float32')
+
+        # Region palette, then one LUT lookup per pixel
+        rgba_image = colourise(region, layer_type, data, region_palette(region))
+
+    # Save
+    with timed("encode"):
+        pil_img = Image.fromarray(rgba_image)
+        buf = io.BytesIO()
+        pil_img.save(buf, format="PNG")
+
+    return buf.getvalue()
+
+
+def render_data_tile(region: str, layer_type: str, z: int, x: int, y: int, version: Optional[str] = None, dtype: str = "uint16") -> bytes:
+    """
+    Reads one tile of raw layer values from the COG, quantized and encoded
+    for client-side styling (see utils/data_tiles.py).
+    """
+    file_path = TIFF_PATHS[region][layer_type]
+    pool = get_reader_pool((region, layer_type), file_path, max_size=COG_POOL_SIZE)
+
+    with pool.reader(version) as cog:
+        try:
+            with timed("read"):
+                img = cog.tile(x, y, z)
+        except TileOutsideBounds:
+            return EMPTY_DATA_TILES[dtype]
+
+    with timed("encode"):
+        return encode_data_tile(img.data[0].astype('float32'), img.mask > 0, dtype)
+
+
+def archived_tile(region: str, layer_type: str, version: str, z: int, x: int, y: int) -> Optional[bytes]:
+    """
+    The tile from the layer's pre-rendered archive, or None if the archive is
+    missing, stale (built from another TIFF version) or doesn't cover zoom z.
+    Within the archived zooms, tiles the build skipped are outside the data.
+    """
+    archive = get_archive(region, layer_type)
+    if archive is None or not archive.covers(version, z):
+        return None
+    with timed("archive"):
+        content = archive.get(z, x, y)
+    return content if content is not None else EMPTY_TILE_PNG
@@ -0,0 +1,140 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from .shared_cache import SHARED_CACHE, CACHE_FORMAT
+
+
+def _result_size(entry):
+    """Bytes held by a site result's series arrays."""
+    series = entry.get("series") if isinstance(entry, dict) else None
+    if not series:
+        return 1
+    size = sum(series[k].nbytes for k in ("error", "dt", "count"))
+    for values in series["variables"].values():
+        size += sum(arr.nbytes for arr in values.values())
+    return size
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a per-entry time-to-live.
+
+    Bounded by the summed size of its entries, where sizeof(value) gives each
+    entry's size (default: 1, i.e. an entry count). Expired entries are dropped
+    when they are next looked up, or pushed out by the LRU.
+
+    With a shared backend (utils/shared_cache.py) entries are also written
+    there under namespace, and memory misses are looked up there, so other
+    worker processes' results are reused. Keys must have a stable repr().
+    """
+
+    def __init__(self, max_size, ttl, sizeof=None, shared=None, namespace=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof or (lambda value: 1)
+        self.shared = shared
+        self.namespace = namespace
+        self._entries = OrderedDict() # key -> (expires_at, size, value)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.shared_hits = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, size, value = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self._size -= size
+                self.expired += 1
+
+        if self.shared is not None:
+            value = self.shared.get_object(self.namespace, repr(key))
+            if value is not None:
+                self._put_memory(key, value)
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._put_memory(key, value)
+        if self.shared is not None:
+            self.shared.put_object(self.namespace, repr(key), value, ttl=self.ttl)
+
+    def _put_memory(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._size += size
+            while self._size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted[1]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size": self._size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+# Finished per-site results (daily series as arrays). Size is counted in bytes.
+TIMESERIES_CACHE = TTLCache(
+    max_size=int(os.getenv("SHIVER_TS_CACHE_MB", "128")) * 1024 * 1024,
+    ttl=float(os.getenv("SHIVER_TS_CACHE_TTL", "3600")),
+    sizeof=_result_size,
+    shared=SHARED_CACHE,
+    namespace=f"timeseries/v{CACHE_FORMAT}" # keys start with the raw handle, which covers the store version
+)
+
+# Raw per-date series (DataFrames) behind those results, kept so changing the
+# smoothing parameters doesn't re-read Zarr. Size is counted in bytes.
+RAW_SERIES_CACHE = TTLCache(
+    max_size=int(os.getenv("SHIVER_RAW_CACHE_MB", "256")) * 1024 * 1024,
+    ttl=float(os.getenv("SHIVER_RAW_CACHE_TTL", "3600")),
+    sizeof=lambda df: int(df.memory_usage(index=True).sum()),
+    shared=SHARED_CACHE,
+    namespace=f"raw_series/v{CACHE_FORMAT}"
+)
+
+# Rasterized polygon masks (pixel indices) per store and geometry, so a
+# re-clicked or re-uploaded outline skips buffering and rasterizing.
+MASK_CACHE = TTLCache(
+    max_size=int(os.getenv("SHIVER_MASK_CACHE_MB", "32")) * 1024 * 1024,
+    ttl=float(os.getenv("SHIVER_MASK_CACHE_TTL", "86400")),
+    sizeof=lambda plan: plan['iy'].nbytes + plan['ix'].nbytes
+)
@@ -0,0 +1,202 @@
+# File: web/tests/benchmarks/bench_interval_median.py
+# Compares the old per-pair pd.date_range loop (STEP 2 of _process_single_site)
+# with the vectorised interval-median engine, across increasing pair counts.
+#
+# Before timing, every generated case is checked against the old loop, kept
+# here verbatim as the reference (pd.testing.assert_series_equal on values,
+# index and dtype; not the name, which nothing reads). A mismatch stops the
+# run with an AssertionError.
+#
+#   python tests/benchmarks/bench_interval_median.py           # checks, then timings
+#   python tests/benchmarks/bench_interval_median.py --check   # checks only
+import sys
+import os
+import csv
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../../server"))
+from utils.interval_median import daily_interval_median, pair_day_bounds
+
+# CONFIGURATION
+PAIR_COUNTS = [100, 500, 1000, 2000, 5000, 10000]
+REPEATS = 3
+LOOP_MAX_PAIRS = 5000 # The old loop gets very slow beyond this
+CHECK_SEEDS = range(5)
+OUTPUT_FILE = os.path.join(os.path.dirname(__file__), "../results/interval_median_bench.csv")
+
+
+def make_pairs(n_pairs, seed=0, duplicates=0.0, same_day=0.0, nan_values=0.0, dtype="float64", hour=0):
+    """
+    Synthetic pixel: n_pairs Sentinel-1 style pairs. duplicates is the share
+    of pairs that repeat another pair's mid date (overlapping intervals, an
+    unsorted index), same_day the share with a zero separation (one-day
+    intervals), nan_values the share of missing speeds; hour shifts every
+    mid date off midnight.
+    """
+    rng = np.random.default_rng(seed)
+    span = max(3650, n_pairs * 2)
+    days = np.sort(rng.choice(span, n_pairs, replace=False))
+    n_dup = int(n_pairs * duplicates)
+    if n_dup:
+        days[rng.choice(n_pairs, n_dup, replace=False)] = rng.choice(days, n_dup)
+    index = pd.DatetimeIndex(pd.Timestamp("2015-01-01") + pd.to_timedelta(days, unit="D") + pd.Timedelta(hours=hour))
+    sep = rng.choice([6.0, 12.0, 18.0, 24.0, 36.0], len(index))
+    sep[rng.random(len(index)) < same_day] = 0.0
+    values = rng.normal(300, 30, len(index)).astype(dtype)
+    values[rng.random(len(index)) < nan_values] = np.nan
+    speed = pd.Series(values, index=index)
+    df = pd.DataFrame({"time_separation": sep}, index=index)
+    full_idx = pd.date_range(start=index.min(), end=index.max(), freq="D")
+    return df, speed, full_idx
+
+
+def legacy_loop(df, speed, full_idx):
+    """The old STEP 2 loop over a plain series of pair values."""
+    time_sep_days = pd.to_timedelta(df["time_separation"], unit="D")
+    starts = df.index - (time_sep_days / 2)
+    ends = df.index + (time_sep_days / 2)
+    daily_stack = []
+    for i in range(len(df)):
+        if pd.isna(speed.iloc[i]): continue
+        date_rng = pd.date_range(start=starts.iloc[i].floor("D"), end=ends.iloc[i].ceil("D"), freq="D")
+        if not date_rng.empty:
+            daily_stack.append(pd.DataFrame({"date": date_rng, "speed": speed.iloc[i]}))
+    if daily_stack:
+        return pd.concat(daily_stack).groupby("date")["speed"].median().reindex(full_idx)
+    return pd.Series(dtype=float, index=full_idx)
+
+
+def engine(df, speed, full_idx):
+    start_days, end_days = pair_day_bounds(df.index, df["time_separation"].values, full_idx)
+    return pd.Series(daily_interval_median(start_days, end_days, speed.values, len(full_idx)), index=full_idx)
+
+
+def legacy_step2(df, current_speed_series, processed_raw_series, full_idx):
+    """STEP 2 of _process_single_site before vectorisation, verbatim."""
+    time_sep_days = pd.to_timedelta(df['time_separation'], unit='D')
+    starts = df.index - (time_sep_days / 2)
+    ends   = df.index + (time_sep_days / 2)
+
+    daily_stack = []
+    for i in range(len(df)):
+        if pd.isna(current_speed_series.iloc[i]): continue
+
+        s_date = starts.iloc[i].floor('D')
+        e_date = ends.iloc[i].ceil('D')
+
+        # For the trend line generation, we use the smoothed point value if available
+        val_to_use = current_speed_series.iloc[i]
+        try:
+            if pd.notnull(processed_raw_series.loc[df.index[i]]):
+                val_to_use = processed_raw_series.loc[df.index[i]]
+        except: pass
+
+        date_rng = pd.date_range(start=s_date, end=e_date, freq='D')
+        if not date_rng.empty:
+            daily_stack.append(pd.DataFrame({'date': date_rng, 'speed': val_to_use}))
+
+    if daily_stack:
+        big_df = pd.concat(daily_stack)
+        daily_ts = big_df.groupby('date')['speed'].median()
+        daily_ts = daily_ts.reindex(full_idx)
+    else:
+        daily_ts = pd.Series(dtype=float, index=full_idx)
+    return daily_ts
+
+
+def engine_step2(df, current_speed_series, processed_raw_series, full_idx):
+    """STEP 2 of _smooth_raw_series as it is now."""
+    smoothed_vals = processed_raw_series.reindex(df.index).values
+    raw_vals = current_speed_series.values
+    use_smoothed = pd.notnull(smoothed_vals) & pd.notnull(raw_vals)
+    pair_dtype = np.result_type(smoothed_vals, raw_vals) if use_smoothed.any() else raw_vals.dtype
+    pair_vals = np.where(use_smoothed, smoothed_vals, raw_vals).astype(pair_dtype)
+
+    start_days, end_days = pair_day_bounds(df.index, df['time_separation'].values, full_idx)
+    return pd.Series(daily_interval_median(start_days, end_days, pair_vals, len(full_idx)), index=full_idx)
+
+
+def check():
+    """Asserts the engine matches the old loop on every generated case."""
+    kernel_cases = {
+        "plain": dict(),
+        "float32": dict(dtype="float32"),
+        "same_day": dict(same_day=0.3),
+        "duplicates": dict(duplicates=0.3),
+        "nan_values": dict(nan_values=0.3),
+        "all_nan": dict(nan_values=1.0),
+        "off_midnight": dict(hour=12),
+        "mixed": dict(duplicates=0.2, same_day=0.2, nan_values=0.2, dtype="float32"),
+    }
+    n_checked = 0
+    for case, options in kernel_cases.items():
+        for seed in CHECK_SEEDS:
+            for n in (1, 2, 7, 60):
+                df, speed, full_idx = make_pairs(n, seed, **options)
+                expected = legacy_loop(df, speed, full_idx)
+                pd.testing.assert_series_equal(engine(df, speed, full_idx), expected, check_freq=False, check_names=False, obj=f"{case}/{n}/{seed}")
+                n_checked += 1
+
+    # Full STEP 2: the pipeline hands it a sorted, de-duplicated index (see
+    # _prepare_raw_series) and a smoothed series on the daily axis, NaN off
+    # the observation dates and wherever smoothing didn't produce a value
+    step2_cases = {
+        "smoothed": dict(),
+        "float32": dict(dtype="float32"),
+        "same_day": dict(same_day=0.3, dtype="float32"),
+        "nan_values": dict(nan_values=0.3, dtype="float32"),
+        "all_nan": dict(nan_values=1.0, dtype="float32"),
+        "no_smoothed": dict(dtype="float32"),
+    }
+    for case, options in step2_cases.items():
+        for seed in CHECK_SEEDS:
+            for n in (1, 2, 7, 60):
+                df, speed, full_idx = make_pairs(n, seed, **options)
+                rng = np.random.default_rng(seed + 100)
+                smoothed = speed.astype("float64").reindex(full_idx) + rng.normal(0, 5, len(full_idx))
+                smoothed[rng.random(len(full_idx)) < 0.2] = np.nan
+                if case == "no_smoothed":
+                    smoothed[:] = np.nan
+                expected = legacy_step2(df, speed, smoothed, full_idx)
+                pd.testing.assert_series_equal(engine_step2(df, speed, smoothed, full_idx), expected, check_freq=False, check_names=False, obj=f"step2 {case}/{n}/{seed}")
+                n_checked += 1
+    print(f"✅ {n_checked} cases identical to the old loop")
+
+
+def best_of(func, *args):
+    best = float("inf")
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+if __name__ == "__main__":
+    check()
+    if "--check" in sys.argv[1:]:
+        sys.exit(0)
+
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    rows = []
+    print(f"{'pairs':>8} {'loop (ms)':>12} {'engine (ms)':>12} {'speedup':>9}  identical")
+    for n in PAIR_COUNTS:
+        df, speed, full_idx = make_pairs(n)
+        t_new, new = best_of(engine, df, speed, full_idx)
+        if n <= LOOP_MAX_PAIRS:
+            t_old, old = best_of(legacy_loop, df, speed, full_idx)
+            pd.testing.assert_series_equal(new, old, check_freq=False, check_names=False)
+            same = True
+            speedup = t_old / t_new
+        else:
+            t_old, same, speedup = float("nan"), None, float("nan")
+        print(f"{len(df):>8} {t_old * 1e3:>12.1f} {t_new * 1e3:>12.2f} {speedup:>8.0f}x  {same}")
+        rows.append([len(df), t_old * 1e3, t_new * 1e3, same])
+
+    with open(OUTPUT_FILE, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["pairs", "loop_ms", "engine_ms", "identical"])
+        writer.writerows(rows)
+    print(f"Saved to {os.path.abspath(OUTPUT_FILE)}")
@@ -0,0 +1,382 @@
+# File: web/tests/benchmarks/bench_suite.py
+# Micro-benchmarks for time-series extraction and tiling, run against the
+# synthetic stores and COGs from server/utils/synthetic.py (generated on first
+# use), so they can run anywhere, not just on the HPC mount.
+#
+#   python tests/benchmarks/bench_suite.py                      # small data, writes tests/results/bench_suite_<commit>_small.json
+#   python tests/benchmarks/bench_suite.py --size medium --only extract
+#   python tests/benchmarks/bench_suite.py --compare old.json new.json
+#   python tests/benchmarks/bench_suite.py --check              # equivalence checks only, exits non-zero on a mismatch
+#
+# Each result file records the commit, machine and data size plus min /
+# median / mean / stdev (ms) per benchmark, so runs can be compared between
+# commits. "cold" extraction clears the result, raw-series and mask caches
+# before every repeat; "warm" repeats the same request against them.
+import sys
+import os
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+SERVER_DIR = os.path.join(os.path.dirname(__file__), "../../server")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "../results")
+sys.path.insert(0, SERVER_DIR)
+
+# CONFIGURATION
+REPEATS = 5
+BATCH_SITES = 50
+TILE_ZOOMS = [7, 10]
+LARGE_RADIUS = 9000 # m, large-polygon case
+SLOWER_THRESHOLD = 1.2 # --compare flags medians that grew by more than this
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=SERVER_DIR).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--", "."], capture_output=True, text=True, cwd=SERVER_DIR).stdout.strip())
+        return commit or "unknown", dirty
+    except OSError:
+        return "unknown", False
+
+
+def timed(func, repeats, setup=None):
+    """Runs func once to warm up, then repeats times (setup before each, untimed). Returns ms per run."""
+    if setup: setup()
+    func()
+    times = []
+    for _ in range(repeats):
+        if setup: setup()
+        t0 = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - t0) * 1e3)
+    return times
+
+
+def summarise(times):
+    return {
+        "repeats": len(times),
+        "min_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+        "stdev_ms": round(statistics.stdev(times), 3) if len(times) > 1 else 0.0,
+    }
+
+
+def build_benchmarks():
+    """[(name, func, setup), ...] for the synthetic data set (imports the server modules)."""
+    import geopandas as gpd
+    from shapely.geometry import Point
+    from morecantile import tms as tile_matrix_sets
+    from fastapi.testclient import TestClient
+
+    import utils.extract_zarr_ts as ez
+    from utils.stores import get_store
+    from utils.synthetic import REGIONS
+    from utils.interval_median import daily_interval_median, pair_day_bounds
+    from utils.columnar import encode_columnar
+    from utils.ts_cache import TIMESERIES_CACHE, RAW_SERIES_CACHE, MASK_CACHE
+    from utils.tiles import TIFF_PATHS, render_tile, render_data_tile
+    import main
+
+    def clear_caches():
+        TIMESERIES_CACHE.clear()
+        RAW_SERIES_CACHE.clear()
+        MASK_CACHE.clear()
+
+    region = "Greenland"
+    lon, lat = REGIONS[region]["centre"]
+    grid = get_store(region).grid
+    to_lonlat = grid.transformer.transform
+    rng = np.random.default_rng(0)
+
+    # Sites in lon/lat, spread over the synthetic grid
+    def random_site():
+        px = rng.uniform(grid.x_min + 2000, grid.x_max - 2000)
+        py = rng.uniform(grid.y_min + 2000, grid.y_max - 2000)
+        return to_lonlat(px, py, direction="INVERSE")
+
+    batch = [[site_lat, site_lon] for site_lon, site_lat in (random_site() for _ in range(BATCH_SITES))]
+    # An elongated outline along the synthetic glacier trunk
+    centre = Point(grid.transformer.transform(lon, lat))
+    outline = centre.buffer(1).union(Point(centre.x + 4000, centre.y - 4000)).convex_hull.buffer(600)
+    polygon = gpd.GeoDataFrame({"name": ["Outline"]}, geometry=[outline], crs=grid.crs).to_crs("EPSG:4326")
+
+    # A wide disc for the native / overview (resolution='auto') comparison
+    large = gpd.GeoDataFrame({"name": ["Large"]}, geometry=[centre.buffer(LARGE_RADIUS)], crs=grid.crs).to_crs("EPSG:4326")
+
+    extraction_cases = {
+        "point": dict(location_input=[[lat, lon]], buffer=0),
+        "buffered_point": dict(location_input=[[lat, lon]], buffer=500),
+        "polygon": dict(location_input=polygon, buffer=0),
+        f"batch_{BATCH_SITES}": dict(location_input=batch, buffer=200),
+        "large_polygon.native": dict(location_input=large, buffer=0),
+        "large_polygon.auto": dict(location_input=large, buffer=0, resolution="auto"),
+    }
+
+    benchmarks = []
+    for case, kwargs in extraction_cases.items():
+        params = dict(kwargs, variables=["s", "u", "v"], quality=["filt"])
+        run = lambda params=params: ez.get_glacier_timeseries(**params)
+        benchmarks.append((f"extract.{case}.cold", run, clear_caches))
+        benchmarks.append((f"extract.{case}.warm", run, None))
+
+    # Smoothing stages on one buffered-point series
+    store = get_store(region)
+    target_keys = ["s_filt", "u_filt", "v_filt"]
+    proj = grid.project([Point(lon, lat)])[0]
+    plan = ez._plan_site(store, proj, 500)
+    frame = ez._read_windows(store, list(set(target_keys + ez.BASE_VARS)), target_keys[0], [(0, plan)])[0]
+    raw_df = ez._prepare_raw_series(frame.copy(), target_keys)
+    smoothing = dict(gap_fill=24, win_raw=25, win_daily=25, poly=2)
+    smoothed = ez._smooth_raw_series(raw_df, target_keys, **smoothing)
+    days = pd.date_range(smoothed["series"]["start"], periods=smoothed["series"]["n_days"], freq="D")
+
+    def interval_median():
+        start_days, end_days = pair_day_bounds(raw_df.index, raw_df["time_separation"].values, days)
+        daily_interval_median(start_days, end_days, raw_df["s_filt"].values, len(days))
+
+    benchmarks += [
+        ("stage.prepare_raw", lambda: ez._prepare_raw_series(frame.copy(), target_keys), None),
+        ("stage.smooth", lambda: ez._smooth_raw_series(raw_df, target_keys, **smoothing), None),
+        ("stage.interval_median", interval_median, None),
+        ("stage.to_json", lambda: ez._series_to_json(smoothed["series"]), None),
+        ("stage.to_columnar", lambda: encode_columnar({"site": smoothed}), None),
+    ]
+
+    # Tiles: a cold render (and raw data tile) per layer and zoom, and a warm (cached) request through the endpoint
+    client = TestClient(main.app)
+    web_mercator = tile_matrix_sets.get("WebMercatorQuad")
+    for tile_region, layers in TIFF_PATHS.items():
+        tile_lon, tile_lat = REGIONS[tile_region]["centre"]
+        for layer in layers:
+            for z in TILE_ZOOMS:
+                t = web_mercator.tile(tile_lon, tile_lat, z)
+                benchmarks.append((f"tile.render.{tile_region}.{layer}.z{z}", lambda r=tile_region, l=layer, t=t: render_tile(r, l, t.z, t.x, t.y), None))
+                benchmarks.append((f"tile.data.{tile_region}.{layer}.z{z}", lambda r=tile_region, l=layer, t=t: render_data_tile(r, l, t.z, t.x, t.y), None))
+            t = web_mercator.tile(tile_lon, tile_lat, TILE_ZOOMS[-1])
+            url = f"/api/tiles/{tile_region}/{layer}/{t.z}/{t.x}/{t.y}.png"
+            benchmarks.append((f"tile.endpoint.{tile_region}.{layer}.warm", lambda url=url: client.get(url), None))
+    return benchmarks
+
+
+def _check_store(tmp, variables):
+    """
+    A small synthetic store for the checks (24 x 30 pixels, 90 dates): odd
+    time chunks, so block budgets both split chunks and group several, 90%
+    gaps and two dates that are empty everywhere, so every window has dates
+    with no valid pixel at all.
+    """
+    import xarray as xr
+    from utils.synthetic import REGIONS, make_store
+    from utils.stores import StoreHandle
+
+    info = REGIONS["Greenland"]
+    path = os.path.join(tmp, "date_pair.zarr")
+    make_store(path, info['crs'], info['centre'], n_time=90, ny=24, nx=30, chunks=(17, 10, 12), nan_fraction=0.9, seed=3)
+    # A few dates with no data anywhere (one at a chunk start, one mid-chunk)
+    for t in (17, 50):
+        empty = {v: (('time', 'y', 'x'), np.full((1, 24, 30), np.nan, dtype='float32')) for v in variables}
+        xr.Dataset(empty).to_zarr(path, region={'time': slice(t, t + 1), 'y': slice(None), 'x': slice(None)})
+    return StoreHandle("Greenland", path, info['crs'])
+
+
+def check_spatial_median():
+    """
+    blockwise_spatial_median (and _read_windows routed through it) must give
+    exactly the one-pass median(dim=...) / count(dim=...), on _check_store.
+    """
+    import xarray as xr
+    import utils.extract_zarr_ts as ez
+    from utils.spatial_median import blockwise_spatial_median, selection_bytes, time_blocks
+
+    variables = ['s_filt', 'u_filt', 'v_raw']
+    rng = np.random.default_rng(0)
+    iy, ix = rng.integers(0, 24, 60), rng.integers(0, 30, 60)
+    cases = {
+        "window": ({'y': slice(3, 19), 'x': slice(5, 27)}, ['x', 'y']),
+        "edge_window": ({'y': slice(18, 24), 'x': slice(26, 30)}, ['x', 'y']),
+        "single_pixel": ({'y': slice(7, 8), 'x': slice(11, 12)}, ['x', 'y']),
+        "mask": ({'y': xr.DataArray(iy, dims='pixel'), 'x': xr.DataArray(ix, dims='pixel')}, ['pixel']),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = _check_store(tmp, variables)
+        chunk_edges = set(np.cumsum(store.source['s_filt'].chunks[0]).tolist())
+
+        for case, (indexers, dims) in cases.items():
+            subset = store.ds[variables].isel(**indexers)
+            expected = subset.median(dim=dims, keep_attrs=True).load()
+            expected_counts = subset.count(dim=dims).load()
+            assert bool(expected_counts['s_filt'].isin([0]).any()), f"{case}: no NaN-only dates to check"
+
+            n_pixels = int(np.prod([subset.sizes[d] for d in dims]))
+            per_step = selection_bytes(store.source, variables, n_pixels) // store.source.sizes['time']
+            for steps in (1, 5, 17, 40, 90):
+                blocks = time_blocks(store.source, variables, n_pixels, per_step * steps)
+                split = any(stop not in chunk_edges for _, stop in blocks[:-1])
+                for workers in (1, 3):
+                    medians, counts = blockwise_spatial_median(
+                        store.source, store.time_order, variables, variables, indexers, dims, per_step * steps, workers
+                    )
+                    xr.testing.assert_identical(medians, expected)
+                    xr.testing.assert_identical(counts, expected_counts)
+                print(f"   ✔ spatial_median.{case}: {steps} steps/block -> {len(blocks)} blocks{' (chunks split)' if split else ''}")
+
+        # Whole window read: the one-pass route against everything forced blockwise
+        plans = [(0, {'kind': 'window', 'ys': slice(3, 19), 'xs': slice(5, 27)}), (1, {'kind': 'mask', 'iy': iy, 'ix': ix})]
+        default = ez._read_windows(store, variables, 's_filt', plans)
+        saved = ez.MEDIAN_MEMORY_MB
+        ez.MEDIAN_MEMORY_MB = 1e-4
+        try:
+            blockwise = ez._read_windows(store, variables, 's_filt', plans)
+        finally:
+            ez.MEDIAN_MEMORY_MB = saved
+        for i in default:
+            pd.testing.assert_frame_equal(blockwise[i], default[i])
+        print("   ✔ spatial_median._read_windows: blockwise == one pass")
+
+
+def check_window_batch():
+    """
+    A batch of many windows and masks through _read_windows: whatever the
+    memory budget, each one-pass compute holds at most the budget's worth of
+    sites (larger sites go blockwise), and every site's frame is the one it
+    gets when read on its own.
+    """
+    import dask
+    import utils.extract_zarr_ts as ez
+    from utils.spatial_median import selection_bytes
+
+    variables = ['s_filt', 'u_filt', 'v_raw']
+    rng = np.random.default_rng(1)
+    plans = []
+    for i in range(40):
+        if i % 2:
+            n = int(rng.integers(1, 40))
+            plans.append((i, {'kind': 'mask', 'iy': rng.integers(0, 24, n), 'ix': rng.integers(0, 30, n)}))
+        else:
+            y0, x0 = int(rng.integers(0, 20)), int(rng.integers(0, 25))
+            h, w = int(rng.integers(1, 5)), int(rng.integers(1, 6))
+            plans.append((i, {'kind': 'window', 'ys': slice(y0, y0 + h), 'xs': slice(x0, x0 + w)}))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = _check_store(tmp, variables)
+        expected = {i: ez._read_windows(store, variables, 's_filt', [(i, plan)])[i] for i, plan in plans}
+        pixel_bytes = selection_bytes(store.ds, variables, 1)
+
+        saved = ez.MEDIAN_MEMORY_MB, ez.budget_groups, dask.compute
+        for budget_pixels in (10 ** 6, 100, 30, 10):
+            budget = pixel_bytes * budget_pixels
+            groupings, computes = [], []
+
+            def recording_groups(sizes, budget_bytes):
+                groups = saved[1](sizes, budget_bytes)
+                groupings.append((sizes, groups, budget_bytes))
+                return groups
+
+            def recording_compute(*args, **kwargs):
+                computes.append(len(args))
+                return saved[2](*args, **kwargs)
+
+            ez.MEDIAN_MEMORY_MB = budget / (1024 * 1024)
+            ez.budget_groups, dask.compute = recording_groups, recording_compute
+            try:
+                frames = ez._read_windows(store, variables, 's_filt', plans)
+            finally:
+                ez.MEDIAN_MEMORY_MB, ez.budget_groups, dask.compute = saved
+
+            (sizes, groups, budget_bytes), = groupings
+            assert sorted(p for group in groups for p in group) == list(range(len(sizes)))
+            for group in groups:
+                assert sum(sizes[p] for p in group) <= budget_bytes, f"group over budget at {budget_pixels} px"
+            assert computes == [len(group) for group in groups], "one compute per group"
+            for i, _ in plans:
+                pd.testing.assert_frame_equal(frames[i], expected[i])
+            n_blockwise = len(plans) - len(sizes)
+            print(f"   ✔ window_batch: budget {budget_pixels} px -> {len(groups)} passes, {n_blockwise} sites blockwise")
+        assert len(groups) > 1 and n_blockwise > 0, "smallest budget should split the batch and send sites blockwise"
+
+
+CHECKS = [check_spatial_median, check_window_batch]
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f: old = json.load(f)
+    with open(new_path) as f: new = json.load(f)
+    print(f"{old['commit']} ({old['size']}) -> {new['commit']} ({new['size']})")
+    print(f"{'benchmark':<48} {'old (ms)':>10} {'new (ms)':>10} {'ratio':>7}")
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            continue
+        before, after = old["results"][name]["median_ms"], result["median_ms"]
+        ratio = after / before if before else float("nan")
+        flag = "  slower" if ratio > SLOWER_THRESHOLD else ""
+        print(f"{name:<48} {before:>10.2f} {after:>10.2f} {ratio:>6.2f}x{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extraction and tiling micro-benchmarks on synthetic data.")
+    parser.add_argument("--size", default="small", help="Synthetic data size (small / medium / large)")
+    parser.add_argument("--data", default=None, help="Synthetic data directory (default: $SHIVER_SYNTHETIC_DATA or a temp dir per size)")
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--only", default=None, help="Only run benchmarks whose name contains this")
+    parser.add_argument("--out", default=None, help="Result file (default: tests/results/bench_suite_<commit>_<size>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files and exit")
+    parser.add_argument("--check", action="store_true", help="Run the equivalence checks and exit (non-zero on a mismatch)")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    if args.check:
+        for check in CHECKS:
+            print(f"🔎 {check.__name__}")
+            check()
+        print("✅ All checks passed")
+        sys.exit(0)
+
+    # Must be set before the server modules are imported
+    data_dir = args.data or os.getenv("SHIVER_SYNTHETIC_DATA") or os.path.join(tempfile.gettempdir(), f"shiver_synthetic_{args.size}")
+    os.environ["SHIVER_SYNTHETIC_DATA"] = data_dir
+    from utils.synthetic import SIZES, generate
+    generate(data_dir, args.size)
+    from utils.build_overviews import build_overview
+    from utils.stores import OVERVIEW_FACTORS
+    for factor in OVERVIEW_FACTORS:
+        build_overview("Greenland", factor)
+
+    commit, dirty = git_commit()
+    results = {}
+    benchmarks = build_benchmarks()
+    print(f"{'benchmark':<48} {'median (ms)':>12} {'min (ms)':>10}")
+    for name, func, setup in benchmarks:
+        if args.only and args.only not in name:
+            continue
+        results[name] = summarise(timed(func, args.repeats, setup))
+        print(f"{name:<48} {results[name]['median_ms']:>12.2f} {results[name]['min_ms']:>10.2f}")
+
+    report = {
+        "suite": "bench_suite",
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cpus": os.cpu_count(),
+        "size": args.size,
+        "data": SIZES[args.size],
+        "results": results,
+    }
+    out_path = args.out or os.path.join(RESULTS_DIR, f"bench_suite_{commit}_{args.size}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    with open(out_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved to {os.path.abspath(out_path)}")